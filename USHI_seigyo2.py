@@ -5,10 +5,20 @@ import time
 import csv
 import os
 import datetime
-import matplotlib.pyplot as plt
+import itertools
 import threading
-from matplotlib.animation import FuncAnimation
-from matplotlib.ticker import ScalarFormatter
+# matplotlib は読み込みに時間がかかるので、グラフを描くときに読み込む（入力待ちなしの計測では計測の後まで読み込まない）
+from serial_ingest import (BulkSerialReader, decode_ignoring_errors, parse_data_line, parse_data_lines, raw_to_weight,
+                           delay_to_rpm)
+from sample_store import SampleStore
+from async_writer import RecordWriter
+from binary_record import BinaryRecordWriter
+from online_stats import OnlineRunStatistics
+from clock_sync import ClockSync
+from step_index import StepIndexBuilder, parse_ack_delay
+from metrics import Metrics, MetricsExporter, SamplingProfiler
+from speed_schedule import (PROFILE_KINDS, SpeedScheduler, linear_profile, load_profile_table, log_profile,
+                            profile_duration)
 
 OUT_VOL=0.0007
 HX711_AVDD=4.2987
@@ -17,16 +27,101 @@ HX711_PGA=128
 
 HX711_SCALE=OUT_VOL * HX711_AVDD / LOAD *HX711_PGA
 HX711_ADC1bit=HX711_AVDD/16777216
+
+# 一括読み出しでこの行数より少なく届いたときは、process_response で1行ずつ処理する
+# （numpy でまとめて変換する手間は1回ごとに決まってかかるので、1行だけなら1行ずつのほうが速い。
+# 大きくしすぎると、高いレートで少しずつ読むときに1行ずつの処理から抜けられず受信が追いつかなくなる）
+MIN_BULK_LINES = 2
+
+
+def save_graph_image(save_path, timestamps_esp32, weights, speeds_rpm, dpi=300):
+    """
+    重量と速度の2軸グラフを画像として保存する。
+    pyplot を使わずに Figure を直接作るので、ウィンドウを開かず、GUIのバックエンドも読み込まない。
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax1 = fig.subplots()
+
+    color = 'tab:red'
+    ax1.set_xlabel('Timestamp')
+    ax1.set_ylabel('Weight', color=color)
+    ax1.plot(timestamps_esp32, weights, color=color)
+    ax1.tick_params(axis='y', labelcolor=color)
+
+    ax2 = ax1.twinx()
+    color = 'tab:blue'
+    ax2.set_ylabel('Speed (rpm)', color=color)
+    ax2.plot(timestamps_esp32, speeds_rpm, color=color)
+    ax2.tick_params(axis='y', labelcolor=color)
+
+    fig.savefig(save_path, format="png", dpi=dpi)
+    print("Graph image saved:", save_path)
+
+
+def iter_data_rows(current_ut, timestamps_esp32, weights, speed_delay, speeds_rpm):
+    """ 一括で解析した[data]行の配列から、データ用CSVの行を順に生成する """
+    yield from zip(itertools.repeat(current_ut), timestamps_esp32.tolist(), weights.tolist(),
+                   speed_delay.tolist(), speeds_rpm.tolist())
+
+
 class DataCollector:
-    def __init__(self, port='COM3', baudrate=115200, timeout=1):
-        self.ser = serial.Serial(port, baudrate, timeout=timeout)
-        time.sleep(1)
+    def __init__(self, port='COM3', baudrate=115200, timeout=1, ser=None, bulk_read=True,
+                 sample_capacity=2 ** 20, spill_evicted=False, live_view='decimated', live_window=None,
+                 console='status', sync='flush', binary_record=True, online_stats=True, clock_sync=True,
+                 metrics_export=False, metrics_port=None, profile_receive=False, read_batch_wait=0.0):
+        # serが渡された場合はそれを使う（esp32_simulator.SimulatedESP32などの疑似デバイス用）
+        self.ser = ser if ser is not None else serial.Serial(port, baudrate, timeout=timeout)
+        # Trueなら受信バッファをまとめて読み、[data]行を一括で解析する（Falseなら1行ずつreadline）
+        self.bulk_read = bulk_read
+        # 一括読み出しで行がたまるのを待つ最長の時間（秒）。0なら待たない
+        # （待つと1回の解析の手間は減るが、その分だけ受信の遅延が増える。serial_ingest.BulkSerialReader を参照）
+        self.read_batch_wait = read_batch_wait
+        if ser is None:
+            # ポートを開くとESP32がリセットされるので、起動するまで待つ（渡されたデバイスは待たない）
+            time.sleep(1)
         # シリアル通信の受信バッファをクリア
         self.ser.read_all()
         self.script_directory = os.path.dirname(__file__)
-        self.timestamps = []
-        self.weights = []
-        self.speeds = []
+        # グラフ描画用のサンプルは固定容量のリングバッファに保持する（受信スレッドが書き、グラフが読む）
+        self.sample_capacity = sample_capacity
+        # Trueなら容量を超えて追い出されたサンプルを _esp32_spill.bin に退避する
+        self.spill_evicted = spill_evicted
+        self.samples = SampleStore(sample_capacity)
+        # ライブグラフの描画方式（'decimated': 間引き＋blitting, 'full': 全点を毎回描画）と表示範囲（秒, Noneなら全体）
+        self.live_view = live_view
+        self.live_window = live_window
+        # CSVへの書き込みと端末表示は別スレッドの RecordWriter が行う（表示方式とflush/fsyncの方針）
+        self.console = console
+        self.sync = sync
+        self.record_writer = None
+        # TrueならCSVと並行して _esp32_data.bin（固定長レコードのバイナリ形式）にも記録する
+        self.binary_record = binary_record
+        self.binary_writer = None
+        # Trueなら速度段階ごとの重量の統計量と 重量 対 時間 の近似を計測中に計算する
+        self.run_stats = OnlineRunStatistics() if online_stats else None
+        # TrueならPCとESP32の時刻の対応を推定し、伝送遅延と取りこぼしを数える
+        self.clock_sync = ClockSync() if clock_sync else None
+        # 複数の装置を同時に計測するときの装置の名前（状態表示に付ける）
+        self.name = None
+        self.command_lock = threading.Lock()
+        # 速度の段階（configure で作る）と、それを締め切りどおりに切り替えるスケジューラ
+        self.profile = None
+        self.profile_kind = 'linear'
+        self.scheduler = None
+        # 速度の段階ごとのデータの行の範囲（_esp32_steps.csv。解析で段階ごとに切り出すのに使う）
+        self.step_index = StepIndexBuilder(clock=self.clock_sync)
+        # 受信の状態（行数、バイト数、壊れた行、キューの長さなど）のカウンタとタイマー
+        self.metrics = Metrics()
+        # Trueなら metrics を _esp32_metrics.json に定期的に書き出す。ポートを指定すると
+        # http://127.0.0.1:<ポート>/metrics で Prometheus 形式でも公開する
+        self.metrics_export = metrics_export
+        self.metrics_port = metrics_port
+        self.metrics_exporter = None
+        # Trueなら受信スレッドをサンプリングして、時間を使っている行を _esp32_profile.txt に書き出す
+        self.profile_receive = profile_receive
+        self.profiler = None
 
     def get_non_negative_integer_input(self, prompt):
         """ 0以上の整数値を入力させる """
@@ -53,6 +148,13 @@ class DataCollector:
         self.raw_csv_writer.writerow([0, f"final_rpm: {self.final_rpm}"])
         self.raw_csv_writer.writerow([0, f"planned_steps: {self.planned_steps}"])
         self.raw_csv_writer.writerow([0, f"operation_during: {self.operation_during}"])
+        self.raw_csv_writer.writerow([0, f"speed_profile: {self.profile_kind}"])
+        if self.name is not None:
+            # 複数の装置を同時に計測したとき、ファイル名の最後に付けた装置の名前（replay_raw でメモと分けるのに使う）
+            self.raw_csv_writer.writerow([0, f"rig: {self.name}"])
+        for step in self.profile:
+            self.raw_csv_writer.writerow([0, f"step {step.step}: rpm {step.rpm:g}, delay {step.motor_delay}, "
+                                             f"start {step.start_offset:g} s, duration {step.duration:g} s"])
 
     def create_csv_file(self, directory, file_name):
         """
@@ -76,91 +178,200 @@ class DataCollector:
         # csv.writerのインスタンスを返す
         return csv_writer, file_obj
 
+    def open_record_writer(self, file_objs):
+        """
+        受信した行をCSVに書き込むスレッドを開始する（raw_csv_writer / data_csv_writer を作った後に呼ぶ）。
+
+        Parameters:
+            file_objs (list): flush/fsync するCSVのファイルオブジェクト。
+        """
+        self.record_writer = RecordWriter(self.raw_csv_writer, self.data_csv_writer, file_objs,
+                                          binary_writer=self.binary_writer, sync=self.sync, console=self.console,
+                                          status_callback=self.status_text,
+                                          name=self.name, metrics=self.metrics).start()
+        return self.record_writer
+
+    def status_text(self):
+        """ 状態表示の1行に付け加える、計測中の統計量と遅延（書き込みスレッドから呼ばれる） """
+        texts = [monitor.status_text() for monitor in (self.run_stats, self.clock_sync) if monitor is not None]
+        return "  ".join(text for text in texts if text)
+
     def send_command(self, command):
-        self.ser.write(command.encode())
+        # 速度の切り替えは SpeedScheduler のスレッドから送られるので、書き込みが混ざらないようにする
+        with self.command_lock:
+            self.ser.write(command.encode())
 
     def set_motor_speed(self, count):
         """
-        モーターの速度を設定する関数
+        モーターの速度を設定する関数（SpeedScheduler のスレッドから呼ばれる）
         
         Parameters:
-            initial_rpm (int): 開始時のrpm。
-            one_step_increase (float): 1ステップごとの速度増加量。
-            count (int): 現在のステップ数。
+            count (int): 現在のステップ数（self.profile の添字）。
         
         Returns:
             int: モーターの遅延時間。
         """
-        rpm = self.initial_rpm + self.one_step_increase * count
-        motor_delay =round( 60 / (rpm * 200) * 1000000) if rpm != 0 else 0
-        self.send_command(f"set_speed {motor_delay}\n")
+        step = self.profile[count]
+        # 新しい速度の行が届く前に索引に載せておく
+        self.step_index.command(count, step.rpm, step.motor_delay, time.perf_counter())
+        self.send_command(f"set_speed {step.motor_delay}\n")
+        if self.run_stats is not None:
+            self.run_stats.start_step(count, step.rpm, step.motor_delay, time.perf_counter())
         
-        return motor_delay
+        return step.motor_delay
+
+    def stop_motor(self):
+        """ 最後の段階が終わったときにモーターを止める（SpeedScheduler のスレッドから呼ばれる） """
+        self.step_index.finish(time.perf_counter())
+        if self.run_stats is not None:
+            self.run_stats.finish(0)
+        self.send_command("set_speed 0\n")
     
     def process_response(self, current_ut, response):
         """
         ESP32からの応答を処理し、CSVファイルに書き込む関数
         """
         if response:
-            print("Response from ESP32:", response)
-            
-            # 全てのログ用のCSVファイルへの書き込み
-            self.raw_csv_writer.writerow([current_ut, response])
-            
             # データのみを抽出して書き込むCSVファイルへの書き込み
+            data_rows = []
+            binary_records = None
             if b"[data]" in response.encode('utf-8'):
-                data = response.split(',')
-                timestamp_esp32 = int(data[1])
-                weight = -int(data[2])*HX711_ADC1bit/HX711_SCALE-140
-                speed_delay = int(data[3])
-                speed_rpm = 60 / (speed_delay / 1000000 * 200) if speed_delay != 0 else 0
-                self.data_csv_writer.writerow([current_ut, timestamp_esp32, weight, speed_delay, speed_rpm])
-
-                self.timestamps.append(timestamp_esp32)
-                self.weights.append(weight)
-                self.speeds.append(speed_rpm)
-
-    def receive_and_process(self):
-        start_ut = time.perf_counter()
-        self.send_command("start_output\n")
-        self.send_command("set_speed 0\n")
-        for count in range(self.planned_steps + 1):
-            # 新しい速度を設定
-            self.set_motor_speed(count)
-
-            while True:
-                # ESP32からの応答を受信
-                # シリアル通信のラインにノイズが乗ったりすると変なバイト列が生成されてしまい、エンコードに失敗することがあるので、
-                # replaceもしくはignoreを使って回避すべき
-                response = self.ser.readline().decode('utf-8', 'ignore').rstrip()
-
-                self.current_ut = time.perf_counter()
-                elapsed_ut = self.current_ut - start_ut
+                # 一括で処理する process_lines（parse_data_lines）と同じ規則で解析する
+                record = parse_data_line(response)
+                if record is None:
+                    # ノイズで壊れた行はrawのCSVにだけ残して読み飛ばす
+                    self.metrics.inc('malformed_records_total')
+                else:
+                    timestamp_esp32, raw, speed_delay = record
+                    weight = -raw*HX711_ADC1bit/HX711_SCALE-140
+                    self.metrics.inc('data_records_total')
+                    speed_rpm = 60 / (speed_delay / 1000000 * 200) if speed_delay != 0 else 0
+                    data_rows = [[current_ut, timestamp_esp32, weight, speed_delay, speed_rpm]]
+                    binary_records = (current_ut, [timestamp_esp32], [raw], [speed_delay])
+                    self.samples.append(current_ut, timestamp_esp32, weight, speed_delay, speed_rpm)
+                    if self.run_stats is not None:
+                        self.run_stats.update([timestamp_esp32], [weight], [speed_delay])
+                    if self.clock_sync is not None:
+                        self.clock_sync.update(current_ut, [timestamp_esp32])
+                    self.step_index.update([timestamp_esp32], [speed_delay])
+            else:
+                ack_delay = parse_ack_delay(response)
+                if ack_delay is not None:
+                    self.step_index.acknowledge(current_ut, ack_delay)
 
-                # 応答をCSVファイルに保存し、グラフ描画用データを更新
-                self.process_response(self.current_ut, response)
+            # 全てのログ用のCSVファイルと、データ用のCSVファイルへの書き込みは RecordWriter のスレッドで行う
+            self.record_writer.put([[current_ut, response]], data_rows, binary_records)
 
-                if elapsed_ut > self.one_step_duration * (count + 1):
-                    break
+    def process_lines(self, current_ut, lines):
+        """
+        まとめて受信した複数の応答を処理し、CSVファイルに書き込む関数
+        （process_response の一括版。[data]行はnumpyでまとめて数値化する）
+        """
+        if len(lines) < MIN_BULK_LINES:
+            for line in lines:
+                self.process_response(current_ut, line)
+            return
+        raw_rows = [[current_ut, line] for line in lines]
+        # 速度の変更へのファームウェアの応答（"speed was set : <delay>"）を段階の索引に記録する
+        for line in lines:
+            ack_delay = parse_ack_delay(line)
+            if ack_delay is not None:
+                self.step_index.acknowledge(current_ut, ack_delay)
+
+        # データのみを抽出して書き込むCSVファイルへの書き込み
+        timestamps_esp32, raw, speed_delay, malformed = parse_data_lines(lines)
+        if malformed:
+            self.metrics.inc('malformed_records_total', malformed)
+        if timestamps_esp32.size == 0:
+            self.record_writer.put(raw_rows)
+            return
+        self.metrics.inc('data_records_total', timestamps_esp32.size)
+        weights = raw_to_weight(raw, HX711_ADC1bit, HX711_SCALE)
+        speeds_rpm = delay_to_rpm(speed_delay)
+        self.samples.append_many(current_ut, timestamps_esp32, weights, speed_delay, speeds_rpm)
+        if self.run_stats is not None:
+            self.run_stats.update(timestamps_esp32, weights, speed_delay)
+        if self.clock_sync is not None:
+            self.clock_sync.update(current_ut, timestamps_esp32)
+        self.step_index.update(timestamps_esp32, speed_delay)
+
+        # CSVの行への変換（tolist）も含めて RecordWriter のスレッドで行う
+        self.record_writer.put(raw_rows, iter_data_rows(current_ut, timestamps_esp32, weights, speed_delay, speeds_rpm),
+                               (current_ut, timestamps_esp32, raw, speed_delay))
+
+    def receive_and_process(self, start_ut=None, close_plot=True):
+        """
+        出力を開始し、速度を段階的に変えながら応答を受信・処理する（受信スレッドで実行する）。
 
-        
+        Parameters:
+            start_ut (float): 段階の時間を測る基準の time.perf_counter() の値。Noneなら呼び出した時刻。
+                複数の装置を同じ速度スケジュールで動かすときは共通の値を渡す。
+            close_plot (bool): Trueなら終了時にグラフウィンドウを閉じる。
+        """
+        start_ut = time.perf_counter() if start_ut is None else start_ut
+        reader = BulkSerialReader(self.ser, metrics=self.metrics, max_batch_wait=self.read_batch_wait)
+        if self.profile_receive:
+            self.profiler = SamplingProfiler(threading.get_ident()).start()
+        self.send_command("start_output\n")
         self.send_command("set_speed 0\n")
-        self.raw_csv_writer.writerow([time.perf_counter(), "Program finished succesfully."])
+
+        # 速度の切り替えは受信とは別のスレッドで、締め切りどおりに行う（読み出しが止まっても遅れない）
+        self.scheduler = SpeedScheduler(self.profile, self.set_motor_speed, self.stop_motor, start_ut).start()
+        while not self.scheduler.finished.is_set():
+            # ESP32からの応答を受信
+            # シリアル通信のラインにノイズが乗ったりすると変なバイト列が生成されてしまい、エンコードに失敗することがあるので、
+            # replaceもしくはignoreを使って回避すべき
+            if self.bulk_read:
+                lines = reader.read_lines()
+            else:
+                waiting = self.ser.in_waiting
+                line = self.ser.readline()
+                response = decode_ignoring_errors(line, self.metrics).rstrip()
+                self.metrics.set('serial_buffer_bytes', waiting)
+                self.metrics.inc('reads_total')
+                self.metrics.inc('bytes_total', len(line))
+                if response:
+                    self.metrics.inc('lines_total')
+
+            self.current_ut = time.perf_counter()
+
+            # 応答をCSVファイルに保存し、グラフ描画用データを更新
+            with self.metrics.time('process_batch_seconds'):
+                if self.bulk_read:
+                    self.process_lines(self.current_ut, lines)
+                else:
+                    self.process_response(self.current_ut, response)
+
+        # 切り替えた時刻を全てのログ用のCSVにも残す
+        self.record_writer.put([[d.dispatched, f"step {d.step} dispatched: rpm {d.rpm:g}, delay {d.motor_delay}, "
+                                               f"jitter {d.jitter * 1000:.3f} ms"] for d in self.scheduler.dispatches])
+        self.record_writer.put([[time.perf_counter(), "Program finished succesfully."]])
+        if self.profiler is not None:
+            self.profiler.stop()
         # print("Program finished successfully. Resuming when you close the graph window.")
-        print("正常に終了しました。グラフウィンドウを閉じると再開します。")
-        # すべてのグラフを削除
-        plt.close()
+        if close_plot:
+            print("正常に終了しました。グラフウィンドウを閉じると再開します。")
+            # すべてのグラフを削除
+            import matplotlib.pyplot as plt
+            plt.close()
+        else:
+            print("正常に終了しました。")
         
 
     def plot_graph(self):
         """
-        2軸グラフを描画する関数
-        
-        Parameters:
-            timestamps (list): タイムスタンプのリスト。
-            weights (list): 重量のリスト。
-            speeds (list): 速度のリスト。
+        2軸グラフを描画する関数（self.samples のスナップショットを100msごとに描画する）
         """
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
+        from matplotlib.ticker import ScalarFormatter
+        from live_view import LivePlot
+
+        if self.live_view == 'decimated':
+            # 画面の幅程度の点数に間引いて描画する（計測が長くなっても1フレームのコストが増えない）
+            LivePlot(self.samples, window=self.live_window, metrics=self.metrics).show()
+            return
+
         fig, ax1 = plt.subplots()
 
         color = 'tab:red'
@@ -177,10 +388,10 @@ class DataCollector:
         ax2.tick_params(axis='y', labelcolor=color)
 
         def update(frame):
-            line1.set_data(self.timestamps, self.weights)
-            line2.set_data(self.timestamps, self.speeds)
-            line1.set_data(self.timestamps, self.weights)
-            line2.set_data(self.timestamps, self.speeds)
+            # 3列の長さがそろったコピーを受け取る
+            snapshot = self.samples.snapshot()
+            line1.set_data(snapshot.timestamp, snapshot.weight)
+            line2.set_data(snapshot.timestamp, snapshot.speed)
             ax1.relim()
             ax2.relim()
             ax1.autoscale_view()
@@ -193,36 +404,49 @@ class DataCollector:
     def plot_graph_and_save(self, save_path, dpi=300):
         """
         2軸グラフを描画して保存するメソッド
-        
+
+        リングバッファ（self.samples）は最新の sample_capacity 点しか持たないので、計測全体を描くために
+        記録したデータファイル（_esp32_data.bin があればそれを memmap で、なければ _esp32_data.csv）から読み直す。
+        close_outputs の後に呼ぶ。データファイルを読めない場合だけリングバッファの内容を描く。
+
         Parameters:
             save_path (str): 保存先のファイルパス。
         """
-        fig, ax1 = plt.subplots()
+        import contextlib
+        import io
 
-        color = 'tab:red'
-        ax1.set_xlabel('Timestamp')
-        ax1.set_ylabel('Weight', color=color)
-        line1, = ax1.plot(self.timestamps, self.weights, color=color)
-        ax1.tick_params(axis='y', labelcolor=color)
+        import display_approximation_exponential as analysis
 
-        ax2 = ax1.twinx()  
-        color = 'tab:blue'
-        ax2.set_ylabel('Speed (rpm)', color=color)
-        line2, = ax2.plot(self.timestamps, self.speeds, color=color)
-        ax2.tick_params(axis='y', labelcolor=color)
-
-        plt.savefig(save_path, format="png", dpi=dpi)
-        print("Graph image saved:", save_path)
-
-    def start(self):
-        self.start_ut = 0
-        self.current_ut = 0
-        self.elapsed_ut = 0
-
-        self.initial_rpm = self.get_non_negative_integer_input("開始時のrpmを入力してください: ")
-        self.final_rpm = self.get_non_negative_integer_input("終了時のrpmを入力してください: ")
-        self.planned_steps = self.get_non_negative_integer_input("途中で何回速度を変更しますか？: ")
-        self.operation_during = self.get_non_negative_integer_input("何秒間実行しますか？: ")
+        loaded = None
+        prefix = os.path.join(self.directory_name, self.file_prefix)
+        for data_path in (f'{prefix}_esp32_data.bin', f'{prefix}_esp32_data.csv'):
+            if not os.path.exists(data_path):
+                continue
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    loaded = analysis.load_data_arrays(data_path)
+            except Exception as e:
+                print(f"グラフ用にデータファイルを読めませんでした: {data_path}: {e}")
+                continue
+            break
+        if loaded is None:
+            snapshot = self.samples.snapshot()
+            loaded = (snapshot.timestamp, snapshot.weight, snapshot.speed)
+        save_graph_image(save_path, *loaded, dpi=dpi)
+
+    def prompt_settings(self):
+        """ 計測の設定（速度・段階数・時間・メモ）を入力させて configure する """
+        while True:
+            initial_rpm = self.get_non_negative_integer_input("開始時のrpmを入力してください: ")
+            final_rpm = self.get_non_negative_integer_input("終了時のrpmを入力してください: ")
+            planned_steps = self.get_non_negative_integer_input("途中で何回速度を変更しますか？: ")
+            operation_during = self.get_non_negative_integer_input("何秒間実行しますか？: ")
+            profile_kind, profile_table = self.get_profile_kind_input()
+            # 対数で等間隔にする場合は 0rpm を使えない（log_profile が ValueError になる）
+            if profile_kind == 'log' and (initial_rpm <= 0 or final_rpm <= 0):
+                print("対数で速度を変える場合、開始時と終了時のrpmは0より大きくしてください。再度入力してください。")
+                continue
+            break
 
         # 顔文字のリスト
         faces = ['(⊙ω⊙)', '(ノ◕ヮ◕)ノ⋇:・ﾟ✧', '(⁄◕ヮ◕)⁄', '(◠‿◠✿)', '(ノ^∇^)', '(˶‾᷄ ⁻̫ ‾᷅˵)', '(^◡^ )', '(✿｡✿)', '(◡‿◡❀)', '(´｡• ᵕ •｡`)', '♪(๑ᴖ◡ᴖ๑)♪', '(≧◡≦)', '(⁄  ⁄^-^(^ ^⋇)⁄', '( ̄▽ ̄)ノ', '(⋇˘︶˘⋇).｡⋇♡', '（＾ｖ＾）', '(✧ω✧)', '(◡‿◡✿)', '( ´ ∀ ` )', '（⋇＾3＾）⁄～♡', '(⋇´▽`⋇)', '(⋇≧▽≦)', '(￣3￣)♡', '(°▽°)', '(●´ω｀●)', '٩(ó｡ò۶ ♡)))♬', 'ヽ(⟩∀⟨☆)ノ', '（⋇＾3＾)⁄～☆', '(o^▽^o)', '(๑˃̵ᴗ˂̵)و', '(｡◕‿◕｡)', '＼(￣▽￣)／', '(≧▽≦)', '╰(°▽°)╯', '(≧ω≦)', '(⋇⌒∇⌒⋇)', '(⋇⟩ω⟨)', '(⊙o⊙)', '(●´⌓`●)', '(⋇°∀°)=3', '(⋇ ˘ ³˘)zZ♡', '(✿ ♥‿♥)', '(˘▽˘⟩ԅ( ˘⌣˘)', '(¬‿¬)', '(⊙_◎)', '(⌐■_■)', '(╹◡╹)', 'ヽ(⋇⌒▽⌒⋇)ﾉ', '(◠‿◠)', '（  ̆ 3 ̆)♡', 'ヽ(＾Д＾)ﾉ', '(◕‿◕✿)', '(⁄ ⁄•⁄ω⁄•⁄ ⁄)', 'ಥ‿ಥ', '(つ✧ω✧)つ', '(｡^‿^｡)', '(๑⟩ᴗ⟨๑)', '(●•̀ㅂ•́)و✧', '(◕‿◕)♡', '( ˘ ³˘)♥', '(•ө•)♡', '(⋇≧ω≦)', '(｡♥‿♥｡)', '( ̄▽ ̄)σ', '(♡ ⟩ω⟨ ♡)', '(⋇^▽^⋇)', '(´ ▽ ` )', '(´｡• ω •｡`)', '(╯✧▽✧)╯', '⁽⁽ଘ( ˊᵕˋ )ଓ⁾⁾', '(⁄• •∖∖)', '(◕‿◕)', '(´ ´｡• ω •｡`) ♡', '(⑅˃◡˂⑅)', '｡^‿^｡', '(▰˘◡˘▰)', '(★^O^★)', '(✪‿✪)ノ', '(￣▽￣)ノ', '(´• ω •`)', '╰( ･ ᗜ ･ )╯', '(°◡°♡).｡', '(⊙ヮ⊙)', '(⺣◡⺣)♡⋇', '(●´ϖ`●)', '(⋇¯︶¯⋇)', '(´∩｡• ᵕ •｡∩`)', '(o˘◡˘o)', '(｡･ω･｡)', '(⁄ ⁄⟩⁄ ▽ ⁄⟨⁄ ⁄)', '(☆▽☆)', 'ʕっ•ᴥ•ʔっ', '(･ω･)ﾉ', '(ღ˘⌣˘ღ)', '(っ˘ڡ˘ς)', '（⋇＾3＾）⁄～☆', '（⌒▽⌒）', '(♡°▽°♡)', '(⊙︿⊙)', '(◡ ω ◡)', '(─‿─)', '(⌒‿⌒)', '(⋇°▽°⋇)', '(^▽^)', '♡＾▽＾♡', '(∩˃o˂∩)♡', '(✯◡✯❁)', '(￣3￣)', '(≡^∇^≡)', '(◠︿◠✿)', '(ᗒᗨᗕ)', '(♥ω♥⋇)', '(◜▿‾ ≡‾▿◝)', '（＾ω＾）', '(◠ω◕)', 'ʕ•́ᴥ•̀ʔっ', '(´• ω •`)ﾉ♡', 'o(〃＾▽＾〃)o', '(⋇ ⟩ω⟨)', '˚₊· ͟͟͞͞➳❥', '(ノ◕ヮ◕)ノ', '(ﾉ⋇⟩∀⟨)     )ﾉ♡', '(´•  ̫ •ू`)', '(◕ᴗ◕✿)', '( ´ ▽ ` )ﾉ', '(✿◕‿◕)', '✧･ﾟ： ⋇✧･ﾟ：⋇', '(´｡• ᵕ •｡`) ♡', '( ´ ▽ ` )', '(ﾉ◕ヮ◕)ﾉ⋇：･ﾟ✧', '(✯◡✯)', '＼(＾▽＾)／', '(⊙_☉)', '(•‿•)', '(˘⌣˘)♡(˘⌣˘)', '˚₊·͟͟͟͟͟͟͞͞͞͞͞͞➳❥', '(ɔˆ ³(ˆ⌣ˆc)', '(∩^o^)⊃━☆ﾟ.⋇･｡ﾟ', 'ლ(́◉◞౪◟◉‵ლ)', '✩°｡⋆⸜(⋇ ॑꒳ ॑⋇ )⸝', '(ʃƪ˘･ᴗ･˘)', '（⋇＾3＾)⁄～♡', '(              (•‾⌣‾•)و ̑̑♡', "。.：☆⋇：･'(⋇⌒―⌒⋇)))", '(˘⌣˘ )♡(˘⌣˘ )', '(✿◠‿◠)', '(^∇^)', '(¬‿¬ )', '☆.｡.：⋇･ﾟ☆.｡.：⋇･ﾟ', '(＾▽＾)', '✧⋇。٩(ˊᗜˋ⋇)و✧⋇。', '(^ε^)♪', '(｡•̀  ᴗ-)✧', '(☞ﾟ∀ﾟ)☞']
@@ -230,30 +454,199 @@ class DataCollector:
 
         # ランダムに選択された顔文字を表示
         memory_helper = random.choice(faces)
-        self.memoname = input("覚えるときのメモを入力してください（空欄可）: ")
+        memoname = input("覚えるときのメモを入力してください（空欄可）: ")
 
-        self.memoname = self.memoname if self.memoname != "" else memory_helper
+        memoname = memoname if memoname != "" else memory_helper
 
-        print(self.memoname)
+        print(memoname)
         input("メモはこれです。Enterで始めますよ。よろしいですね？")
+        self.configure(initial_rpm, final_rpm, planned_steps, operation_during, memoname,
+                       profile_kind=profile_kind, profile_table=profile_table)
+
+    def get_profile_kind_input(self):
+        """ 速度の変え方を選ばせる。表を選んだ場合はそのCSVのパスも入力させる """
+        while True:
+            choice = input("速度の変え方を選んでください (1: 等間隔 [既定], 2: 対数で等間隔, 3: 表ファイル): ").strip()
+            if choice in ("", "1"):
+                return 'linear', None
+            if choice == "2":
+                return 'log', None
+            if choice == "3":
+                path = input("速度の表のCSV（1列目: rpm, 2列目: 秒）のパスを入力してください: ").strip().strip('"')
+                try:
+                    return 'table', load_profile_table(path)
+                except (OSError, ValueError) as e:
+                    print(e)
+                    continue
+            print("無効な選択です。もう一度試してください。")
+
+    def configure(self, initial_rpm, final_rpm, planned_steps, operation_during, memoname, profile_kind='linear',
+                  profile_table=None):
+        """
+        計測の設定を行う（prompt_settings を使わずに、プログラムから設定する場合にも使う）。
+
+        Parameters:
+            profile_kind (str): 速度の変え方。'linear'（等間隔）, 'log'（対数で等間隔）, 'table'（表）。
+            profile_table (list): profile_kind='table' のときの SpeedStep のリスト（speed_schedule.table_profile
+                または load_profile_table で作る）。このとき initial_rpm などは表から決める。
+        """
+        if profile_kind not in PROFILE_KINDS:
+            raise ValueError(f"profile_kind は {PROFILE_KINDS} のいずれかです: {profile_kind}")
+        if profile_kind == 'table':
+            profile = list(profile_table)
+            initial_rpm, final_rpm = profile[0].rpm, profile[-1].rpm
+            planned_steps = len(profile) - 1
+            operation_during = profile_duration(profile)
+        elif profile_kind == 'log':
+            profile = log_profile(initial_rpm, final_rpm, planned_steps, operation_during)
+        else:
+            profile = linear_profile(initial_rpm, final_rpm, planned_steps, operation_during)
+        self.profile = profile
+        self.profile_kind = profile_kind
+        self.start_ut = 0
+        self.current_ut = 0
+        self.elapsed_ut = 0
+        self.initial_rpm = initial_rpm
+        self.final_rpm = final_rpm
+        self.planned_steps = planned_steps
+        self.operation_during = operation_during
+        self.memoname = memoname
+        self.one_step_duration = (self.operation_during) / (self.planned_steps + 1)
+        self.one_step_increase = (self.final_rpm - self.initial_rpm) / self.planned_steps if self.planned_steps != 0 else 0
+
+    def open_outputs(self, directory_name, file_prefix):
+        """
+        記録用のファイルを作り、設定を記録して、CSVへの書き込みスレッドを始める。
+
+        Parameters:
+            directory_name (str): 保存先のディレクトリ。
+            file_prefix (str): ファイル名の先頭（'<日時>_<メモ>'。これに '_esp32_raw.csv' などを付ける）。
+        """
+        self.directory_name = directory_name
+        self.file_prefix = file_prefix
+        # 同じ接続で続けて計測する場合に備えて、計測ごとの状態を新しくする
+        self.reset_run_state()
 
         # 記録・デバッグ用のCSVファイル
-        directory_name = os.path.join(self.script_directory, "data")
-        file_name = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{self.memoname}_esp32_raw.csv'
-        self.raw_csv_writer, file_obj_raw = self.create_csv_file(directory_name, file_name)
+        self.raw_csv_writer, file_obj_raw = self.create_csv_file(directory_name, f'{file_prefix}_esp32_raw.csv')
 
         self.raw_csv_writer.writerow(['Timestamp', 'log and response'])
 
         # データ用のCSVファイル
-        file_name = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{self.memoname}_esp32_data.csv'
-        self.data_csv_writer, file_obj_data = self.create_csv_file(directory_name, file_name)
+        self.data_csv_writer, file_obj_data = self.create_csv_file(directory_name, f'{file_prefix}_esp32_data.csv')
         self.data_csv_writer.writerow(['Timestamp(python)','Timestamp(ESP32)','weight' ,'speed(delay)','speed(rpm)'])
+        self.file_objs = [file_obj_raw, file_obj_data]
+
+        # データ用のバイナリファイル（計測設定と校正値をヘッダに持つ）
+        if self.binary_record:
+            self.binary_writer = BinaryRecordWriter(
+                os.path.join(directory_name, f'{file_prefix}_esp32_data.bin'),
+                settings={'initial_rpm': self.initial_rpm, 'final_rpm': self.final_rpm, 'planned_steps': self.planned_steps,
+                          'operation_during': self.operation_during, 'memoname': self.memoname,
+                          'speed_profile': self.profile_kind,
+                          'steps': [[step.rpm, step.motor_delay, step.start_offset, step.duration] for step in self.profile]},
+                calibration={'adc1bit': HX711_ADC1bit, 'scale': HX711_SCALE, 'offset': 140})
+
+        # グラフ用のリングバッファ（追い出されたサンプルを退避する場合はその退避ファイルも）
+        spill_path = os.path.join(directory_name, f'{file_prefix}_esp32_spill.bin') if self.spill_evicted else None
+        self.samples = SampleStore(self.sample_capacity, spill_path=spill_path)
 
         # 設定を表示・記録する
         self.show_and_save_settings()
 
-        self.one_step_duration = (self.operation_during) / (self.planned_steps + 1)
-        self.one_step_increase = (self.final_rpm - self.initial_rpm) / self.planned_steps if self.planned_steps != 0 else 0
+        # CSVへの書き込みを別スレッドで始める
+        self.open_record_writer(self.file_objs)
+
+        # 受信の状態の書き出し・公開を始める
+        if self.metrics_export or self.metrics_port is not None:
+            json_path = os.path.join(directory_name, f'{file_prefix}_esp32_metrics.json') if self.metrics_export else None
+            self.metrics_exporter = MetricsExporter(self.metrics, json_path=json_path, port=self.metrics_port,
+                                                    extra=self.metrics_extra).start()
+
+    def metrics_extra(self):
+        """ _esp32_metrics.json に metrics と一緒に書き出す、計測の名前と書き込みの状況 """
+        extra = {'run': self.file_prefix, 'name': self.name}
+        if self.record_writer is not None:
+            extra['writer'] = {'raw_rows_written': self.record_writer.raw_rows_written,
+                               'data_rows_written': self.record_writer.data_rows_written,
+                               'max_queue_depth': self.record_writer.max_queue_depth}
+        return extra
+
+    def reset_run_state(self):
+        """ 計測ごとの状態（書き込み先、統計量、スケジューラ）を初期状態に戻す """
+        self.record_writer = None
+        self.binary_writer = None
+        self.scheduler = None
+        self.metrics = Metrics()
+        self.metrics_exporter = None
+        self.profiler = None
+        if self.run_stats is not None:
+            self.run_stats = OnlineRunStatistics()
+        if self.clock_sync is not None:
+            self.clock_sync = ClockSync()
+        self.step_index = StepIndexBuilder(clock=self.clock_sync)
+
+    def close_outputs(self, close_port=True):
+        """
+        計測の終了処理（出力の停止、ファイルとシリアルポートを閉じる、統計量の表示と保存）
+
+        Parameters:
+            close_port (bool): Falseならシリアルポートを開いたままにする（同じ接続で続けて計測する場合）。
+        """
+        self.send_command("stop_output\n")
+        if self.profiler is not None and self.profiler.thread.is_alive():
+            self.profiler.stop()
+        try:
+            # 書き込みスレッドが例外で止まっていたらここで投げ直される（ファイルとポートは閉じる）
+            self.record_writer.close()
+        finally:
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.close()
+            for file_obj in self.file_objs:
+                file_obj.close()
+            if self.binary_writer is not None:
+                self.binary_writer.close()
+            self.samples.close()
+            if close_port:
+                self.ser.close()
+        if close_port:
+            print("csv file saved. serial port closed.")
+        else:
+            print("csv file saved.")
+
+        # 速度を切り替えた時刻とジッタの表示と保存
+        if self.scheduler is not None:
+            max_jitter, mean_jitter = self.scheduler.jitter_summary()
+            print(f"速度切り替えの遅れ: 最大 {max_jitter * 1000:.3f} ms, 平均 {mean_jitter * 1000:.3f} ms")
+            self.scheduler.write_csv(os.path.join(self.directory_name, f'{self.file_prefix}_esp32_schedule.csv'))
+
+        # 速度の段階ごとのデータの行の範囲（解析で段階ごとに切り出す）
+        self.step_index.write_csv(os.path.join(self.directory_name, f'{self.file_prefix}_esp32_steps.csv'))
+
+        # PCとESP32の時刻の対応・遅延・取りこぼしの表示と保存
+        if self.clock_sync is not None:
+            self.clock_sync.print_summary()
+            self.clock_sync.write_csv(os.path.join(self.directory_name, f'{self.file_prefix}_esp32_clock.csv'))
+
+        # 速度段階ごとの統計量（計測中に計算したもの）の表示と保存
+        if self.run_stats is not None:
+            self.run_stats.print_summary()
+            self.run_stats.write_csv(os.path.join(self.directory_name, f'{self.file_prefix}_esp32_step_stats.csv'))
+
+        # 受信スレッドのプロファイルの表示と保存
+        if self.profiler is not None:
+            report = self.profiler.report()
+            print(report)
+            with open(os.path.join(self.directory_name, f'{self.file_prefix}_esp32_profile.txt'), 'w',
+                      encoding='utf-8') as file_obj:
+                file_obj.write(report + "\n")
+
+    def start(self):
+        self.prompt_settings()
+
+        directory_name = os.path.join(self.script_directory, "data")
+        file_prefix = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{self.memoname}'
+        self.open_outputs(directory_name, file_prefix)
 
         # マイコンとの通信を別スレッドで始める
         reveiver_thread = threading.Thread(target=self.receive_and_process)
@@ -267,17 +660,36 @@ class DataCollector:
             reveiver_thread.join()
 
         # プログラム終了時の共通処理
-        self.send_command("stop_output\n")
-        file_obj_raw.close()
-        file_obj_data.close()
-        self.ser.close()
-        print("csv file saved. serial port closed.")
-        
+        self.close_outputs()
+
         # グラフの描画と保存
-        file_name = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{self.memoname}_graph_image.png'
-        save_path = os.path.join(directory_name, file_name)
+        save_path = os.path.join(directory_name, f'{file_prefix}_graph_image.png')
         self.plot_graph_and_save(save_path, dpi=300)
-        
+
+    def run_headless(self, directory_name, file_prefix, close_port=True, save_image=True):
+        """
+        設定済み（configure 済み）の計測を、入力待ちやグラフウィンドウなしで最後まで行う。
+
+        Parameters:
+            directory_name (str): 保存先のディレクトリ。
+            file_prefix (str): ファイル名の先頭。
+            close_port (bool): Falseなら終了後もシリアルポートを開いたままにする（次の計測に使う）。
+            save_image (bool): Falseなら終了後にグラフの画像を作らない（後から acquire_headless.py --render で作れる）。
+        """
+        # 前の計測の後に届いた行を捨ててから始める
+        self.ser.reset_input_buffer()
+        self.open_outputs(directory_name, file_prefix)
+        try:
+            self.receive_and_process(close_plot=False)
+        finally:
+            if self.scheduler is not None and not self.scheduler.finished.is_set():
+                self.scheduler.stop()
+                self.send_command("set_speed 0\n")
+            self.close_outputs(close_port=close_port)
+
+        if save_image:
+            save_path = os.path.join(directory_name, f'{file_prefix}_graph_image.png')
+            self.plot_graph_and_save(save_path, dpi=300)
 
 
 def select_com_port():
@@ -0,0 +1,108 @@
+"""
+入力待ちやグラフウィンドウなしで1回の計測を行う、起動の軽いスクリプト。
+
+matplotlib・pandas・scipy は読み込まないので、起動してからすぐにシリアルの読み出しを始められる。
+グラフの画像は計測とポートの終了処理の後に作る（matplotlib はそのときに読み込む）。
+--no-image で画像を作らずに終わり、後から --render でまとめて作ることもできる。
+
+使い方:
+    python acquire_headless.py 10 100 5 60 --memo test --port COM3
+    python acquire_headless.py 10 100 5 60 --profile log --simulate --no-image
+    python acquire_headless.py --render data      # 画像のない計測データの画像を作る
+"""
+import argparse
+import datetime
+import os
+
+from USHI_seigyo2 import DataCollector, save_graph_image, select_com_port
+from speed_schedule import PROFILE_KINDS, linear_profile, load_profile_table, log_profile
+
+
+def render_missing_images(data_directory, dpi=300):
+    """
+    data_directory 以下の計測データのうち、グラフの画像（_graph_image.png）がないものの画像を作る。
+
+    Returns:
+        list: 作った画像のパスのリスト。
+    """
+    import contextlib
+    import io
+
+    import display_approximation_exponential as analysis
+    from batch_analysis import discover_runs
+
+    saved = []
+    for path in discover_runs(data_directory):
+        prefix = path[:-len('_esp32_data.bin')]  # '_esp32_data.csv' も同じ長さ
+        save_path = f'{prefix}_graph_image.png'
+        if os.path.exists(save_path):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            loaded = analysis.load_data_arrays(path)
+        if loaded is None:
+            print(f"有効なデータがないので画像を作りません: {path}")
+            continue
+        save_graph_image(save_path, *loaded, dpi=dpi)
+        saved.append(save_path)
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入力待ちやグラフウィンドウなしで1回の計測を行う")
+    parser.add_argument('settings', nargs='*', type=int,
+                        help="initial_rpm final_rpm planned_steps operation_during（--profile に表を指定したときは不要）")
+    parser.add_argument('--memo', default='headless', help="ファイル名に付けるメモ")
+    parser.add_argument('--profile', default='linear',
+                        help="速度の変え方。'linear', 'log', または速度の表のCSV（1列目: rpm, 2列目: 秒）のパス")
+    parser.add_argument('--port', default=None, help="使用するCOMポート（省略すると一覧から選ぶ）")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--data-dir', default=None, help="保存先（既定: このスクリプトの data/）")
+    parser.add_argument('--simulate', action='store_true', help="実機の代わりに疑似デバイスを使う")
+    parser.add_argument('--no-image', action='store_true', help="グラフの画像を作らない（後から --render で作る）")
+    parser.add_argument('--render', metavar='DIR', default=None,
+                        help="計測はせず、DIR 以下の画像のない計測データの画像を作る")
+    args = parser.parse_args()
+
+    if args.render is not None:
+        saved = render_missing_images(args.render)
+        print(f"画像を {len(saved)} 件作りました。")
+        return
+
+    if args.profile in PROFILE_KINDS and args.profile != 'table':
+        if len(args.settings) != 4:
+            parser.error("initial_rpm final_rpm planned_steps operation_during の4つを指定してください")
+        if any(value < 0 for value in args.settings):
+            parser.error("負数は指定できません")
+        try:
+            (log_profile if args.profile == 'log' else linear_profile)(*args.settings)
+        except ValueError as e:
+            parser.error(str(e))
+        run = dict(zip(('initial_rpm', 'final_rpm', 'planned_steps', 'operation_during'), args.settings),
+                   profile_kind=args.profile, profile_table=None)
+    else:
+        try:
+            table = load_profile_table(args.profile)
+        except (OSError, ValueError) as e:
+            print(f"エラー: 速度の表を読めません: {e}")
+            return
+        run = dict(initial_rpm=0, final_rpm=0, planned_steps=0, operation_during=0, profile_kind='table',
+                   profile_table=table)
+
+    if args.simulate:
+        from esp32_simulator import SimulatedESP32
+        collector = DataCollector(ser=SimulatedESP32(seed=0), console='none')
+    else:
+        port = args.port or select_com_port()
+        if not port:
+            print("COMポートが選択されませんでした。")
+            return
+        collector = DataCollector(port=port, baudrate=args.baudrate, console='none')
+
+    collector.configure(memoname=args.memo, **run)
+    directory_name = args.data_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    file_prefix = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{collector.memoname}'
+    collector.run_headless(directory_name, file_prefix, save_image=not args.no_image)
+
+
+if __name__ == "__main__":
+    main()
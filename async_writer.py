@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+
+
+class RecordWriter:
+    """
+    受信スレッドから受け取った行を、別スレッドでまとめてCSVに書き込むクラス。
+
+    受信スレッドは put() で有界キューに積むだけにして、ディスクや端末への出力の遅れが
+    シリアルの読み出しを止めないようにする。キューが満杯のときは put() が空くまで待ち
+    （データは捨てない）、その回数と待ち時間を backpressure として記録・表示する。
+    書き込みで例外（ディスクの空き不足など）が起きたら書き込みスレッドは止まり、その例外を error に残して
+    以後の put() と close() で投げ直す（put() が空くのを待ち続けて受信が止まることはない）。
+
+    Parameters:
+        raw_csv_writer (csv.writer): 全てのログ用のCSV。
+        data_csv_writer (csv.writer): データのみのCSV。
+        file_objs (list): flush/fsync するファイルオブジェクト。
+        binary_writer (binary_record.BinaryRecordWriter): 指定するとバイナリ形式でも記録する。
+        queue_size (int): キューに積める件数（1件は受信1回分の行のまとまり）。
+        sync (str): 'none'（Pythonのバッファ任せ）, 'flush'（定期的にflush）, 'fsync'（flushに加えてos.fsync）。
+        flush_interval (float): flush/fsync する間隔（秒）。
+        console (str): 'status'（定期的に状態を1行表示）, 'all'（全ての応答を表示）, 'none'（表示しない）。
+        status_interval (float): 状態表示の間隔（秒）。
+        status_callback (callable): 状態表示の行に付け加える文字列を返す関数（書き込みスレッドから呼ばれる）。
+        name (str): 状態表示に付ける名前（複数の装置を同時に計測するとき、どの装置の表示か分かるように）。
+        metrics (metrics.Metrics): 指定するとキューの長さ・1回の書き込みにかかった時間・待たされた回数を記録する。
+    """
+
+    def __init__(self, raw_csv_writer, data_csv_writer, file_objs=(), binary_writer=None, queue_size=1024, sync='flush',
+                 flush_interval=1.0, console='status', status_interval=1.0, status_callback=None, name=None,
+                 metrics=None):
+        self.raw_csv_writer = raw_csv_writer
+        self.data_csv_writer = data_csv_writer
+        self.file_objs = list(file_objs)
+        self.binary_writer = binary_writer
+        if binary_writer is not None:
+            self.file_objs.append(binary_writer.file_obj)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sync = sync
+        self.flush_interval = flush_interval
+        self.console = console
+        self.status_interval = status_interval
+        self.status_callback = status_callback
+        self.name = name
+        self.metrics = metrics
+
+        self.raw_rows_written = 0
+        self.data_rows_written = 0
+        self.max_queue_depth = 0
+        self.backpressure_count = 0
+        self.backpressure_time = 0.0
+        self.last_response = ""
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, raw_rows, data_rows=(), binary_records=None):
+        """
+        書き込む行をキューに積む（受信スレッドから呼ぶ）。
+
+        Parameters:
+            raw_rows (list): 全てのログ用のCSVの行 [Timestamp, log and response] のリスト。
+            data_rows (iterable): データのみのCSVの行のリスト。
+            binary_records (tuple): バイナリ形式で記録する (host_time, timestamps, raw, speed_delay)。
+
+        Raises:
+            Exception: 書き込みスレッドが例外で止まっている場合、その例外。
+        """
+        self._raise_error()
+        item = (raw_rows, data_rows, binary_records)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # 書き込みが追いついていない。データは捨てずに空くまで待つ（書き込みスレッドが止まったら待つのをやめる）
+            t0 = time.perf_counter()
+            while True:
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    self._raise_error()
+            self.backpressure_count += 1
+            self.backpressure_time += time.perf_counter() - t0
+            if self.metrics is not None:
+                self.metrics.inc('writer_backpressure_total')
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if self.metrics is not None:
+            self.metrics.set('writer_queue_depth', depth)
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            # 受信スレッドが put() / close() で気づけるように残す
+            self.error = e
+            print(f"エラー: 書き込みスレッドが停止しました: {type(e).__name__}: {e}")
+
+    def _run(self):
+        last_flush = last_status = time.perf_counter()
+        running = True
+        while running:
+            try:
+                items = [self.queue.get(timeout=min(self.flush_interval, self.status_interval))]
+            except queue.Empty:
+                items = []
+            # たまっている分をまとめて取り出して書き込む
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in items:
+                running = False
+                items = [item for item in items if item is not None]
+            if self.metrics is not None and items:
+                with self.metrics.time('writer_batch_seconds'):
+                    self._write(items)
+                self.metrics.set('writer_queue_depth', self.queue.qsize())
+            else:
+                self._write(items)
+
+            now = time.perf_counter()
+            if now - last_flush >= self.flush_interval or not running:
+                self._sync()
+                last_flush = now
+            if self.console == 'status' and (now - last_status >= self.status_interval or not running):
+                self.print_status()
+                last_status = now
+
+    def _write(self, items):
+        for raw_rows, data_rows, binary_records in items:
+            if raw_rows:
+                self.raw_csv_writer.writerows(raw_rows)
+                self.raw_rows_written += len(raw_rows)
+                self.last_response = raw_rows[-1][1]
+                if self.console == 'all':
+                    print("Response from ESP32:", "\nResponse from ESP32: ".join(str(row[1]) for row in raw_rows))
+            if data_rows:
+                data_rows = list(data_rows)
+                self.data_csv_writer.writerows(data_rows)
+                self.data_rows_written += len(data_rows)
+            if binary_records is not None and self.binary_writer is not None:
+                self.binary_writer.append(*binary_records)
+
+    def _sync(self):
+        if self.sync == 'none':
+            return
+        for file_obj in self.file_objs:
+            file_obj.flush()
+            if self.sync == 'fsync':
+                os.fsync(file_obj.fileno())
+
+    def print_status(self):
+        tag = f"[status {self.name}]" if self.name else "[status]"
+        status = (f"{tag} 受信行数: {self.raw_rows_written}  データ行数: {self.data_rows_written}  "
+                  f"キュー: {self.queue.qsize()}/{self.queue.maxsize}  最新: {self.last_response}")
+        if self.status_callback is not None:
+            extra = self.status_callback()
+            if extra:
+                status += f"  {extra}"
+        if self.backpressure_count:
+            status += f"  ※書き込み待ち {self.backpressure_count}回 ({self.backpressure_time:.3f}秒)"
+        print(status)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        キューに残っている行を全て書き込んでからスレッドを終了する。
+
+        Raises:
+            Exception: 書き込みスレッドが例外で止まった場合、その例外。
+        """
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        if self.thread.ident is not None:
+            self.thread.join()
+        if self.backpressure_count:
+            print(f"警告: 書き込みが追いつかず、受信スレッドが {self.backpressure_count} 回 "
+                  f"(合計 {self.backpressure_time:.3f} 秒) 待たされました。最大キュー長: {self.max_queue_depth}")
+        self._raise_error()
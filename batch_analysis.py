@@ -0,0 +1,325 @@
+"""
+data/ 以下の全ての計測データ（_esp32_data.csv / _esp32_data.bin）をまとめて解析し、
+近似パラメータとMSE、パラメータの信頼区間（ブートストラップ法）の一覧表と、
+候補モデル（fit_models）を AIC で比べた結果の一覧表を作るスクリプト。
+
+解析結果はファイル内容のハッシュと解析のバージョンをキーにしてキャッシュするので、
+2回目以降は新しく増えた・変更された計測データだけを解析する。
+
+使い方:
+    python batch_analysis.py                     # data/ を解析して data/analysis_summary.csv に書き出す
+    python batch_analysis.py --workers 4 --force # キャッシュを使わずに4プロセスで解析し直す
+    python batch_analysis.py --bootstrap 0       # 信頼区間を求めない（速い）
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import math
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bootstrap import BOOTSTRAP_SAMPLES
+from fit_models import REGISTRY, decimate_series, fit_model, rank_results
+from step_index import step_index_path
+
+# 解析の中身を変えたらこの値を上げる（古いキャッシュは使われなくなる）
+ANALYSIS_VERSION = 10
+
+CACHE_DIRECTORY_NAME = ".analysis_cache"
+
+SUMMARY_COLUMNS = [
+    'run', 'path', 'samples', 'unique_speeds',
+    'time_a', 'time_b', 'time_c', 'time_mse', 'time_error',
+    'speed_a', 'speed_b', 'speed_c', 'speed_mse', 'speed_error',
+    'speed_best_model', 'speed_best_aic', 'time_best_model', 'time_best_aic',
+    'bootstrap_samples',
+    'time_a_low', 'time_a_high', 'time_b_low', 'time_b_high', 'time_c_low', 'time_c_high',
+    'speed_a_low', 'speed_a_high', 'speed_b_low', 'speed_b_high', 'speed_c_low', 'speed_c_high',
+]
+
+# 候補モデルごとの近似結果の一覧（analysis_models.csv）の列
+MODEL_COLUMNS = ['run', 'kind', 'rank', 'model', 'formula', 'params', 'n', 'aic', 'bic', 'rmse', 'r2',
+                 'max_abs_residual', 'error']
+
+
+def discover_runs(data_directory):
+    """
+    計測データのファイルを探す。同じ計測のCSVとバイナリが両方あるときはバイナリを使う。
+
+    Returns:
+        list: ファイルパスのリスト（名前順）。
+    """
+    runs = {}
+    for root, _, files in os.walk(data_directory):
+        if CACHE_DIRECTORY_NAME in root.split(os.sep):
+            continue
+        for file_name in files:
+            lower = file_name.lower()
+            for suffix in ('_esp32_data.bin', '_esp32_data.csv'):
+                if lower.endswith(suffix):
+                    key = os.path.join(root, file_name[:-len(suffix)])
+                    path = os.path.join(root, file_name)
+                    if key not in runs or suffix.endswith('.bin'):
+                        runs[key] = path
+    return [runs[key] for key in sorted(runs)]
+
+
+def file_hash(path):
+    """ ファイル内容のSHA-256 """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_hash(path):
+    """ 計測データと、あれば段階の索引（解析結果が変わる）の内容のハッシュ """
+    content_hash = file_hash(path)
+    index_path = step_index_path(path)
+    if index_path is not None and os.path.exists(index_path):
+        content_hash = hashlib.sha256((content_hash + file_hash(index_path)).encode('ascii')).hexdigest()
+    return content_hash
+
+
+def analyze_run(path, bootstrap_samples=BOOTSTRAP_SAMPLES):
+    """
+    1つの計測データについて、重量 対 時間 の近似と、中央値に基づいた 重量 対 速度 の近似を行い、
+    bootstrap_samples 回のブートストラップで近似パラメータの95%信頼区間を求める（0なら求めない）。
+    （別プロセスで実行される。表示やプロットは行わない。ファイルごとに並列なので、ブートストラップは1プロセスで行う）
+
+    Returns:
+        dict: SUMMARY_COLUMNS の各値。候補モデルの比較に使う系列を '_model_inputs'（kind → (x, y)）に入れる
+        （候補モデルの近似は run_batch がモデルごとに別のタスクとして行う）。
+    """
+    result = {column: None for column in SUMMARY_COLUMNS}
+    result['run'] = os.path.basename(path)
+    result['path'] = path
+    result['bootstrap_samples'] = bootstrap_samples
+    # 1件の解析で予期しない例外が出ても一覧全体を止めない（段階の索引が壊れている場合など）。
+    # それまでに求めた値は残し、まだ埋まっていないエラーの列に理由を書く
+    try:
+        _analyze_run(result, path, bootstrap_samples)
+    except Exception as e:
+        message = f"解析エラー: {type(e).__name__}: {e}"
+        for column in ('time_error', 'speed_error'):
+            if result[column] is None:
+                result[column] = message
+    return result
+
+
+def _analyze_run(result, path, bootstrap_samples):
+    """ analyze_run の本体。result に値を書き込む """
+    import display_approximation_exponential as analysis
+
+    # load_data_arrays の表示は一覧には不要なので捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            loaded = analysis.load_data_arrays(path)
+        except Exception as e:
+            loaded = None
+            result['time_error'] = result['speed_error'] = f"読み込みエラー: {e}"
+    if loaded is None:
+        if result['time_error'] is None:
+            result['time_error'] = result['speed_error'] = "有効なデータがありません"
+        return
+
+    timestamps_esp32, weights, speeds_rpm = loaded
+    result['samples'] = len(weights)
+    time_for_fit = timestamps_esp32 - timestamps_esp32[0]
+    model_inputs = {}
+    time_points = decimate_series(time_for_fit, weights)
+    if len(weights) > 3:
+        model_inputs['time'] = tuple(values.tolist() for values in time_points)
+
+    params_time = params_speed = None
+    if len(weights) > 3:
+        try:
+            params, mse = analysis.fit_weight_vs_time(time_for_fit, weights)
+            params_time = params
+            result['time_a'], result['time_b'], result['time_c'] = (float(value) for value in params)
+            result['time_mse'] = float(mse)
+        except Exception as e:
+            result['time_error'] = str(e)
+    else:
+        result['time_error'] = "データ点が不足しています"
+
+    # 段階の索引（_esp32_steps.csv）があれば段階ごとに切り出す
+    unique_speeds, weight_groups, _ = analysis.weight_groups_by_speed_or_step(path, timestamps_esp32, weights,
+                                                                               speeds_rpm)
+    median_weights = np.array([np.median(group) for group in weight_groups])
+    result['unique_speeds'] = len(unique_speeds)
+    if len(unique_speeds) > 0:
+        model_inputs['speed'] = (np.asarray(unique_speeds, dtype=np.float64).tolist(),
+                                 np.asarray(median_weights, dtype=np.float64).tolist())
+    result['_model_inputs'] = model_inputs
+    if len(unique_speeds) > 3:
+        try:
+            params, mse = analysis.fit_median_vs_speed(unique_speeds, median_weights)
+            params_speed = params
+            result['speed_a'], result['speed_b'], result['speed_c'] = (float(value) for value in params)
+            result['speed_mse'] = float(mse)
+        except Exception as e:
+            result['speed_error'] = str(e)
+    else:
+        result['speed_error'] = "ユニークな速度のデータ点数が少なすぎます (3点超必要)"
+
+    if bootstrap_samples > 0:
+        intervals = analysis.bootstrap_fit_intervals(
+            time_points, params_time, params_speed, unique_speeds, weight_groups, n_boot=bootstrap_samples,
+            workers=1)
+        for kind, interval in intervals.items():
+            for name, lower, upper in zip('abc', interval.lower, interval.upper):
+                result[f'{kind}_{name}_low'] = float(lower) if np.isfinite(lower) else None
+                result[f'{kind}_{name}_high'] = float(upper) if np.isfinite(upper) else None
+
+
+def _model_rows(result, results_by_kind):
+    """ 候補モデルの近似結果を result に書き込む（最良のモデルは SUMMARY_COLUMNS に、全ての候補は 'models' に） """
+    result['models'] = []
+    for kind, ranked in results_by_kind.items():
+        if ranked and ranked[0].error is None:
+            result[f'{kind}_best_model'] = ranked[0].name
+            result[f'{kind}_best_aic'] = ranked[0].aic
+        for rank, model_result in enumerate(ranked, start=1):
+            # 近似できなかったモデル（データ点不足を含む）には順位を付けない
+            rank = rank if model_result.error is None else None
+            params = (dict(zip(model_result.param_names, model_result.params))
+                      if model_result.params is not None else None)
+            result['models'].append({
+                'kind': kind, 'rank': rank, 'model': model_result.name, 'formula': model_result.formula,
+                'params': params, 'n': model_result.n,
+                'aic': model_result.aic if math.isfinite(model_result.aic) else None,
+                'bic': model_result.bic if math.isfinite(model_result.bic) else None,
+                'rmse': model_result.rmse, 'r2': model_result.r2, 'max_abs_residual': model_result.max_abs_residual,
+                'error': model_result.error})
+
+
+def _cache_path(cache_directory, content_hash, bootstrap_samples):
+    return os.path.join(cache_directory, f"{content_hash}_v{ANALYSIS_VERSION}_b{bootstrap_samples}.json")
+
+
+def run_batch(data_directory, workers=None, force=False, bootstrap_samples=BOOTSTRAP_SAMPLES):
+    """
+    data_directory 以下の全ての計測データを解析する。キャッシュにあるものは解析しない。
+
+    Parameters:
+        data_directory (str): 計測データのディレクトリ。
+        workers (int): 解析に使うプロセス数（Noneならコア数）。
+        force (bool): Trueならキャッシュを使わずに全て解析し直す。
+        bootstrap_samples (int): 信頼区間を求めるブートストラップの回数（0なら求めない。回数ごとに別にキャッシュする）。
+
+    Returns:
+        list: 各計測データの解析結果（SUMMARY_COLUMNS の辞書）のリスト。
+    """
+    cache_directory = os.path.join(data_directory, CACHE_DIRECTORY_NAME)
+    os.makedirs(cache_directory, exist_ok=True)
+
+    paths = discover_runs(data_directory)
+    results = {}
+    to_analyze = []
+    for path in paths:
+        content_hash = run_hash(path)
+        cache_path = _cache_path(cache_directory, content_hash, bootstrap_samples)
+        if not force and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf-8') as file_obj:
+                result = json.load(file_obj)
+            # 同じ内容のファイルが移動・改名されていても使えるように、名前は今のものにする
+            result['run'] = os.path.basename(path)
+            result['path'] = path
+            results[path] = result
+        else:
+            to_analyze.append((path, cache_path))
+
+    print(f"計測データ: {len(paths)}件  キャッシュ済み: {len(results)}件  解析: {len(to_analyze)}件")
+    if to_analyze:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 読み込みと指数関数近似はファイルごと、候補モデルの近似はさらにモデルごとのタスクにして同じプロセスで並列に行う
+            analyzed = executor.map(analyze_run, [path for path, _ in to_analyze],
+                                    itertools.repeat(bootstrap_samples))
+            pending = []
+            for (path, cache_path), result in zip(to_analyze, analyzed):
+                model_futures = {kind: [executor.submit(fit_model, kind, name, x, y) for name in REGISTRY[kind]]
+                                 for kind, (x, y) in result.pop('_model_inputs', {}).items()}
+                pending.append((path, cache_path, result, model_futures))
+            for path, cache_path, result, model_futures in pending:
+                _model_rows(result, {kind: rank_results([future.result() for future in futures])
+                                     for kind, futures in model_futures.items()})
+                with open(cache_path, 'w', encoding='utf-8') as file_obj:
+                    json.dump(result, file_obj, ensure_ascii=False)
+                results[path] = result
+                print(f"解析済み: {result['run']}")
+
+    return [results[path] for path in paths]
+
+
+def write_summary(results, output_path):
+    """ 解析結果の一覧をCSVに書き出す """
+    with open(output_path, 'w', newline='', encoding='utf-8') as file_obj:
+        csv_writer = csv.writer(file_obj)
+        csv_writer.writerow(SUMMARY_COLUMNS)
+        for result in results:
+            csv_writer.writerow([result.get(column) for column in SUMMARY_COLUMNS])
+
+
+def write_models(results, output_path):
+    """ 全ての計測データの候補モデルごとの近似結果をCSVに書き出す """
+    with open(output_path, 'w', newline='', encoding='utf-8') as file_obj:
+        csv_writer = csv.writer(file_obj)
+        csv_writer.writerow(MODEL_COLUMNS)
+        for result in results:
+            for model in result.get('models', []):
+                params = model['params']
+                model = dict(model, run=result['run'],
+                             params=', '.join(f"{name}={value:.6g}" for name, value in params.items()) if params else None)
+                csv_writer.writerow([model.get(column) for column in MODEL_COLUMNS])
+
+
+def print_summary(results):
+    def fmt(value, spec):
+        return format(value, spec) if value is not None and np.isfinite(value) else '-'
+
+    print(f"{'run':<60} {'samples':>8} {'time b':>11} {'time MSE':>10} {'speed b':>11} {'speed MSE':>10} "
+          f"{'best(speed)':>14} {'best(time)':>14}")
+    for result in results:
+        print(f"{result['run'][:60]:<60} {result['samples'] or 0:>8} {fmt(result['time_b'], '>11.3e')} "
+              f"{fmt(result['time_mse'], '>10.4f')} {fmt(result['speed_b'], '>11.3e')} {fmt(result['speed_mse'], '>10.4f')} "
+              f"{result.get('speed_best_model') or '-':>14} {result.get('time_best_model') or '-':>14}")
+
+
+def main():
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="data/ 以下の全ての計測データをまとめて解析する")
+    parser.add_argument('--data-dir', default=os.path.join(script_directory, "data"), help="計測データのディレクトリ")
+    parser.add_argument('--output', default=None, help="一覧表のCSVの出力先（既定: <data-dir>/analysis_summary.csv）")
+    parser.add_argument('--models-output', default=None,
+                        help="候補モデルごとの近似結果のCSVの出力先（既定: <data-dir>/analysis_models.csv）")
+    parser.add_argument('--workers', type=int, default=None, help="解析に使うプロセス数（既定: コア数）")
+    parser.add_argument('--force', action='store_true', help="キャッシュを使わずに全て解析し直す")
+    parser.add_argument('--bootstrap', type=int, default=BOOTSTRAP_SAMPLES,
+                        help=f"近似パラメータの信頼区間を求めるブートストラップの回数（0なら求めない。既定: {BOOTSTRAP_SAMPLES}）")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"エラー: ディレクトリが見つかりません: {args.data_dir}")
+        return
+    output_path = args.output or os.path.join(args.data_dir, "analysis_summary.csv")
+    models_output_path = args.models_output or os.path.join(args.data_dir, "analysis_models.csv")
+
+    results = run_batch(args.data_dir, workers=args.workers, force=args.force, bootstrap_samples=args.bootstrap)
+    write_summary(results, output_path)
+    write_models(results, models_output_path)
+    print()
+    print_summary(results)
+    print(f"\n一覧表を保存しました: {output_path}")
+    print(f"候補モデルごとの近似結果を保存しました: {models_output_path}")
+
+
+if __name__ == "__main__":
+    main()
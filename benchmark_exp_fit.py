@@ -0,0 +1,115 @@
+"""
+指数関数近似の速度と結果を、従来の curve_fit の方法（method='curve_fit'）と
+exp_fit.fit_exponential（method='varpro'）で比べるベンチマーク。
+
+使い方:
+    python benchmark_exp_fit.py                 # data/ 以下の計測データで比べる
+    python benchmark_exp_fit.py --data-dir D:\\runs
+    python benchmark_exp_fit.py --synthetic 20  # 計測データがないときは合成データで比べる
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+import display_approximation_exponential as analysis
+from batch_analysis import discover_runs
+
+METHODS = ('curve_fit', 'varpro')
+
+
+def _time_fit(fit_function, *args, method):
+    t0 = time.perf_counter()
+    try:
+        params, mse = fit_function(*args, method=method)
+        error = None
+    except Exception as e:
+        params, mse, error = None, None, str(e)
+    return time.perf_counter() - t0, params, mse, error
+
+
+def _median_by_speed(speeds_rpm, weights):
+    """ 各速度(rpm)における重量の中央値（速度の昇順の (unique_speeds, median_weights)） """
+    import pandas as pd
+    median_data = pd.Series(weights).groupby(speeds_rpm).median().sort_index()
+    return median_data.index.values, median_data.values
+
+
+def benchmark_dataset(name, timestamps_esp32, weights, speeds_rpm):
+    """ 1つのデータセットについて、両方の方法で時間近似と中央値-速度近似を行った結果を返す """
+    time_for_fit = timestamps_esp32 - timestamps_esp32[0]
+    unique_speeds, median_weights = _median_by_speed(speeds_rpm, weights)
+    rows = []
+    for method in METHODS:
+        elapsed, params, mse, error = _time_fit(analysis.fit_weight_vs_time, time_for_fit, weights, method=method)
+        rows.append((name, 'time', method, len(weights), elapsed, params, mse, error))
+        if len(unique_speeds) > 3:
+            elapsed, params, mse, error = _time_fit(analysis.fit_median_vs_speed, unique_speeds, median_weights,
+                                                    method=method)
+            rows.append((name, 'speed', method, len(unique_speeds), elapsed, params, mse, error))
+    return rows
+
+
+def synthetic_datasets(count, samples, seed=0):
+    """ 速度を段階的に上げたときの重量の応答を模した合成データ """
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        steps = rng.integers(5, 15)
+        timestamps = np.arange(samples) * 10.0
+        step_index = np.minimum(np.arange(samples) * steps // samples, steps - 1)
+        speeds = 10 + step_index * rng.uniform(5, 20)
+        level = rng.uniform(0.5, 3) * np.exp(rng.uniform(0.005, 0.02) * speeds)
+        drift = rng.uniform(-2, 2) * np.exp(-timestamps / rng.uniform(1e5, 1e6))
+        weights = level + drift + rng.normal(0, 0.2, samples)
+        yield f"synthetic_{i:02d}", timestamps, weights, speeds
+
+
+def print_rows(rows):
+    print(f"{'dataset':<40} {'fit':<6} {'method':<10} {'points':>8} {'time(ms)':>10} {'MSE':>12}  result")
+    for name, fit, method, points, elapsed, params, mse, error in rows:
+        result = error if error else f"a={params[0]:.4e}, b={params[1]:.4e}, c={params[2]:.4f}"
+        mse_text = f"{mse:>12.5g}" if mse is not None else f"{'-':>12}"
+        print(f"{name[:40]:<40} {fit:<6} {method:<10} {points:>8} {elapsed * 1e3:>10.2f} {mse_text}  {result}")
+
+    print()
+    for fit in ('time', 'speed'):
+        for method in METHODS:
+            selected = [row for row in rows if row[1] == fit and row[2] == method]
+            if not selected:
+                continue
+            failures = sum(1 for row in selected if row[7])
+            total = sum(row[4] for row in selected)
+            print(f"{fit:<6} {method:<10} 合計 {total * 1e3:>10.1f} ms  失敗 {failures}/{len(selected)}")
+
+
+def main():
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="指数関数近似の方法を計測データで比較する")
+    parser.add_argument('--data-dir', default=os.path.join(script_directory, "data"), help="計測データのディレクトリ")
+    parser.add_argument('--synthetic', type=int, default=0, help="合成データの個数（計測データの代わり/追加）")
+    parser.add_argument('--samples', type=int, default=100000, help="合成データ1つあたりのサンプル数")
+    args = parser.parse_args()
+
+    datasets = []
+    if os.path.isdir(args.data_dir):
+        for path in discover_runs(args.data_dir):
+            with contextlib.redirect_stdout(io.StringIO()):
+                loaded = analysis.load_data_arrays(path)
+            if loaded is not None:
+                datasets.append((os.path.basename(path),) + tuple(loaded))
+    datasets.extend(synthetic_datasets(args.synthetic, args.samples))
+    if not datasets:
+        print("比較するデータがありません。--data-dir を指定するか、--synthetic で合成データを使ってください。")
+        return
+
+    rows = []
+    for dataset in datasets:
+        rows.extend(benchmark_dataset(*dataset))
+    print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
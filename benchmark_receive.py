@@ -0,0 +1,144 @@
+"""
+疑似ESP32（esp32_simulator.SimulatedESP32）を使って DataCollector の受信処理の速度を測るベンチマーク。
+
+使い方:
+    python benchmark_receive.py --rates 100 1000 5000 20000 --duration 3
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+from USHI_seigyo2 import DataCollector
+from esp32_simulator import SimulatedESP32
+
+
+def run_benchmark(rate_hz, duration, noise_std=0.0, garbage_rate=0.0, buffer_size=4096, steps=4, echo=False,
+                  bulk_read=True, batch_wait=0.0):
+    """
+    指定したレートで疑似ESP32を動かし、receive_and_process を duration 秒間実行して結果を返す。
+
+    Parameters:
+        rate_hz (float): 疑似ESP32の[data]行の送信レート。
+        duration (float): 計測時間（秒）。
+        noise_std (float): 重量のノイズの標準偏差。
+        garbage_rate (float): ゴミバイトを混入させる確率。
+        buffer_size (int): 疑似ESP32の受信バッファのバイト数。
+        steps (int): 計測中の速度変更回数。
+        echo (bool): Trueなら "Response from ESP32:" の表示も端末に出す（表示のコストも含めて測る）。
+        bulk_read (bool): Trueなら一括読み出し（process_lines）、Falseなら1行ずつ（process_response）で測る。
+        batch_wait (float): 一括読み出しで行がたまるのを待つ最長の時間（秒。DataCollector の read_batch_wait）。
+
+    Returns:
+        dict: 計測結果。
+    """
+    device = SimulatedESP32(rate_hz=rate_hz, noise_std=noise_std, garbage_rate=garbage_rate,
+                            buffer_size=buffer_size, seed=0)
+    collector = DataCollector(ser=device, bulk_read=bulk_read, console='all' if echo else 'status',
+                              read_batch_wait=batch_wait)
+    collector.configure(10, 100, steps, duration, 'benchmark')
+
+    # 1行あたりの処理時間を測るために process_response / process_lines をラップする
+    # （process_lines が少ない行を process_response に回したときは、process_lines の側だけで数える）
+    process_times = []
+    process_response = collector.process_response
+    process_lines = collector.process_lines
+
+    def timed_process_response(current_ut, response):
+        t0 = time.perf_counter()
+        process_response(current_ut, response)
+        if not bulk_read:
+            process_times.append(time.perf_counter() - t0)
+
+    def timed_process_lines(current_ut, lines):
+        t0 = time.perf_counter()
+        process_lines(current_ut, lines)
+        if lines:
+            process_times.extend([(time.perf_counter() - t0) / len(lines)] * len(lines))
+
+    collector.process_response = timed_process_response
+    collector.process_lines = timed_process_lines
+
+    with tempfile.TemporaryDirectory() as directory:
+        collector.raw_csv_writer, file_obj_raw = collector.create_csv_file(directory, "bench_esp32_raw.csv")
+        collector.data_csv_writer, file_obj_data = collector.create_csv_file(directory, "bench_esp32_data.csv")
+        record_writer = collector.open_record_writer([file_obj_raw, file_obj_data])
+
+        stdout = contextlib.nullcontext() if echo else contextlib.redirect_stdout(io.StringIO())
+        t_start = time.perf_counter()
+        with stdout:
+            collector.receive_and_process()
+            elapsed = time.perf_counter() - t_start
+            record_writer.close()
+
+        file_obj_raw.close()
+        file_obj_data.close()
+
+    read_latencies = np.asarray(device.read_latencies)
+    process_times = np.asarray(process_times)
+    parsed_samples = collector.samples.total_count
+    return {
+        'mode': 'bulk' if bulk_read else 'line',
+        'rate_hz': rate_hz,
+        'elapsed': elapsed,
+        'lines': len(process_times),
+        'lines_per_s': len(process_times) / elapsed,
+        'bytes_per_s': device.bytes_read / elapsed,
+        'emitted_samples': device.emitted_samples,
+        'parsed_samples': parsed_samples,
+        'dropped_lines': device.dropped_lines,
+        'lost_samples': device.emitted_samples - parsed_samples,
+        'latency_p50': np.percentile(read_latencies, 50) if read_latencies.size else float('nan'),
+        'latency_p95': np.percentile(read_latencies, 95) if read_latencies.size else float('nan'),
+        'latency_p99': np.percentile(read_latencies, 99) if read_latencies.size else float('nan'),
+        'process_p50': np.percentile(process_times, 50) if process_times.size else float('nan'),
+        'process_p99': np.percentile(process_times, 99) if process_times.size else float('nan'),
+        'backpressure': record_writer.backpressure_count,
+    }
+
+
+def print_results(results):
+    header = (f"{'mode':>5} {'rate(Hz)':>9} {'lines/s':>10} {'bytes/s':>11} {'emitted':>8} {'parsed':>8} {'dropped':>8} {'lost':>7} "
+              f"{'lat p50(ms)':>11} {'lat p95(ms)':>11} {'lat p99(ms)':>11} {'proc p50(us)':>12} {'proc p99(us)':>12} {'backpressure':>12}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['mode']:>5} {r['rate_hz']:>9.0f} {r['lines_per_s']:>10.0f} {r['bytes_per_s']:>11.0f} {r['emitted_samples']:>8} "
+              f"{r['parsed_samples']:>8} {r['dropped_lines']:>8} {r['lost_samples']:>7} "
+              f"{r['latency_p50'] * 1e3:>11.2f} {r['latency_p95'] * 1e3:>11.2f} {r['latency_p99'] * 1e3:>11.2f} "
+              f"{r['process_p50'] * 1e6:>12.1f} {r['process_p99'] * 1e6:>12.1f} {r['backpressure']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataCollectorの受信処理のスループットを疑似ESP32で測定する")
+    parser.add_argument('--rates', type=float, nargs='+', default=[100, 1000, 5000, 10000, 20000, 50000],
+                        help="測定する[data]行の送信レート(Hz)")
+    parser.add_argument('--duration', type=float, default=3.0, help="1レートあたりの測定時間(秒)")
+    parser.add_argument('--noise', type=float, default=0.0, help="重量のノイズの標準偏差")
+    parser.add_argument('--garbage', type=float, default=0.0, help="ゴミバイトを混入させる確率")
+    parser.add_argument('--buffer-size', type=int, default=4096, help="疑似ESP32の受信バッファのバイト数")
+    parser.add_argument('--echo', action='store_true', help="ESP32の応答の表示も端末に出す")
+    parser.add_argument('--modes', nargs='+', choices=['line', 'bulk'], default=['line', 'bulk'],
+                        help="測定する受信方式（line: 1行ずつreadline, bulk: 一括読み出し）")
+    parser.add_argument('--batch-wait', type=float, default=0.0,
+                        help="一括読み出しで行がたまるのを待つ最長の秒数（0なら待たない。待つと遅延が増える）")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        for rate_hz in args.rates:
+            print(f"測定中: {mode} {rate_hz:.0f} Hz ...", flush=True)
+            results.append(run_benchmark(rate_hz, args.duration, args.noise, args.garbage, args.buffer_size,
+                                         echo=args.echo, bulk_read=(mode == 'bulk'), batch_wait=args.batch_wait))
+    print()
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+各スクリプトの起動時間（モジュールの読み込みにかかる時間）と、読み込まれた重いライブラリを測るベンチマーク。
+
+1回ごとに新しい Python のプロセスで import するので、2回目以降の読み込みが速くなることはない
+（ディスクのキャッシュは効く）。入力待ちなしの計測の入口（acquire_headless, run_queue, multi_rig）が
+matplotlib・pandas・scipy を読み込んでいたり、--max-ms より遅かったりしたら終了コード1で終わるので、
+起動が遅くなっていないかの確認に使える。
+
+使い方:
+    python benchmark_startup.py
+    python benchmark_startup.py --repeat 10 --max-ms 500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 入力待ちなしの計測の入口（重いライブラリを読み込んではいけない）
+# （multi_rig はグラフを表示するときだけ matplotlib を読み込む）
+HEADLESS_MODULES = ['acquire_headless', 'run_queue', 'multi_rig']
+# 比べるためのその他のモジュール
+OTHER_MODULES = ['USHI_seigyo2', 'display_approximation_exponential', 'batch_analysis']
+HEAVY_PACKAGES = ['matplotlib', 'pandas', 'scipy', 'japanize_matplotlib']
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+"""
+
+
+def measure_import(module, repeat, cwd):
+    """
+    新しいプロセスで module を repeat 回 import し、その時間と読み込まれた重いライブラリを返す。
+
+    Returns:
+        tuple: (秒のリスト, 重いライブラリの名前のリスト)。
+    Raises:
+        RuntimeError: import に失敗した場合。
+    """
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_PACKAGES)],
+                                   cwd=cwd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "不明なエラー")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    return times, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各スクリプトの起動時間を測る")
+    parser.add_argument('--repeat', type=int, default=5, help="1つのモジュールを測る回数")
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help="入力待ちなしの計測の入口の起動時間（中央値）の上限（ミリ秒）")
+    parser.add_argument('--modules', nargs='+', default=None, help="測るモジュール（既定: 全て）")
+    args = parser.parse_args()
+
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    modules = args.modules or HEADLESS_MODULES + OTHER_MODULES
+    failures = []
+    print(f"{'module':<36} {'median(ms)':>11} {'min(ms)':>9} {'max(ms)':>9}  重いライブラリ")
+    for module in modules:
+        try:
+            times, heavy = measure_import(module, args.repeat, script_directory)
+        except RuntimeError as e:
+            print(f"{module:<36} 読み込めません: {e}")
+            if module in HEADLESS_MODULES:
+                failures.append(f"{module} を読み込めません: {e}")
+            continue
+        median_ms = statistics.median(times) * 1000
+        print(f"{module:<36} {median_ms:>11.1f} {min(times) * 1000:>9.1f} {max(times) * 1000:>9.1f}  "
+              f"{', '.join(heavy) or '-'}")
+        if module in HEADLESS_MODULES:
+            if heavy:
+                failures.append(f"{module} が {', '.join(heavy)} を読み込んでいます")
+            if args.max_ms is not None and median_ms > args.max_ms:
+                failures.append(f"{module} の起動に {median_ms:.1f} ms かかっています（上限 {args.max_ms:g} ms）")
+
+    if failures:
+        print()
+        for failure in failures:
+            print("NG:", failure)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from serial_ingest import raw_to_weight, delay_to_rpm
+
+# ファイルの先頭の識別子とヘッダ長（ヘッダはJSON）
+MAGIC = b"USHIBIN1"
+_HEADER_PREFIX = struct.Struct('<8sI')
+# データ部の先頭をこのバイト数の倍数にそろえる
+_ALIGNMENT = 64
+FORMAT_VERSION = 1
+
+# 1サンプル分の固定長レコード。重量と回転数は raw と speed_delay からヘッダの校正値で計算する
+RECORD_DTYPE = np.dtype([
+    ('host_time', '<f8'),     # Timestamp(python)
+    ('timestamp', '<u4'),     # Timestamp(ESP32) (millis, ESP32のunsigned long)
+    ('raw', '<i4'),           # HX711の生の値
+    ('speed_delay', '<i4'),   # speed(delay)
+])
+
+
+def _dtype_to_json(dtype):
+    return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+
+class BinaryRecordWriter:
+    """
+    計測データを固定長レコードのバイナリファイルに追記していくクラス。
+
+    ファイルは「識別子 + ヘッダ長 + JSONヘッダ（計測設定・校正値・列の型）+ レコードの並び」。
+    レコード数はファイルサイズから求めるので、計測が途中で止まってもそこまでのデータは読める。
+
+    Parameters:
+        path (str): 書き込むファイルのパス。
+        settings (dict): ヘッダに保存する計測設定（initial_rpm, final_rpm, planned_steps, operation_during, memoname など）。
+        calibration (dict): 重量の計算に使う校正値（adc1bit, scale, offset）。
+    """
+
+    def __init__(self, path, settings, calibration):
+        self.path = path
+        header = {
+            'version': FORMAT_VERSION,
+            'columns': _dtype_to_json(RECORD_DTYPE),
+            'settings': settings,
+            'calibration': calibration,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        padding = -(_HEADER_PREFIX.size + len(header_bytes)) % _ALIGNMENT
+        header_bytes += b' ' * padding
+
+        self.file_obj = open(path, 'wb')
+        self.file_obj.write(_HEADER_PREFIX.pack(MAGIC, len(header_bytes)))
+        self.file_obj.write(header_bytes)
+        self.count = 0
+
+    def append(self, host_time, timestamps, raw, speed_delay):
+        """
+        サンプルをまとめて追記する。
+
+        Parameters:
+            host_time (float or array-like): Python側のタイムスタンプ（スカラーなら全サンプル共通）。
+            timestamps, raw, speed_delay (array-like): 各列の値。
+
+        Raises:
+            ValueError: 列の型（RECORD_DTYPE）に収まらない値がある場合（黙って桁があふれた値を書かないように、何も書かない）。
+        """
+        timestamps = np.asarray(timestamps)
+        columns = {'timestamp': timestamps, 'raw': np.asarray(raw), 'speed_delay': np.asarray(speed_delay)}
+        for name, values in columns.items():
+            limits = np.iinfo(RECORD_DTYPE[name])
+            if values.size and (values.min() < limits.min or values.max() > limits.max):
+                raise ValueError(f"{name} の値が {RECORD_DTYPE[name]} の範囲を超えています: "
+                                 f"{values.min()}〜{values.max()}")
+        records = np.empty(timestamps.shape[0], dtype=RECORD_DTYPE)
+        records['host_time'] = host_time
+        for name, values in columns.items():
+            records[name] = values
+        self.file_obj.write(records.tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        self.file_obj.flush()
+
+    def close(self):
+        self.file_obj.close()
+
+
+class BinaryRecord:
+    """
+    BinaryRecordWriter で書いたファイルを numpy.memmap で読み込んだもの。
+
+    records は読み込みのコピーをしない構造化配列で、各列（host_time, timestamp, raw, speed_delay）は
+    そのビューとして取り出せる。重量と回転数はヘッダの校正値で計算して返す。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file_obj:
+            magic, header_length = _HEADER_PREFIX.unpack(file_obj.read(_HEADER_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} は計測データのバイナリファイルではありません。")
+            self.header = json.loads(file_obj.read(header_length).decode('utf-8'))
+
+        if self.header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"未対応のバイナリファイルのバージョンです: {self.header.get('version')}")
+        dtype = np.dtype([(name, dtype_str) for name, dtype_str in self.header['columns']])
+        offset = _HEADER_PREFIX.size + header_length
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def settings(self):
+        return self.header.get('settings', {})
+
+    @property
+    def host_time(self):
+        return self.records['host_time']
+
+    @property
+    def timestamp(self):
+        return self.records['timestamp']
+
+    @property
+    def raw(self):
+        return self.records['raw']
+
+    @property
+    def speed_delay(self):
+        return self.records['speed_delay']
+
+    @property
+    def weight(self):
+        calibration = self.header['calibration']
+        return raw_to_weight(self.raw.astype(np.float64), calibration['adc1bit'], calibration['scale'], calibration['offset'])
+
+    @property
+    def speed_rpm(self):
+        return delay_to_rpm(self.speed_delay)
+
+
+def open_binary_record(path):
+    """ バイナリの計測データファイルを開く """
+    return BinaryRecord(path)
@@ -0,0 +1,312 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 既定の再標本化の回数と、1回のまとめた近似で扱う再標本の数（メモリは batch_size × データ点数）
+BOOTSTRAP_SAMPLES = 2000
+BOOTSTRAP_BATCH_SIZE = 250
+
+BootstrapResult = collections.namedtuple(
+    'BootstrapResult', ['params', 'lower', 'upper', 'std', 'samples', 'failed', 'confidence', 'method'])
+
+
+def fit_exponential_batch(x, y, b0, weights=None, max_iter=50, tol=1e-10):
+    """
+    a * exp(b * x) + c を、多数の再標本についてまとめて（配列演算で）最小二乗近似する。
+
+    exp_fit.fit_exponential と同じ変数射影法（a, c は厳密に解き、b だけをガウス・ニュートン法で求める）を
+    再標本ごとの行で同時に行う。初期値は全ての行で元のデータの近似の b（b0）を使う。
+
+    Parameters:
+        x (numpy.ndarray): 説明変数（n点。全ての再標本で共通）。
+        y (numpy.ndarray): 目的変数。(B, n) または (n,)（weights で再標本を表す場合）。
+        b0 (float): b の初期値。
+        weights (numpy.ndarray): (B, n) の重み（各点が再標本に選ばれた回数）。Noneなら全て1。
+
+    Returns:
+        tuple: (params, converged)
+            params (numpy.ndarray): (B, 3) の (a, b, c)。
+            converged (numpy.ndarray): (B,) 収束して有限の解が得られたか。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    batch = len(weights) if weights is not None else len(y)
+    y = np.broadcast_to(np.asarray(y, dtype=np.float64), (batch, len(x)))
+    w = np.broadcast_to(np.ones(1) if weights is None else np.asarray(weights, dtype=np.float64), (batch, len(x)))
+
+    # 数値の桁をそろえるため、x を [0, 1] に正規化する（exp_fit.fit_exponential と同じ）
+    x0 = x.min()
+    span = x.max() - x0
+    if span <= 0:
+        return np.full((batch, 3), np.nan), np.zeros(batch, dtype=bool)
+    u = (x - x0) / span
+
+    def project(beta, rows):
+        yr, wr = y[rows], w[rows]
+        sw = wr.sum(axis=1)
+        phi = np.exp(beta[:, None] * u)
+        phi_mean = (wr * phi).sum(axis=1) / sw
+        y_mean = (wr * yr).sum(axis=1) / sw
+        phi_centered = phi - phi_mean[:, None]
+        denominator = (wr * phi_centered * phi_centered).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(denominator > 0, (wr * phi_centered * (yr - y_mean[:, None])).sum(axis=1) / denominator, 0.0)
+        c = y_mean - a * phi_mean
+        residual = yr - (a[:, None] * phi + c[:, None])
+        cost = (wr * residual * residual).sum(axis=1)
+        return phi, phi_centered, denominator, a, c, residual, cost
+
+    beta = np.full(batch, b0 * span)
+    rows = np.arange(batch)
+    phi, phi_centered, denominator, a, c, residual, cost = project(beta, rows)
+    converged = np.zeros(batch, dtype=bool)
+    active = np.isfinite(cost)
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            rows = np.flatnonzero(active)
+            if len(rows) == 0:
+                break
+            wr = w[rows]
+            sw = wr.sum(axis=1)
+            # Kaufman の近似による d(residual)/d(beta)（exp_fit.fit_exponential と同じ）
+            derivative = a[rows, None] * u * phi[rows]
+            derivative -= ((wr * derivative).sum(axis=1) / sw)[:, None]
+            pc = phi_centered[rows]
+            derivative -= ((wr * pc * derivative).sum(axis=1) / denominator[rows])[:, None] * pc
+            jacobian = -derivative
+            jj = (wr * jacobian * jacobian).sum(axis=1)
+            flat = ~(jj > 0) | ~np.isfinite(jj)
+            converged[rows[flat]] = True
+            active[rows[flat]] = False
+            keep = ~flat
+            rows, jacobian, jj, wr = rows[keep], jacobian[keep], jj[keep], wr[keep]
+            if len(rows) == 0:
+                break
+            step = -(wr * jacobian * residual[rows]).sum(axis=1) / jj
+
+            # コストが下がるまで、下がっていない行だけステップ幅を半分にする
+            pending = np.arange(len(rows))
+            for _ in range(30):
+                candidate = project(beta[rows[pending]] + step[pending], rows[pending])
+                accepted = np.isfinite(candidate[6]) & (candidate[6] <= cost[rows[pending]])
+                accepted_rows = rows[pending[accepted]]
+                beta[accepted_rows] += step[pending[accepted]]
+                for array, values in zip((phi, phi_centered, denominator, a, c, residual, cost), candidate):
+                    array[accepted_rows] = values[accepted]
+                done = np.abs(step[pending[accepted]]) < tol * (1.0 + np.abs(beta[accepted_rows]))
+                converged[accepted_rows[done]] = True
+                active[accepted_rows[done]] = False
+                pending = pending[~accepted]
+                if len(pending) == 0:
+                    break
+                step[pending] *= 0.5
+            else:
+                # これ以上コストが下がらない
+                converged[rows[pending]] = True
+                active[rows[pending]] = False
+
+    b = beta / span
+    with np.errstate(over='ignore', invalid='ignore'):
+        params = np.column_stack((a * np.exp(-b * x0), b, c))
+    converged &= np.all(np.isfinite(params), axis=1)
+    return params, converged
+
+
+def _residual_chunk(x, fitted, residual, groups, b0, seed, count):
+    """ 残差の再標本化（groups があれば同じグループの中で）による count 回分の近似 """
+    rng = np.random.default_rng(seed)
+    y = np.empty((count, len(x)))
+    for indices in groups:
+        draws = rng.integers(0, len(indices), size=(count, len(indices)))
+        y[:, indices] = fitted[indices] + residual[indices][draws]
+    return fit_exponential_batch(x, y, b0)
+
+
+def _pairs_chunk(x, y, b0, seed, count):
+    """ データ点の組の再標本化（各点が選ばれた回数を重みにする）による count 回分の近似 """
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(len(x), np.full(len(x), 1 / len(x)), size=count)
+    return fit_exponential_batch(x, y, b0, weights=weights)
+
+
+def _median_chunk(speeds, sorted_groups, median_tables, b0, seed, count):
+    """ 各速度の生データの再標本の中央値を作り、中央値 対 速度 を count 回分近似する """
+    rng = np.random.default_rng(seed)
+    medians = np.column_stack([draw_bootstrap_medians(values, tables, rng, count)
+                               for values, tables in zip(sorted_groups, median_tables)])
+    return fit_exponential_batch(speeds, medians, b0)
+
+
+def bootstrap_median_cdf(n, m=None):
+    """
+    n 個の値から復元抽出した n 個のうち小さい方から m 番目の値（既定は中央値。偶数個のときは下側）が、
+    元の値の小さい方から j 番目（1〜n）以下になる確率（累積分布）。
+
+    m 番目が j 番目以下 ⇔ j 番目以下の値が m 個以上選ばれる ⇔ 二項分布 Bin(n, j / n) が m 以上
+    = 正則化不完全ベータ関数 I_{j/n}(m, n - m + 1)。
+    これを使うと、再標本を実際に作らずに中央値を直接抽出できる（1回あたり O(log n)）。
+    """
+    from scipy.special import betainc
+
+    m = (n + 1) // 2 if m is None else m
+    return betainc(m, n - m + 1, np.arange(1, n + 1) / n)
+
+
+def bootstrap_median_tables(n):
+    """
+    draw_bootstrap_medians で使う表 (cdf, same) を作る。
+
+    cdf は下側の中央値（m = (n + 1) // 2 番目）の bootstrap_median_cdf。n が偶数のとき、中央値は
+    np.median と同じく m 番目と m + 1 番目の平均なので、same[j - 1] に「m 番目が j 番目の値のとき、
+    m + 1 番目も j 番目の値である確率」を入れる（奇数なら same は None）。
+    C_j を j 番目以下が選ばれた個数とすると、m 番目が j 番目 ⇔ C_{j-1} < m <= C_j で、
+    m + 1 番目も j 番目 ⇔ さらに C_j >= m + 1。
+    P(C_{j-1} < m, C_j >= m + 1) = P(C_j >= m + 1) - P(C_{j-1} >= m) + P(C_j = m) ((j - 1) / j)^m。
+    """
+    from scipy.stats import binom
+
+    cdf = bootstrap_median_cdf(n)
+    if n % 2:
+        return cdf, None
+    m = n // 2
+    j = np.arange(1, n + 1)
+    previous = np.concatenate(([0.0], cdf[:-1]))
+    probability = cdf - previous
+    both = bootstrap_median_cdf(n, m + 1) - previous + binom.pmf(m, n, j / n) * ((j - 1) / j) ** m
+    with np.errstate(divide='ignore', invalid='ignore'):
+        same = np.where(probability > 0, np.clip(both, 0, None) / probability, 1.0)
+    return cdf, np.clip(same, 0.0, 1.0)
+
+
+def draw_bootstrap_medians(sorted_values, tables, rng, count):
+    """
+    昇順の値 sorted_values から復元抽出した再標本の中央値（np.median と同じ定義）を、再標本を作らずに count 個抽出する。
+
+    下側の中央値の位置 j を tables の cdf から抽出する。n が偶数なら上側（m + 1 番目）の位置を、
+    確率 same[j - 1] で j、それ以外は j より大きい値の最小の位置とする（m 番目までが j 番目以下に決まると、
+    残りの n - m 個は j + 1〜n 番目から一様に選ばれるので、最小の位置が k より大きい確率は ((n - k) / (n - j))^(n - m)）。
+
+    Parameters:
+        tables (tuple): bootstrap_median_tables(len(sorted_values)) の結果。
+    """
+    cdf, same = tables
+    n = len(sorted_values)
+    lower = np.minimum(np.searchsorted(cdf, rng.random(count)), n - 1)
+    if same is None:
+        return sorted_values[lower]
+    m = n // 2
+    position = lower + 1
+    upper = np.ceil(n - (n - position) * rng.random(count) ** (1 / (n - m))).astype(np.int64)
+    upper = np.clip(upper, position + 1, n)
+    upper = np.where(rng.random(count) < same[lower], position, upper)
+    return (sorted_values[lower] + sorted_values[upper - 1]) / 2
+
+
+def _run_chunks(function, shared, seeds, counts, workers):
+    if workers == 1 or len(seeds) == 1:
+        return [function(*shared, seed, count) for seed, count in zip(seeds, counts)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(function, *shared, seed, count) for seed, count in zip(seeds, counts)]
+        return [future.result() for future in futures]
+
+
+def _summarize(params, chunks, confidence, method):
+    samples = np.concatenate([chunk_params[converged] for chunk_params, converged in chunks])
+    failed = sum(int(np.count_nonzero(~converged)) for _, converged in chunks)
+    tail = (1 - confidence) / 2 * 100
+    if len(samples):
+        lower, upper = np.percentile(samples, [tail, 100 - tail], axis=0)
+        std = samples.std(axis=0, ddof=1) if len(samples) > 1 else np.full(3, np.nan)
+    else:
+        lower = upper = std = np.full(3, np.nan)
+    return BootstrapResult(np.asarray(params, dtype=np.float64), lower, upper, std, samples, failed, confidence, method)
+
+
+def _split(n_boot, batch_size, seed):
+    """ 再標本化を batch_size 回ずつに分け、それぞれの乱数の種を作る（種は分け方やプロセス数によらず決まる） """
+    counts = [min(batch_size, n_boot - start) for start in range(0, n_boot, batch_size)]
+    return np.random.SeedSequence(seed).spawn(len(counts)), counts
+
+
+def bootstrap_exponential(x, y, params, method='residual', groups=None, n_boot=BOOTSTRAP_SAMPLES, seed=0,
+                          confidence=0.95, workers=None, batch_size=BOOTSTRAP_BATCH_SIZE):
+    """
+    a * exp(b * x) + c の近似パラメータの信頼区間をブートストラップ法で求める。
+
+    再標本は batch_size 回分ずつ配列にまとめて fit_exponential_batch で近似し（元の近似の b から始める）、
+    そのまとまりを複数のプロセスで並列に処理する。乱数の種を決めれば、プロセス数によらず同じ結果になる。
+
+    Parameters:
+        x, y (array-like): 近似したデータ。
+        params (array-like): 元のデータの近似パラメータ (a, b, c)。
+        method (str): 'residual'（近似の残差を再標本化して元の曲線に足す）または 'pairs'（データ点を再標本化する）。
+        groups (array-like): method='residual' のとき、各点のグループ（速度の段階など）。残差はグループごとに
+            平均を引いてから同じグループの中で再標本化する（段階ごとにばらつきが違う場合）。
+            Noneなら（既定）全体の残差をそのまま再標本化する。モデルが合っていないときは、グループ内の残差の
+            偏りがそのまま再標本に残るので、グループ分けしない方が区間が偏りにくい。
+        n_boot (int): 再標本化の回数。
+        seed (int): 乱数の種。
+        confidence (float): 信頼区間の信頼係数（パーセンタイル法）。
+        workers (int): プロセス数。1なら並列にしない。Noneならコア数。
+
+    Returns:
+        BootstrapResult: params（元の近似）, lower, upper（信頼区間）, std, samples（収束した再標本の (a, b, c)）,
+        failed（収束しなかった回数）, confidence, method。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    a, b, c = params
+    seeds, counts = _split(n_boot, batch_size, seed)
+    if method == 'residual':
+        fitted = a * np.exp(b * x) + c
+        if groups is None:
+            group_indices = [np.arange(len(x))]
+        else:
+            _, inverse = np.unique(np.asarray(groups), return_inverse=True)
+            group_indices = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+        residual = y - fitted
+        if groups is not None:
+            # 段階ごとの当てはまりのずれ（平均）を再標本に持ち込まない
+            residual = residual - np.bincount(inverse, residual)[inverse] / np.bincount(inverse)[inverse]
+        shared = (x, fitted, residual, group_indices, b)
+        chunks = _run_chunks(_residual_chunk, shared, seeds, counts, workers)
+    elif method == 'pairs':
+        chunks = _run_chunks(_pairs_chunk, (x, y, b), seeds, counts, workers)
+    else:
+        raise ValueError(f"method は 'residual' または 'pairs' です: {method}")
+    return _summarize(params, chunks, confidence, method)
+
+
+def bootstrap_median_fit(speeds, weight_groups, params, n_boot=BOOTSTRAP_SAMPLES, seed=0, confidence=0.95,
+                         workers=None, batch_size=BOOTSTRAP_BATCH_SIZE):
+    """
+    中央値 対 速度 の指数関数近似のパラメータの信頼区間を、各速度の生データを速度ごとに再標本化して求める。
+
+    各速度の再標本の中央値（np.median と同じく、偶数個なら中央の2つの平均）は draw_bootstrap_medians で
+    直接抽出するので、データ点数が多くても速い。
+
+    Parameters:
+        speeds (array-like): 速度（中央値を計算した順）。
+        weight_groups (list): 各速度の重量の配列のリスト。
+        params (array-like): 中央値の近似パラメータ (a, b, c)。
+        その他は bootstrap_exponential と同じ。
+
+    Returns:
+        BootstrapResult（method は 'median'）。
+    """
+    speeds = np.asarray(speeds, dtype=np.float64)
+    sorted_groups = [np.sort(np.asarray(group, dtype=np.float64)) for group in weight_groups]
+    median_tables = [bootstrap_median_tables(len(group)) for group in sorted_groups]
+    seeds, counts = _split(n_boot, batch_size, seed)
+    chunks = _run_chunks(_median_chunk, (speeds, sorted_groups, median_tables, params[1]), seeds, counts, workers)
+    return _summarize(params, chunks, confidence, 'median')
+
+
+def format_intervals(result, names=('a', 'b', 'c')):
+    """ 信頼区間の表示（複数行の文字列） """
+    lines = [f"{int(round(result.confidence * 100))}% 信頼区間 (ブートストラップ, {result.method}, "
+             f"{len(result.samples)}回" + (f", 収束しなかった {result.failed}回" if result.failed else "") + "):"]
+    for name, value, lower, upper, std in zip(names, result.params, result.lower, result.upper, result.std):
+        lines.append(f"  {name} = {value:.4e}  [{lower:.4e}, {upper:.4e}]  (標準誤差 {std:.2e})")
+    return "\n".join(lines)
@@ -0,0 +1,228 @@
+import csv
+import math
+import threading
+
+import numpy as np
+
+from online_stats import RunningStats
+
+# 遅延のヒストグラムの区間（ミリ秒）: 負の値, 0〜0.01ms, 0.01ms〜10秒を対数で60区間, 10秒以上
+LATENCY_BIN_EDGES = np.concatenate(([-np.inf, 0.0], np.logspace(-2, 4, 61), [np.inf]))
+
+CLOCK_SUMMARY_COLUMNS = ['samples', 'offset_s', 'drift_ppm', 'latency_mean_ms', 'latency_p50_ms', 'latency_p95_ms',
+                         'latency_p99_ms', 'latency_max_ms', 'gaps', 'missed_samples', 'max_gap_ms', 'backward_steps']
+
+
+class ClockSync:
+    """
+    PC の時刻（time.perf_counter, 秒）と ESP32 の millis() の対応を計測中に推定し、
+    サンプルごとの伝送遅延と、送信間隔（約10ms）の抜け（取りこぼし）を数える。
+
+    PC で受け取った時刻は「ESP32 で送った時刻 + 遅延（0以上）」なので、
+    host_time - millis/1000 を block_seconds ごとに区切った最小値（遅延が最も小さかったサンプル）に
+    Theil-Sen 法（2点ずつの傾きの中央値。外れ値に強い）で直線を当てはめ、
+        host_time ≈ offset + (1 + drift) * millis / 1000
+    の offset と drift を求める。各サンプルの遅延はこの直線からの差（その時点の推定値で計算する）。
+    メモリは区間の最小値（1秒に1点）と固定区間のヒストグラムだけ。
+
+    Parameters:
+        expected_period_ms (float): ESP32 の送信間隔（ミリ秒）。これの1.5倍を超える間隔を抜けとみなす。
+        block_seconds (float): 最小値をとる区間の長さ（秒）。
+        fit_blocks (int): 直線の当てはめに使う区間の数（新しい方から）。
+        batch_size (int): この件数のサンプルがたまるごとに計算する。
+    """
+
+    def __init__(self, expected_period_ms=10.0, block_seconds=1.0, fit_blocks=300, batch_size=256):
+        self.expected_period_ms = expected_period_ms
+        self.block_seconds = block_seconds
+        self.fit_blocks = fit_blocks
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_count = 0
+
+        self.first_device_s = None
+        self.current_block = None
+        self.current_block_min = math.inf
+        self.envelope_x = []
+        self.envelope_y = []
+        self.offset = None
+        self.drift = 0.0
+
+        self.latency_histogram = np.zeros(len(LATENCY_BIN_EDGES) - 1, dtype=np.int64)
+        self.latency_stats = RunningStats()
+        self.last_latency_ms = math.nan
+        self.sample_count = 0
+        self.last_device_ms = None
+        self.gap_count = 0
+        self.missed_samples = 0
+        self.max_gap_ms = 0.0
+        self.backward_steps = 0
+
+    def update(self, host_time, timestamps_esp32):
+        """
+        受信したサンプルを追加する（受信スレッドから呼ぶ）。
+
+        Parameters:
+            host_time (float or array-like): 受信した時刻（time.perf_counter）。
+            timestamps_esp32 (array-like): 各サンプルの millis()。
+        """
+        with self.lock:
+            self.pending.append((host_time, timestamps_esp32))
+            self.pending_count += len(timestamps_esp32)
+            if self.pending_count >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        """ たまっているサンプルを反映する（lock を取った状態で呼ぶ） """
+        if not self.pending:
+            return
+        device_ms = np.concatenate([np.asarray(chunk[1], dtype=np.float64) for chunk in self.pending])
+        # 受信時刻はたいていスカラーなので np.full で広げる（np.broadcast_to は1回ごとの手間が大きい）
+        host_time = np.concatenate([np.full(len(chunk[1]), chunk[0], dtype=np.float64) if np.ndim(chunk[0]) == 0
+                                    else np.asarray(chunk[0], dtype=np.float64) for chunk in self.pending])
+        self.pending = []
+        self.pending_count = 0
+        if device_ms.size == 0:
+            return
+        self._count_gaps(device_ms)
+        self._update_envelope(host_time, device_ms)
+        self._update_latency(host_time, device_ms)
+        self.sample_count += device_ms.size
+
+    def _count_gaps(self, device_ms):
+        previous = self.last_device_ms if self.last_device_ms is not None else device_ms[0]
+        intervals = np.diff(device_ms, prepend=previous)
+        self.last_device_ms = float(device_ms[-1])
+        gaps = intervals[intervals > 1.5 * self.expected_period_ms]
+        if gaps.size:
+            self.gap_count += int(gaps.size)
+            self.missed_samples += int(np.sum(np.round(gaps / self.expected_period_ms) - 1))
+            self.max_gap_ms = max(self.max_gap_ms, float(gaps.max()))
+        # ESP32 の再起動などで millis() が戻った回数
+        self.backward_steps += int(np.count_nonzero(intervals < 0))
+
+    def _update_envelope(self, host_time, device_ms):
+        device_s = device_ms / 1000.0
+        if self.first_device_s is None:
+            self.first_device_s = float(device_s[0])
+        offsets = host_time - device_s
+        blocks = np.floor((device_s - self.first_device_s) / self.block_seconds).astype(np.int64)
+        # 区間ごとの最小値（millis は増える順に届くので、区間の変わり目で区切る）
+        starts = np.flatnonzero(np.diff(blocks, prepend=blocks[0] - 1))
+        block_ids = blocks[starts]
+        block_mins = np.minimum.reduceat(offsets, starts)
+        added = False
+        for block_id, block_min in zip(block_ids.tolist(), block_mins.tolist()):
+            if block_id == self.current_block:
+                self.current_block_min = min(self.current_block_min, block_min)
+                continue
+            if self.current_block is not None:
+                # 前の区間は終わったので、最小値を当てはめに使う
+                self.envelope_x.append(self.first_device_s + (self.current_block + 0.5) * self.block_seconds)
+                self.envelope_y.append(self.current_block_min)
+                added = True
+            self.current_block = block_id
+            self.current_block_min = block_min
+        if added or self.offset is None:
+            self._fit()
+
+    def _fit(self):
+        x = np.asarray(self.envelope_x[-self.fit_blocks:])
+        y = np.asarray(self.envelope_y[-self.fit_blocks:])
+        if x.size < 2:
+            # まだ区間が2つ揃っていない: ずれは0として、これまでの最小値を offset にする
+            candidates = y.tolist() + [self.current_block_min]
+            self.offset, self.drift = float(min(candidates)), 0.0
+            return
+        i, j = np.triu_indices(x.size, k=1)
+        dx = x[j] - x[i]
+        valid = dx != 0
+        drift = float(np.median((y[j] - y[i])[valid] / dx[valid])) if valid.any() else 0.0
+        self.drift = drift
+        self.offset = float(np.median(y - drift * x))
+
+    def _update_latency(self, host_time, device_ms):
+        latency_ms = (host_time - (self.offset + (1.0 + self.drift) * device_ms / 1000.0)) * 1000.0
+        bins = np.searchsorted(LATENCY_BIN_EDGES, latency_ms, side='right') - 1
+        self.latency_histogram += np.bincount(bins, minlength=self.latency_histogram.size)[:self.latency_histogram.size]
+        self.latency_stats.update(latency_ms)
+        self.last_latency_ms = float(latency_ms[-1])
+
+    def device_ms(self, host_time):
+        """
+        PC の時刻（time.perf_counter）を、その時点の推定で ESP32 の millis() に直す。
+        まだ推定できていなければNone。
+        """
+        with self.lock:
+            self._flush()
+            if self.offset is None:
+                return None
+            return (host_time - self.offset) / (1.0 + self.drift) * 1000.0
+
+    def _latency_quantile(self, q):
+        """ ヒストグラムから遅延の分位点（その区間の上端）を求める """
+        total = self.latency_histogram.sum()
+        if total == 0:
+            return math.nan
+        index = int(np.searchsorted(np.cumsum(self.latency_histogram), q * total))
+        return float(LATENCY_BIN_EDGES[min(index + 1, len(LATENCY_BIN_EDGES) - 2)])
+
+    def summary(self):
+        """ CLOCK_SUMMARY_COLUMNS の辞書 """
+        with self.lock:
+            self._flush()
+            stats = self.latency_stats
+            return {
+                'samples': self.sample_count,
+                'offset_s': self.offset,
+                'drift_ppm': self.drift * 1e6,
+                'latency_mean_ms': float(stats.mean) if stats.count else math.nan,
+                'latency_p50_ms': self._latency_quantile(0.5),
+                'latency_p95_ms': self._latency_quantile(0.95),
+                'latency_p99_ms': self._latency_quantile(0.99),
+                'latency_max_ms': stats.max if stats.count else math.nan,
+                'gaps': self.gap_count,
+                'missed_samples': self.missed_samples,
+                'max_gap_ms': self.max_gap_ms,
+                'backward_steps': self.backward_steps,
+            }
+
+    def status_text(self):
+        """ 状態表示の1行に付け加える文字列 """
+        with self.lock:
+            self._flush()
+            if self.sample_count == 0:
+                return ""
+            return (f"遅延 {self.last_latency_ms:.1f}ms (p95 {self._latency_quantile(0.95):.1f}ms)  "
+                    f"取りこぼし {self.missed_samples}")
+
+    def print_summary(self):
+        s = self.summary()
+        print("\n--- PCとESP32の時刻の対応・遅延 ---")
+        if s['samples'] == 0:
+            print("データがありません。")
+            return
+        print(f"サンプル数: {s['samples']}  時刻のずれ(drift): {s['drift_ppm']:.1f} ppm")
+        print(f"遅延: 平均 {s['latency_mean_ms']:.2f} ms, p50 ≤{s['latency_p50_ms']:.2f} ms, "
+              f"p95 ≤{s['latency_p95_ms']:.2f} ms, p99 ≤{s['latency_p99_ms']:.2f} ms, 最大 {s['latency_max_ms']:.2f} ms")
+        print(f"送信間隔の抜け: {s['gaps']}回, 取りこぼし推定 {s['missed_samples']}サンプル, "
+              f"最大間隔 {s['max_gap_ms']:.0f} ms, millisの巻き戻り {s['backward_steps']}回")
+        counts = self.latency_histogram
+        peak = counts.max()
+        for index in np.flatnonzero(counts):
+            lo, hi = LATENCY_BIN_EDGES[index], LATENCY_BIN_EDGES[index + 1]
+            bar = '#' * max(1, int(40 * counts[index] / peak))
+            print(f"  {lo:>9.3g} 〜 {hi:<9.3g} ms {counts[index]:>9} {bar}")
+
+    def write_csv(self, file_path):
+        """ 概要（1行目）と遅延のヒストグラムをCSVに書き出す """
+        summary = self.summary()
+        with open(file_path, 'w', newline='') as file_obj:
+            csv_writer = csv.writer(file_obj)
+            csv_writer.writerow(CLOCK_SUMMARY_COLUMNS)
+            csv_writer.writerow([summary[column] for column in CLOCK_SUMMARY_COLUMNS])
+            csv_writer.writerow([])
+            csv_writer.writerow(['Latency From(ms)', 'Latency To(ms)', 'Count'])
+            for index, count in enumerate(self.latency_histogram.tolist()):
+                csv_writer.writerow([LATENCY_BIN_EDGES[index], LATENCY_BIN_EDGES[index + 1], count])
@@ -1,16 +1,74 @@
-import pandas as pd
-import japanize_matplotlib # これを追加するだけ
-import matplotlib.pyplot as plt
-from matplotlib.ticker import ScalarFormatter
+# pandas, scipy, matplotlib（と japanize_matplotlib）は読み込みに時間がかかるので、使う関数の中で読み込む
+# （batch_analysis のワーカーのように描画しない使い方では matplotlib を読み込まない）
 import numpy as np
-from scipy.optimize import curve_fit
 import os
+import collections
+from binary_record import open_binary_record
+from exp_fit import fit_exponential
+from online_stats import QuantileSketch, RunningExponentialFit, ReservoirSample
+from step_index import index_matches_data, load_step_index, segment_boundaries_match, segment_slices
+from fit_models import REGISTRY, compare_model_sets, decimate_series, format_ranking
+from bootstrap import BOOTSTRAP_SAMPLES, bootstrap_exponential, bootstrap_median_fit, format_intervals
+from serial_ingest import delay_to_rpm, raw_to_weight
+
+REQUIRED_COLUMNS = ['Timestamp(ESP32)', 'weight', 'speed(rpm)']
+
+# ファイルがこの大きさ以上なら、plot_and_analyze_data は分割読み込み（chunked）で解析する
+CHUNKED_ANALYSIS_MIN_BYTES = 256 * 1024 * 1024
+# 分割読み込みで1回に読む行数
+CHUNK_ROWS = 1000000
+# 散布図の点がこの数を超えたら、全点を描く代わりに2次元ヒストグラムの濃淡画像で描く
+DENSITY_PLOT_MIN_POINTS = 50000
+# 濃淡画像の区間数（速度方向, 重量方向）
+DENSITY_PLOT_BINS = (200, 300)
+# 段階の索引（_esp32_steps.csv）があるとき、各段階の始まりからこの秒数のデータは過渡応答として中央値に使わない
+STEP_SETTLE_SECONDS = 0.0
+# 近似パラメータの信頼区間（ブートストラップ法）の乱数の種（同じデータなら毎回同じ区間になる）
+BOOTSTRAP_SEED = 0
+
+ChunkedSummary = collections.namedtuple(
+    'ChunkedSummary', ['count', 'time_fitter', 'unique_speeds', 'median_weights', 'sample_speeds', 'sample_weights',
+                       'index_boundaries_match'])
 
 # --- 指数関数モデルの定義 ---
 def exponential_func(x, a, b, c):
     """指数関数: a * exp(b * x) + c"""
     return a * np.exp(b * x) + c
 
+# --- 実測値の描画 ---
+def plot_measured_points(ax, speeds_rpm, weights, label, density_threshold=None, bins=DENSITY_PLOT_BINS):
+    """
+    実測値を描く。点の数が density_threshold 以下なら散布図、超えたら2次元ヒストグラムを
+    1枚の画像（点の数を対数の濃淡で表す）として描く。画像の描画時間と大きさは点の数によらない。
+    density_threshold を省略すると DENSITY_PLOT_MIN_POINTS を使う。
+    """
+    if density_threshold is None:
+        density_threshold = DENSITY_PLOT_MIN_POINTS
+    if len(weights) <= density_threshold:
+        ax.scatter(speeds_rpm, weights, alpha=0.25, label=label, color='silver', s=25, zorder=1)
+        return
+
+    x_range = [float(np.min(speeds_rpm)), float(np.max(speeds_rpm))]
+    y_range = [float(np.min(weights)), float(np.max(weights))]
+    for value_range, bin_count in zip((x_range, y_range), bins):
+        if value_range[0] == value_range[1]:
+            value_range[0] -= 0.5
+            value_range[1] += 0.5
+        # 端の値が区間の境目で半分に切れないように、半区間ずつ広げる
+        half_bin = (value_range[1] - value_range[0]) / (bin_count - 1) / 2
+        value_range[0] -= half_bin
+        value_range[1] += half_bin
+    from matplotlib.colors import LogNorm
+    counts, x_edges, y_edges = np.histogram2d(speeds_rpm, weights, bins=bins, range=[x_range, y_range])
+    # 点のない区間は透明にする
+    counts = np.ma.masked_equal(counts.T, 0)
+    image = ax.imshow(counts, origin='lower', aspect='auto', interpolation='nearest', cmap='Greys',
+                      norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)), alpha=0.6,
+                      extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]), zorder=1)
+    # 凡例用（画像は凡例に出ないため）
+    ax.scatter([], [], marker='s', color='silver', s=25, label=f'{label} 濃淡表示')
+    ax.figure.colorbar(image, ax=ax, label='点の数', pad=0.01)
+
 # --- input()経由でCSVファイルパスを取得する関数 ---
 def get_csv_path_from_input():
     """ユーザーにCSVファイルパスの入力を促し、それを返す。"""
@@ -25,8 +83,8 @@ def get_csv_path_from_input():
             retry = input("再入力しますか？ (y/n): ").lower()
             if retry != 'y':
                 return None
-        elif not file_path.lower().endswith('_esp32_data.csv'):
-            print("警告: ファイル名が '_esp32_data.csv' で終わっていません。期待されるファイル形式ですか？")
+        elif not file_path.lower().endswith(('_esp32_data.csv', '_esp32_data.bin')):
+            print("警告: ファイル名が '_esp32_data.csv' または '_esp32_data.bin' で終わっていません。期待されるファイル形式ですか？")
             confirm = input("このファイルで続行しますか？ (y/n): ").lower()
             if confirm == 'y':
                 return file_path
@@ -36,59 +94,407 @@ def get_csv_path_from_input():
         else:
             return file_path
 
+# --- 計測データの読み込み ---
+def load_data_arrays(data_filepath):
+    """
+    計測データ（_esp32_data.csv または _esp32_data.bin）から
+    Timestamp(ESP32), weight, speed(rpm) の配列を読み込む。
+
+    バイナリ形式は numpy.memmap で読むので、テキストの解析が不要で大きなファイルでもすぐに読める。
+
+    Returns:
+        tuple: (timestamps_esp32, weights, speeds_rpm)。読み込めなかった場合はNone。
+    """
+    if data_filepath.lower().endswith('.bin'):
+        record = open_binary_record(data_filepath)
+        print(f"Successfully loaded {data_filepath} ({len(record)} records)")
+        print("Settings:", record.settings)
+        if len(record) == 0:
+            print("No valid data remaining after cleaning. Cannot proceed.")
+            return None
+        return record.timestamp.astype(np.float64), record.weight, record.speed_rpm
+
+    import pandas as pd
+    df = pd.read_csv(data_filepath)
+    print(f"Successfully loaded {data_filepath}")
+    print("Columns found:", df.columns.tolist())
+
+    required_cols = ['Timestamp(ESP32)', 'weight', 'speed(rpm)']
+    missing_cols = [col for col in required_cols if col not in df.columns]
+    if missing_cols:
+        print(f"Error: Missing required columns: {', '.join(missing_cols)}")
+        print(f"Please ensure the CSV contains: {', '.join(required_cols)}")
+        return None
+
+    for col in required_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.dropna(subset=required_cols, inplace=True)
+
+    if df.empty:
+        print("No valid data remaining after cleaning. Cannot proceed.")
+        return None
+
+    return df['Timestamp(ESP32)'].values, df['weight'].values, df['speed(rpm)'].values
+
+# --- 分割読み込みによる解析（メモリに載らない大きな計測データ用） ---
+def iter_data_chunks(data_filepath, chunk_rows=CHUNK_ROWS):
+    """
+    計測データを chunk_rows 行ずつ読み、(timestamps_esp32, weights, speeds_rpm) の配列を順に返す。
+
+    CSVは必要な3列だけを float64 として読む（数値でない値があれば、その読み込みだけ
+    load_data_arrays と同じく数値に変換できない行を捨てる方法に切り替える）。
+    バイナリ形式は memmap を区切って読む。
+    """
+    if data_filepath.lower().endswith('.bin'):
+        record = open_binary_record(data_filepath)
+        calibration = record.header['calibration']
+        # record.weight / record.speed_rpm はファイル全体を変換するので、区切った分だけを変換する
+        for start in range(0, len(record), chunk_rows):
+            stop = start + chunk_rows
+            weights = raw_to_weight(record.raw[start:stop].astype(np.float64),
+                                    calibration['adc1bit'], calibration['scale'], calibration['offset'])
+            yield record.timestamp[start:stop].astype(np.float64), weights, delay_to_rpm(record.speed_delay[start:stop])
+        return
+
+    import pandas as pd
+    header = pd.read_csv(data_filepath, nrows=0).columns
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in header]
+    if missing_cols:
+        raise KeyError(', '.join(missing_cols))
+
+    def read_chunks(dtype):
+        return pd.read_csv(data_filepath, usecols=REQUIRED_COLUMNS, dtype=dtype, chunksize=chunk_rows)
+
+    chunks_done = 0
+    try:
+        for chunk in read_chunks({col: np.float64 for col in REQUIRED_COLUMNS}):
+            chunk = chunk.dropna()
+            chunks_done += 1
+            yield chunk[REQUIRED_COLUMNS[0]].values, chunk[REQUIRED_COLUMNS[1]].values, chunk[REQUIRED_COLUMNS[2]].values
+        return
+    except ValueError:
+        pass
+    # 数値でない値が含まれていた。読み終えた分を飛ばして、文字列として読み直す
+    for index, chunk in enumerate(read_chunks(str)):
+        if index < chunks_done:
+            continue
+        for col in REQUIRED_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        chunk = chunk.dropna()
+        yield chunk[REQUIRED_COLUMNS[0]].values, chunk[REQUIRED_COLUMNS[1]].values, chunk[REQUIRED_COLUMNS[2]].values
+
+
+def summarize_data_chunked(data_filepath, chunk_rows=CHUNK_ROWS, sample_points=200000, segments=None,
+                           settle_seconds=STEP_SETTLE_SECONDS):
+    """
+    計測データを分割して読みながら、解析に必要な量だけを集計する（使うメモリはファイルの大きさによらない）。
+
+    - 速度ごとの重量の中央値: 速度ごとの QuantileSketch（相対誤差 0.1%）。segments（段階の索引）を渡すと、
+      各段階の行の範囲を指令した速度ごとに集める（settle_seconds は compute_median_by_step と同じ）
+    - 重量 対 時間: RunningExponentialFit で間引いた系列
+    - グラフ用: 一様に選んだ sample_points 点の標本
+
+    Returns:
+        ChunkedSummary。有効なデータがなければNone。index_boundaries_match は、segments の各段階の境目の行の
+        Timestamp(ESP32) が読み込んだ行と同じだったか（step_index.segment_boundaries_match。segments がなければTrue）。
+    """
+    count = 0
+    boundaries_match = True
+    time_fitter = RunningExponentialFit()
+    sketches = {}
+    sample = ReservoirSample(sample_points)
+    for timestamps_esp32, weights, speeds_rpm in iter_data_chunks(data_filepath, chunk_rows):
+        if len(weights) == 0:
+            continue
+        row_offset = count
+        count += len(weights)
+        time_fitter.update(timestamps_esp32, weights)
+        sample.update(speeds_rpm, weights)
+        if segments is not None:
+            boundaries_match = boundaries_match and segment_boundaries_match(segments, timestamps_esp32, row_offset)
+            # 段階の索引の行の範囲をそのまま切り出す
+            pieces = [(segment.rpm, weights[rows])
+                      for segment, rows in segment_slices(segments, timestamps_esp32, row_offset, settle_seconds)]
+        else:
+            # 速度ごとに並べ替えて、まとめてスケッチに追加する
+            unique_speeds, inverse, group_sizes = np.unique(speeds_rpm, return_inverse=True, return_counts=True)
+            grouped_weights = np.split(weights[np.argsort(inverse, kind='stable')], np.cumsum(group_sizes)[:-1])
+            pieces = zip(unique_speeds.tolist(), grouped_weights)
+        for speed, group in pieces:
+            if speed not in sketches:
+                sketches[speed] = QuantileSketch()
+            sketches[speed].update(group)
+
+    print(f"Successfully loaded {data_filepath} ({count} records, chunked)")
+    if count == 0:
+        print("No valid data remaining after cleaning. Cannot proceed.")
+        return None
+    unique_speeds = np.array(sorted(sketches))
+    median_weights = np.array([sketches[speed].quantile(0.5) for speed in unique_speeds])
+    sample_speeds, sample_weights = sample.columns
+    return ChunkedSummary(count, time_fitter, unique_speeds, median_weights, sample_speeds, sample_weights,
+                          boundaries_match)
+
+
+def fit_weight_vs_time_chunked(data_filepath, summary, chunk_rows=CHUNK_ROWS):
+    """
+    重量 対 時間 の指数関数近似を、summarize_data_chunked で間引いた系列で行う。
+    MSE は全データに対する値をもう一度ファイルを読んで計算する（fit_weight_vs_time と同じ意味の値）。
+
+    Returns:
+        tuple: (params, mse)。params の b は最初のサンプルからの経過時間に対する値。
+    Raises:
+        RuntimeError: 最適なパラメータが見つからなかった場合。
+    """
+    params = summary.time_fitter.fit().params
+    t0 = summary.time_fitter.t0
+    squared_error = 0.0
+    count = 0
+    for timestamps_esp32, weights, _ in iter_data_chunks(data_filepath, chunk_rows):
+        residual = weights - exponential_func(timestamps_esp32 - t0, *params)
+        squared_error += np.dot(residual, residual)
+        count += len(weights)
+    return params, squared_error / count
+
+
+# --- 解析処理（表示・プロットなし。batch_analysis.py からも使う） ---
+def fit_weight_vs_time(time_for_fit, weights, method='varpro'):
+    """
+    重量 対 時間 の指数関数近似を行う。
+
+    Parameters:
+        method (str): 'varpro'（exp_fit.fit_exponential: 変数射影法＋解析的ヤコビアン）
+            または 'curve_fit'（従来の初期値推定と数値微分による curve_fit）。
+
+    Returns:
+        tuple: (params, mse)。params は (a, b, c)。
+    Raises:
+        RuntimeError: 最適なパラメータが見つからなかった場合（curve_fitと同じ）。
+    """
+    if method == 'varpro':
+        result = fit_exponential(time_for_fit, weights)
+        return result.params, result.mse
+
+    initial_c = np.mean(weights[-int(len(weights)*0.1):]) if len(weights) >= 10 else np.mean(weights)
+    initial_a = weights[0] - initial_c
+    if np.isclose(initial_a, 0): initial_a = 1.0 if weights[0] > initial_c else -1.0 if weights[0] < initial_c else 1.0
+
+    initial_b = -1e-5 # Default guess
+    if len(weights) > 1 and time_for_fit[-1] > time_for_fit[0]:
+        mid_idx = len(weights) // 2
+        if mid_idx > 0 and not np.isclose(initial_a, 0) and time_for_fit[mid_idx] > 1e-9 :
+            val_for_log_b = (weights[mid_idx] - initial_c) / initial_a
+            if val_for_log_b > 1e-9:
+               initial_b = np.log(val_for_log_b) / time_for_fit[mid_idx]
+               if not np.isfinite(initial_b): initial_b = -1e-5
+            elif (weights[mid_idx] - initial_c) * initial_a < 0:
+                initial_b = 1e-5 if initial_a < 0 else -1e-5
+
+    p0_time = [initial_a, initial_b, initial_c]
+    from scipy.optimize import curve_fit
+    params_time, _ = curve_fit(exponential_func, time_for_fit, weights, p0=p0_time, maxfev=20000)
+    weight_approximated_vs_time = exponential_func(time_for_fit, *params_time)
+    mse_time_fit = np.mean((weights - weight_approximated_vs_time)**2)
+    return params_time, mse_time_fit
+
+def group_weights_by_step(segments, timestamps_esp32, weights, settle_seconds=STEP_SETTLE_SECONDS):
+    """
+    段階の索引（step_index.load_step_index）の行の範囲を切り出して、指令した速度(rpm)ごとに重量をまとめる。
+    同じ速度の段階が複数あればまとめる。各段階の始まりから settle_seconds 秒のデータは除く。
+
+    Returns:
+        tuple: (speeds, weight_groups)。速度の昇順と、各速度の重量の配列のリスト。
+    """
+    groups = collections.defaultdict(list)
+    for segment, rows in segment_slices(segments, timestamps_esp32, settle_seconds=settle_seconds):
+        groups[segment.rpm].append(weights[rows])
+    speeds = np.array(sorted(groups), dtype=np.float64)
+    return speeds, [np.concatenate(groups[speed]) for speed in speeds.tolist()]
+
+def compute_median_by_step(segments, timestamps_esp32, weights, settle_seconds=STEP_SETTLE_SECONDS):
+    """
+    段階の索引で切り出した、指令した速度(rpm)ごとの重量の中央値を計算する（group_weights_by_step）。
+
+    Returns:
+        tuple: (speeds, median_weights)。速度の昇順。
+    """
+    speeds, weight_groups = group_weights_by_step(segments, timestamps_esp32, weights, settle_seconds)
+    return speeds, np.array([np.median(group) for group in weight_groups])
+
+def weight_groups_by_speed_or_step(data_filepath, timestamps_esp32, weights, speeds_rpm,
+                                   settle_seconds=STEP_SETTLE_SECONDS):
+    """
+    段階の索引があればそれで段階ごとに切り出し（group_weights_by_step）、なければ speed(rpm) の値で
+    重量をまとめる。
+
+    Returns:
+        tuple: (speeds, weight_groups, used_index)。used_index は段階の索引を使ったかどうか。
+    """
+    segments = load_step_index(data_filepath)
+    if segments is not None and index_matches_data(segments, len(weights), timestamps_esp32):
+        return group_weights_by_step(segments, timestamps_esp32, weights, settle_seconds) + (True,)
+    speeds, inverse = np.unique(speeds_rpm, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    weight_groups = np.split(np.asarray(weights)[order], np.cumsum(np.bincount(inverse))[:-1])
+    return speeds, weight_groups, False
+
+def fit_median_vs_speed(unique_speeds, median_weights_at_speeds, method='varpro'):
+    """
+    中央値に基づいた 重量 対 速度(rpm) の指数関数近似を行う。
+
+    Parameters:
+        method (str): 'varpro' または 'curve_fit'（fit_weight_vs_time と同じ）。
+
+    Returns:
+        tuple: (params, mse)。mse は中央値に対する平均二乗誤差。
+    Raises:
+        RuntimeError: 最適なパラメータが見つからなかった場合（curve_fitと同じ）。
+    """
+    if method == 'varpro':
+        result = fit_exponential(unique_speeds, median_weights_at_speeds)
+        return result.params, result.mse
+
+    # unique_speeds è già ordinato grazie a sort_index().values
+    guess_c_s_median = np.min(median_weights_at_speeds)
+    guess_a_s_median = median_weights_at_speeds[0] - guess_c_s_median
+    if np.isclose(guess_a_s_median, 0):
+        guess_a_s_median = np.median(median_weights_at_speeds) - guess_c_s_median
+    if np.isclose(guess_a_s_median, 0): guess_a_s_median = 1.0
+
+    if len(median_weights_at_speeds) > 1 and median_weights_at_speeds[-1] > median_weights_at_speeds[0] + 1e-6: # Aggiunta tolleranza
+        guess_b_s_median = 1e-3
+    elif len(median_weights_at_speeds) > 1 and median_weights_at_speeds[-1] < median_weights_at_speeds[0] - 1e-6:
+        guess_b_s_median = -1e-3
+    else: # Piatto o singolo punto per b
+        guess_b_s_median = 1e-9 if len(median_weights_at_speeds) > 1 else 0.0
+
+
+    p0_s_median = [guess_a_s_median, guess_b_s_median, guess_c_s_median]
+    from scipy.optimize import curve_fit
+
+    params_s_m, _ = curve_fit(
+        exponential_func,
+        unique_speeds,
+        median_weights_at_speeds,
+        p0=p0_s_median,
+        maxfev=40000 # Aumentato maxfev per dati potenzialmente più difficili (pochi punti)
+    )
+    mse_speed_fit_median = np.mean((median_weights_at_speeds - exponential_func(unique_speeds, *params_s_m))**2)
+    return params_s_m, mse_speed_fit_median
+
 # --- メインのプロットおよび解析関数 ---
-def plot_and_analyze_data(csv_filepath):
+def compare_candidate_models(unique_speeds, median_weights, time_points, workers=None):
     """
-    CSVからデータを読み込み、重量 対 時間の指数関数近似を行い、
+    fit_models に登録された全ての候補モデル（重量 対 速度(rpm) と 重量 対 時間）を、モデルごとに別プロセスで近似して比べる。
+
+    Parameters:
+        unique_speeds, median_weights (numpy.ndarray): 速度ごとの重量の中央値（Noneなら速度のモデルは比べない）。
+        time_points (tuple): (経過時間, 重量)。TIME_MODEL_MAX_POINTS 点以下に間引いたもの（Noneなら時間のモデルは比べない）。
+        workers (int): プロセス数（Noneならモデルの数とコア数の小さい方）。
+
+    Returns:
+        dict: 'speed' / 'time' → fit_models.ModelFitResult のリスト（AICの小さい順）。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    series = {}
+    if unique_speeds is not None and len(unique_speeds) > 0:
+        series['speed'] = (unique_speeds, median_weights)
+    if time_points is not None and len(time_points[0]) > 0:
+        series['time'] = time_points
+    if not series:
+        return {}
+    task_count = sum(len(REGISTRY[kind]) for kind in series)
+    with ProcessPoolExecutor(max_workers=workers or min(task_count, os.cpu_count() or 1)) as executor:
+        return compare_model_sets(series, executor)
+
+def bootstrap_fit_intervals(time_points, params_time, params_speed, median_speeds=None, weight_groups=None,
+                            n_boot=BOOTSTRAP_SAMPLES, seed=BOOTSTRAP_SEED, workers=None):
+    """
+    重量 対 時間 と 中央値に基づいた 重量 対 速度 の指数関数近似のパラメータの信頼区間を、ブートストラップ法で求める。
+
+    重量 対 時間 は区間平均で間引いた系列の残差を全体で（速度の段階に分けずに）再標本化し、
+    重量 対 速度 は各速度の生データを速度ごとに再標本化して中央値を求め直す。
+
+    Parameters:
+        time_points (tuple): (経過時間, 重量)。decimate_series で間引いたもの（Noneなら時間は求めない）。
+        params_time, params_speed (array-like): 元の近似パラメータ（Noneならその近似は求めない）。
+        median_speeds, weight_groups: 速度と、各速度の重量の配列のリスト（weight_groups_by_speed_or_step）。
+        workers (int): プロセス数（Noneならコア数）。
+
+    Returns:
+        dict: 'time' / 'speed' → bootstrap.BootstrapResult。
+    """
+    intervals = {}
+    if params_time is not None and time_points is not None and len(time_points[0]) > 3:
+        intervals['time'] = bootstrap_exponential(time_points[0], time_points[1], params_time, n_boot=n_boot,
+                                                  seed=seed, workers=workers)
+    if params_speed is not None and weight_groups is not None and len(weight_groups) > 3:
+        intervals['speed'] = bootstrap_median_fit(median_speeds, weight_groups, params_speed, n_boot=n_boot,
+                                                  seed=seed, workers=workers)
+    return intervals
+
+def plot_and_analyze_data(csv_filepath, mode='auto', chunk_rows=CHUNK_ROWS, settle_seconds=STEP_SETTLE_SECONDS,
+                          compare_models=False, bootstrap_samples=0):
+    """
+    CSV（またはバイナリ）からデータを読み込み、重量 対 時間の指数関数近似を行い、
     各速度毎の重量中央値を計算・プロットし、その中央値データで指数関数近似を行う。
+
+    Parameters:
+        mode (str): 'memory'（全データを読み込む）, 'chunked'（分割して読み、メモリ使用量を一定に保つ）,
+            'auto'（ファイルが CHUNKED_ANALYSIS_MIN_BYTES 以上なら chunked）。
+            chunked の結果は memory と次の範囲で一致する: 中央値は相対誤差 0.1% 以内、
+            重量 対 時間 の近似は間引いた系列（最大4096点の区間平均）によるため、パラメータは
+            ノイズの大きさに応じてわずかに異なる（MSE は全データに対して計算）。
+            散布図は一様に選んだ最大20万点で描く。
+        settle_seconds (float): 段階の索引（_esp32_steps.csv）があるとき、各段階の始まりから除く秒数。
+            索引がなければ従来どおり speed(rpm) の値ごとに中央値を計算する。
+        compare_models (bool): Trueなら fit_models の候補モデルも近似して AIC/BIC の順に並べ、最良のモデルを描く
+            （モデルごとにプロセスを起動するので時間がかかる。既定では行わない）。
+        bootstrap_samples (int): 指数関数近似のパラメータの信頼区間を求めるブートストラップの回数
+            （0なら求めない。解析の時間が数倍になるので既定では求めない。batch_analysis は既定で求める）。
+            chunked では生データを速度ごとに持たないので、重量 対 速度 の信頼区間は求めない。
     """
+    # pandas は CSV を読むときだけ、matplotlib（と japanize_matplotlib）はグラフを描く直前に読み込む
+    empty_data_errors = ()
     try:
-        df = pd.read_csv(csv_filepath)
-        print(f"Successfully loaded {csv_filepath}")
-        print("Columns found:", df.columns.tolist())
-
-        required_cols = ['Timestamp(ESP32)', 'weight', 'speed(rpm)']
-        missing_cols = [col for col in required_cols if col not in df.columns]
-        if missing_cols:
-            print(f"Error: Missing required columns: {', '.join(missing_cols)}")
-            print(f"Please ensure the CSV contains: {', '.join(required_cols)}")
-            return
-
-        for col in required_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.dropna(subset=required_cols, inplace=True)
-
-        if df.empty:
-            print("No valid data remaining after cleaning. Cannot proceed.")
-            return
+        if not csv_filepath.lower().endswith('.bin'):
+            import pandas as pd
+            empty_data_errors = pd.errors.EmptyDataError
+        if mode == 'auto':
+            mode = 'chunked' if os.path.getsize(csv_filepath) >= CHUNKED_ANALYSIS_MIN_BYTES else 'memory'
 
-        timestamps_esp32 = df['Timestamp(ESP32)'].values
-        weights = df['weight'].values
-        speeds_rpm = df['speed(rpm)'].values # 全データ点の速度
-        time_for_fit = timestamps_esp32 - timestamps_esp32[0]
+        if mode == 'chunked':
+            segments = load_step_index(csv_filepath)
+            summary = summarize_data_chunked(csv_filepath, chunk_rows, segments=segments,
+                                             settle_seconds=settle_seconds)
+            if summary is not None and segments is not None and not (
+                    index_matches_data(segments, summary.count) and summary.index_boundaries_match):
+                print("段階の索引がデータの行と合わないので、speed(rpm) の値ごとに集計し直します。")
+                summary = summarize_data_chunked(csv_filepath, chunk_rows)
+                segments = None
+            if summary is None:
+                return
+            # 散布図は標本で描く
+            speeds_rpm, weights = summary.sample_speeds, summary.sample_weights
+            point_count = summary.count
+            fit_time = lambda: fit_weight_vs_time_chunked(csv_filepath, summary, chunk_rows)
+            time_points = lambda: summary.time_fitter.points()
+        else:
+            loaded = load_data_arrays(csv_filepath)
+            if loaded is None:
+                return
+            timestamps_esp32, weights, speeds_rpm = loaded # speeds_rpm: 全データ点の速度
+            time_for_fit = timestamps_esp32 - timestamps_esp32[0]
+            point_count = len(weights)
+            fit_time = lambda: fit_weight_vs_time(time_for_fit, weights)
+            time_points = lambda: decimate_series(time_for_fit, weights)
 
-        # --- 重量 対 時間 の指数関数近似 (これは変更なし) ---
-        if len(time_for_fit) > 3 and len(weights) > 3:
+        # --- 重量 対 時間 の指数関数近似 ---
+        params_time = None
+        if point_count > 3:
             try:
-                initial_c = np.mean(weights[-int(len(weights)*0.1):]) if len(weights) >= 10 else np.mean(weights)
-                initial_a = weights[0] - initial_c
-                if np.isclose(initial_a, 0): initial_a = 1.0 if weights[0] > initial_c else -1.0 if weights[0] < initial_c else 1.0
-
-                initial_b = -1e-5 # Default guess
-                if len(weights) > 1 and time_for_fit[-1] > time_for_fit[0]:
-                    mid_idx = len(weights) // 2
-                    if mid_idx > 0 and not np.isclose(initial_a, 0) and time_for_fit[mid_idx] > 1e-9 :
-                        val_for_log_b = (weights[mid_idx] - initial_c) / initial_a
-                        if val_for_log_b > 1e-9:
-                           initial_b = np.log(val_for_log_b) / time_for_fit[mid_idx]
-                           if not np.isfinite(initial_b): initial_b = -1e-5
-                        elif (weights[mid_idx] - initial_c) * initial_a < 0:
-                            initial_b = 1e-5 if initial_a < 0 else -1e-5
-                
-                p0_time = [initial_a, initial_b, initial_c]
-                params_time, _ = curve_fit(exponential_func, time_for_fit, weights, p0=p0_time, maxfev=20000)
-                weight_approximated_vs_time = exponential_func(time_for_fit, *params_time)
-                mse_time_fit = np.mean((weights - weight_approximated_vs_time)**2)
+                params_time, mse_time_fit = fit_time()
 
                 print("\n--- 重量 対 時間 の指数関数近似 ---")
                 print(f"式: Weight(t) = a * exp(b * t_offset) + c")
@@ -104,18 +510,24 @@ def plot_and_analyze_data(csv_filepath):
         # --- 各速度(rpm)における重量の中央値を計算 ---
         median_weights_at_speeds = None
         unique_speeds = None
-        if 'speed(rpm)' in df.columns and 'weight' in df.columns:
-            median_data = df.groupby('speed(rpm)')['weight'].median().sort_index().reset_index()
-            if not median_data.empty and len(median_data) > 0:
-                unique_speeds = median_data['speed(rpm)'].values
-                median_weights_at_speeds = median_data['weight'].values
-                print("\n--- 各速度における重量中央値 ---")
-                for s_val, mw_val in zip(unique_speeds, median_weights_at_speeds):
-                    print(f"Speed: {s_val} rpm, Median Weight: {mw_val:.3f}")
-            else:
-                print("中央値の計算に必要なデータグループがありません。")
+        weight_groups = None
+        if mode == 'chunked':
+            median_speeds, median_weights = summary.unique_speeds, summary.median_weights
+            used_index = segments is not None
+        else:
+            median_speeds, weight_groups, used_index = weight_groups_by_speed_or_step(
+                csv_filepath, timestamps_esp32, weights, speeds_rpm, settle_seconds)
+            median_weights = np.array([np.median(group) for group in weight_groups])
+        if used_index:
+            print(f"\n段階の索引を使って段階ごとに切り出しました（各段階の始まりから {settle_seconds:g} 秒を除外）。")
+        if len(median_speeds) > 0:
+            unique_speeds = median_speeds
+            median_weights_at_speeds = median_weights
+            print("\n--- 各速度における重量中央値 ---")
+            for s_val, mw_val in zip(unique_speeds, median_weights_at_speeds):
+                print(f"Speed: {s_val} rpm, Median Weight: {mw_val:.3f}")
         else:
-            print("中央値の計算に必要な'speed(rpm)'または'weight'列がありません。")
+            print("中央値の計算に必要なデータグループがありません。")
 
         # --- 中央値に基づいた 重量 対 速度(rpm) の指数関数近似 ---
         params_speed_fit_median = None
@@ -126,34 +538,10 @@ def plot_and_analyze_data(csv_filepath):
         if unique_speeds is not None and median_weights_at_speeds is not None and len(unique_speeds) > 3:
             # len(unique_speeds) > 3 perché abbiamo 3 parametri (a,b,c) nella funzione esponenziale
             try:
-                # unique_speeds è già ordinato grazie a sort_index().values
-                guess_c_s_median = np.min(median_weights_at_speeds)
-                guess_a_s_median = median_weights_at_speeds[0] - guess_c_s_median
-                if np.isclose(guess_a_s_median, 0):
-                    guess_a_s_median = np.median(median_weights_at_speeds) - guess_c_s_median
-                if np.isclose(guess_a_s_median, 0): guess_a_s_median = 1.0
-
-                if len(median_weights_at_speeds) > 1 and median_weights_at_speeds[-1] > median_weights_at_speeds[0] + 1e-6: # Aggiunta tolleranza
-                    guess_b_s_median = 1e-3
-                elif len(median_weights_at_speeds) > 1 and median_weights_at_speeds[-1] < median_weights_at_speeds[0] - 1e-6:
-                    guess_b_s_median = -1e-3
-                else: # Piatto o singolo punto per b
-                    guess_b_s_median = 1e-9 if len(median_weights_at_speeds) > 1 else 0.0
-
-
-                p0_s_median = [guess_a_s_median, guess_b_s_median, guess_c_s_median]
-                
-                params_s_m, _ = curve_fit(
-                    exponential_func,
-                    unique_speeds,
-                    median_weights_at_speeds,
-                    p0=p0_s_median,
-                    maxfev=40000 # Aumentato maxfev per dati potenzialmente più difficili (pochi punti)
-                )
+                params_s_m, mse_speed_fit_median = fit_median_vs_speed(unique_speeds, median_weights_at_speeds)
                 params_speed_fit_median = params_s_m
                 speed_range_for_median_plot = np.linspace(unique_speeds.min(), unique_speeds.max(), num=200)
                 fitted_median_weights = exponential_func(speed_range_for_median_plot, *params_s_m)
-                mse_speed_fit_median = np.mean((median_weights_at_speeds - exponential_func(unique_speeds, *params_s_m))**2)
 
                 print("\n--- 中央値に基づいた 重量 対 速度(rpm) の指数関数近似 ---")
                 print(f"式: Median_Weight(Speed) = a * exp(b * Speed) + c")
@@ -170,12 +558,44 @@ def plot_and_analyze_data(csv_filepath):
                 print("\n中央値に基づいた指数関数近似を行うには、ユニークな速度のデータ点数が少なすぎます (3点超必要)。")
             elif unique_speeds is None:
                  print("\n中央値データがないため、中央値に基づいた指数関数近似は行えません。")
-        
+
+        # --- 近似パラメータの信頼区間（ブートストラップ法） ---
+        if bootstrap_samples > 0 and (params_time is not None or params_speed_fit_median is not None):
+            intervals = bootstrap_fit_intervals(time_points() if params_time is not None else None, params_time,
+                                                params_speed_fit_median, unique_speeds, weight_groups,
+                                                n_boot=bootstrap_samples)
+            interval_titles = {'time': '重量 対 時間（区間平均で間引いた系列の残差を再標本化）',
+                               'speed': '中央値に基づいた 重量 対 速度(rpm)（各速度の生データを再標本化）'}
+            for kind, result in intervals.items():
+                print(f"\n--- 近似パラメータの信頼区間: {interval_titles[kind]} ---")
+                print(format_intervals(result))
+            if mode == 'chunked' and params_speed_fit_median is not None:
+                print("\n分割読み込みでは速度ごとの生データを持たないので、重量 対 速度 の信頼区間は求めません。")
+
+        # --- 候補モデルの比較（モデルごとに別プロセスで近似し、AICの小さい順に並べる） ---
+        best_speed_model = None
+        if compare_models:
+            rankings = compare_candidate_models(unique_speeds, median_weights_at_speeds,
+                                                time_points() if point_count > 3 else None)
+            titles = {'speed': '重量 対 速度(rpm)（中央値）', 'time': '重量 対 時間（区間平均で間引いた系列）'}
+            for kind, results in rankings.items():
+                print(f"\n--- 候補モデルの比較: {titles[kind]} ---")
+                print(format_ranking(results))
+                if results and results[0].error is None:
+                    print(f"最良のモデル: {results[0].name}  ({results[0].formula})")
+            speed_results = rankings.get('speed')
+            if speed_results and speed_results[0].error is None and speed_results[0].name != 'exponential':
+                best_speed_model = speed_results[0]
+
         # --- 重量 対 速度(rpm) のプロット (中央値折れ線と近似曲線付き) ---
+        import japanize_matplotlib  # これを追加するだけ
+        import matplotlib.pyplot as plt
+        from matplotlib.ticker import ScalarFormatter
         fig_scatter, ax_scatter = plt.subplots(figsize=(12, 8))
 
-        # 1. 全データ点のスキャッタープロット
-        ax_scatter.scatter(speeds_rpm, weights, alpha=0.25, label='実測値 (全データ)', color='silver', s=25, zorder=1)
+        # 1. 全データ点のスキャッタープロット（点が多い場合は濃淡画像）
+        scatter_label = '実測値 (全データ)' if len(weights) == point_count else f'実測値 ({point_count}点から{len(weights)}点を抽出)'
+        plot_measured_points(ax_scatter, speeds_rpm, weights, scatter_label)
 
         # 2. 速度毎の重量中央値の折れ線グラフ
         if unique_speeds is not None and median_weights_at_speeds is not None:
@@ -191,6 +611,13 @@ def plot_and_analyze_data(csv_filepath):
             ax_scatter.plot(speed_range_for_median_plot, fitted_median_weights, color='crimson', linestyle='--', linewidth=2.5,
                             label=fit_label_median, zorder=3)
 
+        # 4. 候補モデルの中で最良のモデル（指数関数以外のとき）
+        if best_speed_model is not None:
+            speed_range = np.linspace(unique_speeds.min(), unique_speeds.max(), num=200)
+            ax_scatter.plot(speed_range, REGISTRY['speed'][best_speed_model.name].function(speed_range, *best_speed_model.params),
+                            color='darkgreen', linestyle='-.', linewidth=2.2,
+                            label=f'最良のモデル ({best_speed_model.name})\nRMSE: {best_speed_model.rmse:.2e}', zorder=3)
+
         ax_scatter.set_xlabel('Speed (rpm)', fontsize=14)
         ax_scatter.set_ylabel('Weight', fontsize=14)
         ax_scatter.set_title('重量 対 速度(rpm) の解析 (中央値トレンドと近似)', fontsize=18)
@@ -209,7 +636,7 @@ def plot_and_analyze_data(csv_filepath):
 
     except FileNotFoundError:
         print(f"エラー: ファイル {csv_filepath} が見つかりませんでした。")
-    except pd.errors.EmptyDataError:
+    except empty_data_errors:
         print(f"エラー: ファイル {csv_filepath} は空です。")
     except KeyError as e:
         print(f"エラー: 列 {e} がCSVに見つかりません。CSVのフォーマットを確認してください。")
@@ -218,8 +645,17 @@ def plot_and_analyze_data(csv_filepath):
 
 # --- メイン実行ブロック ---
 if __name__ == "__main__":
-    csv_file_path = get_csv_path_from_input()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="計測データを解析してグラフを表示する")
+    parser.add_argument('path', nargs='?', default=None, help="計測データのパス（省略すると入力を求める）")
+    parser.add_argument('--compare-models', action='store_true',
+                        help="候補モデル（べき乗則、Cross、Carreau、2項の指数関数）も近似して比べる")
+    parser.add_argument('--bootstrap', type=int, nargs='?', const=BOOTSTRAP_SAMPLES, default=0, metavar='N',
+                        help=f"近似パラメータの信頼区間を N 回のブートストラップで求める（N を省略すると {BOOTSTRAP_SAMPLES}）")
+    args = parser.parse_args()
+    csv_file_path = args.path or get_csv_path_from_input()
     if csv_file_path:
-        plot_and_analyze_data(csv_file_path)
+        plot_and_analyze_data(csv_file_path, compare_models=args.compare_models, bootstrap_samples=args.bootstrap)
     else:
         print("ファイルパスが指定されなかったため、処理を終了します。")
\ No newline at end of file
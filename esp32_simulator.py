@@ -0,0 +1,203 @@
+import collections
+import math
+import random
+import time
+
+from USHI_seigyo2 import HX711_ADC1bit, HX711_SCALE
+
+
+class SimulatedESP32:
+    """
+    esp32_USHI.ino のシリアルプロトコルを模擬する、serial.Serial互換の疑似デバイス。
+
+    実機がなくても DataCollector の受信処理を動かせるように、
+    set_speed / start_output / stop_output のコマンドを受け付け、
+    "[data], millis, raw, delay" の行を指定したレートで送信する。
+    受信バッファは実機と同じく有限で、あふれた行は捨てられる（dropped_lines に数える）。
+
+    Parameters:
+        rate_hz (float): [data]行の送信レート（実機は delay(10) なので約100Hz）。
+        noise_std (float): 重量に乗せるガウスノイズの標準偏差。
+        garbage_rate (float): 1行ごとにゴミバイトを混入させる確率（0〜1）。
+        buffer_size (int): 受信バッファのバイト数。
+        timeout (float): readline/readのタイムアウト秒数（serial.Serialと同じ意味）。
+        weight_per_rpm (float): 回転数1rpmあたりの重量の増加量。
+        time_constant (float): 速度変更後に重量が落ち着くまでの時定数（秒）。
+        seed (int): 乱数のシード。
+    """
+
+    def __init__(self, rate_hz=100, noise_std=0.0, garbage_rate=0.0, buffer_size=4096, timeout=1,
+                 weight_per_rpm=0.05, time_constant=2.0, seed=None):
+        self.rate_hz = rate_hz
+        self.noise_std = noise_std
+        self.garbage_rate = garbage_rate
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.weight_per_rpm = weight_per_rpm
+        self.time_constant = time_constant
+        self.random = random.Random(seed)
+        self.is_open = True
+
+        self.boot_time = time.perf_counter()
+        self.buffer = bytearray()
+        self.motor_delay = 0
+        self.is_output_running = False
+        self.output_start_time = 0.0
+        self.emitted_samples = 0
+
+        # 速度変更時の重量の遷移（一次遅れ）用
+        self.weight_from = 0.0
+        self.weight_target = 0.0
+        self.speed_changed_time = self.boot_time
+
+        # 統計用
+        self.emitted_lines = 0
+        self.dropped_lines = 0
+        self.bytes_read = 0
+        # バッファ内の[data]行の (送信完了位置, 送信時刻)。読み出し時に遅延を記録する
+        self.pending = collections.deque()
+        self.total_pushed = 0
+        self.total_consumed = 0
+        self.read_latencies = []
+
+    # --- serial.Serial互換のインターフェース ---
+    @property
+    def in_waiting(self):
+        self._pump()
+        return len(self.buffer)
+
+    def write(self, data):
+        for line in bytes(data).decode('utf-8', 'ignore').split('\n'):
+            if line:
+                self._handle_command(line)
+        return len(data)
+
+    def read(self, size=1):
+        deadline = time.perf_counter() + self.timeout if self.timeout is not None else None
+        while True:
+            self._pump()
+            if len(self.buffer) >= size:
+                return self._consume(size)
+            if deadline is not None and time.perf_counter() >= deadline:
+                return self._consume(len(self.buffer))
+            self._wait()
+
+    def read_all(self):
+        self._pump()
+        return self._consume(len(self.buffer))
+
+    def readline(self):
+        deadline = time.perf_counter() + self.timeout if self.timeout is not None else None
+        while True:
+            self._pump()
+            newline_index = self.buffer.find(b'\n')
+            if newline_index >= 0:
+                return self._consume(newline_index + 1)
+            if deadline is not None and time.perf_counter() >= deadline:
+                return self._consume(len(self.buffer))
+            self._wait()
+
+    def reset_input_buffer(self):
+        self._consume(len(self.buffer))
+
+    def close(self):
+        self.is_open = False
+
+    # --- 内部処理 ---
+    def _handle_command(self, received):
+        """ esp32_USHI.ino の loop() と同じ規則でコマンドを処理する """
+        command, _, argument_str = received.partition(' ')
+        if command == "set_speed":
+            try:
+                argument = float(argument_str)
+            except ValueError:
+                argument = 0.0
+            # 速度変更までに送信されるはずだった行を先に出しておく
+            self._pump()
+            self.motor_delay = int(argument) if argument >= 0 else 0
+            now = time.perf_counter()
+            self.weight_from = self._weight_at(now)
+            self.weight_target = self.weight_per_rpm * self._rpm()
+            self.speed_changed_time = now
+            self._push_line(f"speed was set : {self.motor_delay}", now)
+        elif command == "start_output":
+            self._pump()
+            self.is_output_running = True
+            self.output_start_time = time.perf_counter()
+            self.emitted_samples = 0
+            self._push_line("output started!", self.output_start_time)
+        elif command == "stop_output":
+            self._pump()
+            self.is_output_running = False
+            self._push_line("output stopped.", time.perf_counter())
+        else:
+            self._push_line("Unknown command.", time.perf_counter())
+
+    def _rpm(self):
+        return 60 / (self.motor_delay / 1000000 * 200) if self.motor_delay != 0 else 0
+
+    def _weight_at(self, t):
+        elapsed = max(t - self.speed_changed_time, 0.0)
+        return self.weight_target + (self.weight_from - self.weight_target) * math.exp(-elapsed / self.time_constant)
+
+    def _raw_at(self, t):
+        weight = self._weight_at(t)
+        if self.noise_std > 0:
+            weight += self.random.gauss(0.0, self.noise_std)
+        # USHI_seigyo2.py の weight = -raw*HX711_ADC1bit/HX711_SCALE-140 の逆変換
+        return int(round(-(weight + 140) * HX711_SCALE / HX711_ADC1bit))
+
+    def _garble(self, line):
+        garbage = bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 8)))
+        position = self.random.randrange(len(line) + 1)
+        return line[:position] + garbage + line[position:]
+
+    def _push_line(self, text, emit_time, is_data=False):
+        line = text.encode('utf-8')
+        if self.garbage_rate > 0 and self.random.random() < self.garbage_rate:
+            line = self._garble(line)
+        line += b"\r\n"
+        self.emitted_lines += 1
+        if len(self.buffer) + len(line) > self.buffer_size:
+            # 受信バッファがあふれた行は失われる
+            self.dropped_lines += 1
+            return False
+        self.buffer += line
+        self.total_pushed += len(line)
+        if is_data:
+            self.pending.append((self.total_pushed, emit_time))
+        return True
+
+    def _pump(self):
+        """ 前回から現在時刻までに送信されるはずだった[data]行をバッファに追加する """
+        if not self.is_output_running:
+            return
+        now = time.perf_counter()
+        due = int((now - self.output_start_time) * self.rate_hz) + 1 - self.emitted_samples
+        for i in range(due):
+            emit_time = self.output_start_time + self.emitted_samples / self.rate_hz
+            self.emitted_samples += 1
+            millis = int((emit_time - self.boot_time) * 1000)
+            text = f"[data], {millis}, {self._raw_at(emit_time)}, {self.motor_delay}"
+            if not self._push_line(text, emit_time, is_data=True):
+                # バッファが満杯のときは残りをまとめて捨てる（読み手が長く止まった場合に備えて）
+                remaining = due - i - 1
+                self.emitted_samples += remaining
+                self.emitted_lines += remaining
+                self.dropped_lines += remaining
+                break
+
+    def _consume(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.total_consumed += size
+        self.bytes_read += size
+        now = time.perf_counter()
+        while self.pending and self.pending[0][0] <= self.total_consumed:
+            _, emit_time = self.pending.popleft()
+            self.read_latencies.append(now - emit_time)
+        return data
+
+    def _wait(self):
+        # 次の行が届くまで少し待つ（高レート時は短く）
+        time.sleep(min(0.5 / self.rate_hz, 0.001) if self.is_output_running else 0.001)
@@ -0,0 +1,183 @@
+import collections
+
+import numpy as np
+
+ExponentialFitResult = collections.namedtuple(
+    'ExponentialFitResult', ['params', 'covariance', 'mse', 'iterations'])
+
+# |b| * (x の範囲) の上限。これを超える b は、端の数点だけを通る意味のない近似になる（exp の桁あふれも防ぐ）
+MAX_EXPONENT = 50.0
+# 累積積分への回帰の計画行列（列を正規化したもの）の条件数の上限。超えたら b を決められないとみなす
+MAX_DESIGN_CONDITION = 1e10
+# 指数関数の項の振れ幅（x の範囲での変化量）が y の範囲のこの割合未満なら、指数関数の成分がないとみなす
+MIN_RELATIVE_AMPLITUDE = 1e-8
+# 定数のモデルに比べた残差平方和の減り方の F 値（自由度 2, n - 3）の下限。
+# ノイズだけのデータでは b を選べる分を含めても 5 程度までにしかならない
+MIN_IMPROVEMENT_F = 10.0
+
+
+def exponential_jacobian(x, a, b, c):
+    """ a * exp(b * x) + c の (a, b, c) についてのヤコビアン（解析的に計算） """
+    x = np.asarray(x, dtype=np.float64)
+    e = np.exp(b * x)
+    return np.column_stack((e, a * x * e, np.ones_like(x)))
+
+
+def _solve_linear(phi, y):
+    """ b を固定したとき、y ≈ a * phi + c の a, c を最小二乗で厳密に解く """
+    phi_mean = phi.mean()
+    y_mean = y.mean()
+    phi_centered = phi - phi_mean
+    denominator = np.dot(phi_centered, phi_centered)
+    if denominator <= 0 or not np.isfinite(denominator):
+        return 0.0, y_mean
+    a = np.dot(phi_centered, y - y_mean) / denominator
+    return a, y_mean - a * phi_mean
+
+
+def initial_estimate(x, y):
+    """
+    反復なしで a * exp(b * x) + c の初期値を求める（累積積分への回帰による方法）。
+
+    y = a * exp(b * x) + c を x1 から x まで積分すると
+        y - y1 = b * S(x) - b * c * (x - x1)    （S は y の累積積分）
+    となり、b は (x - x1) と S への線形回帰の係数として求まる。a, c は b を固定して最小二乗で解く。
+    x は昇順に並んでいる必要がある。
+
+    y がほぼ一定のときは S が (x - x1) とほぼ比例し、b が決まらない。列の大きさをそろえた計画行列の条件数が
+    MAX_DESIGN_CONDITION を超えたら b = 0（定数のモデル）とする。b は |b| * (x の範囲) <= MAX_EXPONENT に収める。
+
+    Returns:
+        tuple: (a, b, c)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    span = x[-1] - x[0]
+    b = 0.0
+    if span > 0:
+        # 台形公式による累積積分
+        s = np.concatenate(([0.0], np.cumsum(0.5 * (y[1:] + y[:-1]) * np.diff(x))))
+        design = np.column_stack((x - x[0], s))
+        scale = np.sqrt(np.einsum('ij,ij->j', design, design))
+        if np.all(scale > 0) and np.all(np.isfinite(scale)):
+            design /= scale
+            if np.linalg.cond(design) <= MAX_DESIGN_CONDITION:
+                coefficients, *_ = np.linalg.lstsq(design, y - y[0], rcond=None)
+                b = coefficients[1] / scale[1]
+        if np.isfinite(b):
+            b = float(np.clip(b, -MAX_EXPONENT / span, MAX_EXPONENT / span))
+        else:
+            b = 0.0
+    a, c = _solve_linear(np.exp(b * (x - x[0])), y)
+    return a * np.exp(-b * x[0]), b, c
+
+
+def fit_exponential(x, y, max_iter=100, tol=1e-10):
+    """
+    a * exp(b * x) + c を最小二乗で近似する。
+
+    b を固定すればモデルは a, c について線形なので、a, c はその都度厳密に解き（変数射影法）、
+    残る b だけを解析的なヤコビアンを使ったガウス・ニュートン法（ステップ幅の半減による直線探索つき）で求める。
+    初期値は initial_estimate で反復なしに求める。数値の桁をそろえるため、x は内部で [0, 1] に正規化する。
+    b は |b| * (x の範囲) <= MAX_EXPONENT の範囲で探す。
+
+    Parameters:
+        x (array-like): 説明変数（時間または速度）。
+        y (array-like): 目的変数（重量）。
+        max_iter (int): b の反復回数の上限。
+        tol (float): b（正規化後）の更新量がこれ未満になったら収束とみなす。
+
+    Returns:
+        ExponentialFitResult: params (a, b, c), covariance（3x3の共分散行列）, mse, iterations。
+
+    Raises:
+        RuntimeError: 収束しなかった場合、有限の解が得られなかった場合（curve_fitと同じ例外）、
+            またはデータに指数関数の成分がない場合（一定・ノイズだけのデータで a ≈ 0 になる、b が上限に張り付く、
+            定数のモデルより有意に良くならないなど。このとき b に意味はないので近似の結果として返さない）。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) < 3:
+        raise RuntimeError("近似にはデータ点が3点以上必要です。")
+    order = np.argsort(x, kind='stable')
+    x_sorted, y_sorted = x[order], y[order]
+    x0 = x_sorted[0]
+    span = x_sorted[-1] - x0
+    if span <= 0:
+        raise RuntimeError("説明変数の値がすべて同じため、指数関数近似ができません。")
+    u = (x_sorted - x0) / span
+
+    def project(beta):
+        phi = np.exp(beta * u)
+        a, c = _solve_linear(phi, y_sorted)
+        residual = y_sorted - (a * phi + c)
+        return phi, a, c, residual, np.dot(residual, residual)
+
+    _, beta, _ = initial_estimate(u, y_sorted)
+    phi, a, c, residual, cost = project(beta)
+
+    iterations = 0
+    converged = False
+    for iterations in range(1, max_iter + 1):
+        # Kaufman の近似: d(residual)/d(beta) ≈ -(I - P) (a * u * phi)。P は [phi, 1] の張る空間への射影で、
+        # 平均を引いたベクトルで計算すると (I - P) v = v_c - (phi_c・v_c / phi_c・phi_c) phi_c になる
+        derivative = a * u * phi
+        derivative -= derivative.mean()
+        phi_centered = phi - phi.mean()
+        phi_norm = np.dot(phi_centered, phi_centered)
+        if phi_norm > 0:
+            derivative -= np.dot(phi_centered, derivative) / phi_norm * phi_centered
+        jacobian = -derivative
+        jj = np.dot(jacobian, jacobian)
+        if jj <= 0 or not np.isfinite(jj):
+            converged = True
+            break
+        step = -np.dot(jacobian, residual) / jj
+
+        # コストが下がるまでステップ幅を半分にする
+        step = np.clip(beta + step, -MAX_EXPONENT, MAX_EXPONENT) - beta
+        for _ in range(30):
+            candidate = project(beta + step)
+            if np.isfinite(candidate[4]) and candidate[4] <= cost:
+                break
+            step *= 0.5
+        else:
+            converged = True
+            break
+        beta += step
+        phi, a, c, residual, cost = candidate
+        if abs(step) < tol * (1.0 + abs(beta)):
+            converged = True
+            break
+
+    if not converged or not np.all(np.isfinite([a, beta, c])):
+        raise RuntimeError("指数関数近似が収束しませんでした。")
+    amplitude = abs(a * np.expm1(beta))
+    constant_cost = np.dot(y_sorted - y_sorted.mean(), y_sorted - y_sorted.mean())
+    improvement_f = (constant_cost - cost) / 2 / (cost / max(len(x) - 3, 1)) if cost > 0 else np.inf
+    if (amplitude <= MIN_RELATIVE_AMPLITUDE * np.ptp(y_sorted) or abs(beta) >= MAX_EXPONENT * (1 - 1e-9)
+            or improvement_f < MIN_IMPROVEMENT_F):
+        raise RuntimeError("データに指数関数の成分が見つからないため、指数関数近似ができません。")
+
+    # 正規化前の x に対するパラメータに戻す: a' * exp(beta * (x - x0) / span) = a * exp(b * x)
+    a_normalized = a
+    b = beta / span
+    a = a * np.exp(-b * x0)
+    params = np.array([a, b, c])
+    if not np.all(np.isfinite(params)) or a == 0:
+        raise RuntimeError("指数関数近似で有限のパラメータが得られませんでした。")
+
+    # x0 が大きいと exp(b * x) があふれるので、残差は正規化した x で計算する
+    residual = y - (a_normalized * np.exp(beta * (x - x0) / span) + c)
+    ssr = np.dot(residual, residual)
+    dof = max(len(x) - 3, 1)
+    with np.errstate(over='ignore', invalid='ignore'):
+        full_jacobian = exponential_jacobian(x, a, b, c)
+        normal_matrix = full_jacobian.T @ full_jacobian
+    try:
+        if not np.all(np.isfinite(normal_matrix)):
+            raise np.linalg.LinAlgError
+        covariance = np.linalg.inv(normal_matrix) * (ssr / dof)
+    except np.linalg.LinAlgError:
+        covariance = np.full((3, 3), np.inf)
+    return ExponentialFitResult(params, covariance, ssr / len(x), iterations)
@@ -0,0 +1,261 @@
+import collections
+import math
+
+import numpy as np
+
+from exp_fit import fit_exponential
+
+# 近似モデル: kind は 'speed'（重量 対 速度(rpm)）または 'time'（重量 対 時間）。
+# fit(x, y) は (params, ...) を返し、失敗したら RuntimeError か ValueError を投げる
+FitModel = collections.namedtuple('FitModel', ['name', 'kind', 'formula', 'param_names', 'function', 'fit'])
+
+ModelFitResult = collections.namedtuple(
+    'ModelFitResult', ['name', 'kind', 'formula', 'param_names', 'params', 'n', 'k', 'ssr', 'mse', 'rmse', 'r2',
+                       'max_abs_residual', 'aic', 'bic', 'error'])
+
+# 時間のモデルを比べるときの点数の上限（これを超えたら区間平均で間引く）
+TIME_MODEL_MAX_POINTS = 4096
+# パラメータの多いモデルが少ないモデルより上位になるのに必要な AICc と BIC の差（どちらもこれ以上小さいこと）
+SELECTION_MARGIN = 10.0
+# 2項の指数関数で、b1 と b2 がこの相対差より近ければ2つの項を区別できないとみなす
+BI_EXPONENTIAL_MIN_RATE_SEPARATION = 0.05
+# 2項の指数関数で、a1 と a2 が逆符号でどちらかの大きさがデータの範囲のこの倍数を超えたら、打ち消し合う近似とみなす
+BI_EXPONENTIAL_MAX_CANCELLATION = 10.0
+
+
+def exponential(x, a, b, c):
+    return a * np.exp(b * x) + c
+
+
+def power_law(x, k, n, c):
+    return k * np.power(x, n) + c
+
+
+def cross(x, w0, w_inf, lam, m):
+    return w_inf + (w0 - w_inf) / (1 + np.power(lam * x, m))
+
+
+def carreau(x, w0, w_inf, lam, n):
+    return w_inf + (w0 - w_inf) * np.power(1 + (lam * x) ** 2, (n - 1) / 2)
+
+
+def bi_exponential(x, a1, b1, a2, b2, c):
+    return a1 * np.exp(b1 * x) + a2 * np.exp(b2 * x) + c
+
+
+def _curve_fit(function, x, y, p0, bounds=(-np.inf, np.inf)):
+    from scipy.optimize import curve_fit
+
+    params, _ = curve_fit(function, x, y, p0=p0, bounds=bounds, maxfev=20000)
+    return params
+
+
+def _fit_exponential(x, y):
+    return fit_exponential(x, y).params
+
+
+def _fit_power_law(x, y):
+    if np.any(x < 0):
+        raise ValueError("べき乗則の近似には負でない速度が必要です。")
+    slope = (y[-1] - y[0]) / (x[-1] - x[0]) if x[-1] > x[0] else 0.0
+    p0 = [slope, 1.0, y[0] - slope * x[0]]
+    return _curve_fit(power_law, x, y, p0, bounds=([-np.inf, 1e-3, -np.inf], [np.inf, 10.0, np.inf]))
+
+
+def _fit_cross(x, y):
+    positive = x[x > 0]
+    lam0 = 1 / np.median(positive) if len(positive) else 1.0
+    p0 = [y[0], y[-1], lam0, 1.0]
+    return _curve_fit(cross, x, y, p0, bounds=([-np.inf, -np.inf, 1e-9, 1e-2], [np.inf, np.inf, np.inf, 10.0]))
+
+
+def _fit_carreau(x, y):
+    positive = x[x > 0]
+    lam0 = 1 / np.median(positive) if len(positive) else 1.0
+    p0 = [y[0], y[-1], lam0, 0.5]
+    return _curve_fit(carreau, x, y, p0, bounds=([-np.inf, -np.inf, 1e-9, -5.0], [np.inf, np.inf, np.inf, 5.0]))
+
+
+def _fit_bi_exponential(x, y):
+    # 数値の桁をそろえるため、x を [0, 1] に正規化して近似し、最後に元の x に対する値に戻す
+    x0 = x[0]
+    span = x[-1] - x0
+    if span <= 0:
+        raise ValueError("説明変数の値がすべて同じです。")
+    u = (x - x0) / span
+    a, beta, c = fit_exponential(u, y).params
+    p0 = [a / 2, beta * 3, a / 2, beta / 3, c]
+    a1, beta1, a2, beta2, c = _curve_fit(bi_exponential, u, y, p0)
+    # 2つの項が同じ速さか、大きな逆符号の項が打ち消し合っているだけなら、パラメータに意味がない
+    if abs(beta1 - beta2) <= BI_EXPONENTIAL_MIN_RATE_SEPARATION * max(abs(beta1), abs(beta2)):
+        raise RuntimeError("2つの指数関数の項の速さ (b1, b2) が区別できません。")
+    if a1 * a2 < 0 and max(abs(a1), abs(a2)) > BI_EXPONENTIAL_MAX_CANCELLATION * np.ptp(y):
+        raise RuntimeError("2つの指数関数の項が打ち消し合っていて、パラメータが決まりません。")
+    b1, b2 = beta1 / span, beta2 / span
+    # 速い成分を先にする
+    if abs(b1) < abs(b2):
+        a1, b1, a2, b2 = a2, b2, a1, b1
+    return np.array([a1 * np.exp(-b1 * x0), b1, a2 * np.exp(-b2 * x0), b2, c])
+
+
+MODELS = collections.OrderedDict((model.name, model) for model in [
+    FitModel('exponential', 'speed', 'a * exp(b * x) + c', ('a', 'b', 'c'), exponential, _fit_exponential),
+    FitModel('power_law', 'speed', 'k * x^n + c', ('k', 'n', 'c'), power_law, _fit_power_law),
+    FitModel('cross', 'speed', 'w_inf + (w0 - w_inf) / (1 + (lam * x)^m)', ('w0', 'w_inf', 'lam', 'm'), cross,
+             _fit_cross),
+    FitModel('carreau', 'speed', 'w_inf + (w0 - w_inf) * (1 + (lam * x)^2)^((n - 1) / 2)',
+             ('w0', 'w_inf', 'lam', 'n'), carreau, _fit_carreau),
+])
+TIME_MODELS = collections.OrderedDict((model.name, model) for model in [
+    FitModel('exponential', 'time', 'a * exp(b * t) + c', ('a', 'b', 'c'), exponential, _fit_exponential),
+    FitModel('bi_exponential', 'time', 'a1 * exp(b1 * t) + a2 * exp(b2 * t) + c', ('a1', 'b1', 'a2', 'b2', 'c'),
+             bi_exponential, _fit_bi_exponential),
+])
+# モデルを増やすときは上のリストに加える（プロセスプールのワーカーもこのモジュールから探す）
+REGISTRY = {'speed': MODELS, 'time': TIME_MODELS}
+
+
+def information_criteria(ssr, n, k):
+    """
+    残差平方和から AIC（小標本補正つきの AICc）と BIC を計算する（誤差を正規分布と仮定。定数項は省く）。
+    n - k - 1 <= 0 なら補正できないので AIC は inf（fit_model はそのようなモデルをデータ点不足とする）。
+    """
+    if n <= 0:
+        return math.inf, math.inf
+    log_likelihood_term = n * math.log(max(ssr / n, 1e-300))
+    aic = log_likelihood_term + 2 * k + (2 * k * (k + 1) / (n - k - 1) if n - k - 1 > 0 else math.inf)
+    bic = log_likelihood_term + k * math.log(n)
+    return aic, bic
+
+
+def fit_model(kind, name, x, y):
+    """
+    登録されたモデル1つを近似し、残差の統計量と情報量規準を計算する（プロセスプールのワーカーから呼ばれる）。
+
+    データ点が k + 1 点以下（k はパラメータ数）のモデルは AICc を計算できず、ほぼ全ての点を通ってしまうので、
+    近似せずにデータ点不足とする（順位は付けない）。
+
+    Returns:
+        ModelFitResult。近似できなかった場合は error にその理由が入る（params は None）。
+    """
+    model = REGISTRY[kind][name]
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n, k = len(x), len(model.param_names)
+
+    def failed(message):
+        return ModelFitResult(name, kind, model.formula, model.param_names, None, n, k, None, None, None, None,
+                              None, math.inf, math.inf, message)
+
+    if n <= k + 1:
+        return failed(f"データ点が不足しています ({k + 1}点超必要)")
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    try:
+        with np.errstate(over='ignore', invalid='ignore'):
+            params = np.asarray(model.fit(x, y), dtype=np.float64)
+            residual = y - model.function(x, *params)
+    except Exception as e:
+        # 1つのモデルの近似が失敗しても、ほかのモデルや一括解析全体は続ける
+        return failed(str(e))
+    if not np.all(np.isfinite(params)) or not np.all(np.isfinite(residual)):
+        return failed("有限のパラメータが得られませんでした")
+
+    ssr = float(np.dot(residual, residual))
+    total = float(np.sum((y - y.mean()) ** 2))
+    aic, bic = information_criteria(ssr, n, k)
+    return ModelFitResult(name, kind, model.formula, model.param_names, [float(value) for value in params], n, k,
+                          ssr, ssr / n, math.sqrt(ssr / n), 1 - ssr / total if total > 0 else math.nan,
+                          float(np.max(np.abs(residual))), aic, bic, None)
+
+
+def decimate_series(x, y, max_points=TIME_MODEL_MAX_POINTS):
+    """ 時系列を連続する区間の平均で max_points 点以下に間引く（モデルの比較を速くするため） """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= max_points:
+        return x, y
+    block = -(-len(x) // max_points)
+    full = len(x) // block * block
+    x_blocks = x[:full].reshape(-1, block).mean(axis=1)
+    y_blocks = y[:full].reshape(-1, block).mean(axis=1)
+    if full < len(x):
+        x_blocks = np.append(x_blocks, x[full:].mean())
+        y_blocks = np.append(y_blocks, y[full:].mean())
+    return x_blocks, y_blocks
+
+
+def rank_results(results, margin=SELECTION_MARGIN):
+    """
+    AICc（同じならBIC）の小さい順に並べる。近似できなかったモデル（データ点不足を含む）は順位を付けずに最後。
+
+    ただし先頭には、パラメータの少ないどのモデルよりも AICc と BIC の両方で margin 以上小さいモデルだけを置く
+    （そうでなければ、差が margin 未満のパラメータの少ないモデルのうち AICc の最も小さいものを先頭にする）。
+    """
+    ranked = sorted(results, key=lambda result: (result.error is not None, result.aic, result.bic))
+    fitted = [result for result in ranked if result.error is None]
+    if not fitted:
+        return ranked
+    best = fitted[0]
+    while True:
+        simpler = [result for result in fitted if result.k < best.k and
+                   (result.aic - best.aic < margin or result.bic - best.bic < margin)]
+        if not simpler:
+            break
+        best = simpler[0]
+    return [best] + [result for result in ranked if result is not best]
+
+
+def compare_models(kind, x, y, names=None, executor=None):
+    """
+    kind の全ての（または names の）モデルを近似して、良い順に並べる。
+
+    Parameters:
+        kind (str): 'speed' または 'time'。
+        names (list): 近似するモデルの名前。Noneなら登録された全てのモデル。
+        executor (concurrent.futures.Executor): 指定するとモデルごとに並列に近似する
+            （ProcessPoolExecutor なら、モデルを増やしても1ファイルあたりの時間はほぼ一番遅いモデルの分で済む）。
+
+    Returns:
+        list: ModelFitResult のリスト（rank_results の順。先頭が最良）。
+    """
+    return compare_model_sets({kind: (x, y)}, executor, {kind: names} if names else None)[kind]
+
+
+def compare_model_sets(series, executor=None, names=None):
+    """
+    複数の種類のモデルの比較をまとめて行う（executor には全ての種類の全てのモデルを先に投入してから待つ）。
+
+    Parameters:
+        series (dict): kind → (x, y)。
+        names (dict): kind → 近似するモデルの名前のリスト（省略した kind は全てのモデル）。
+
+    Returns:
+        dict: kind → ModelFitResult のリスト（良い順）。
+    """
+    names = names or {}
+    tasks = [(kind, name, np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+             for kind, (x, y) in series.items() for name in (names.get(kind) or REGISTRY[kind])]
+    if executor is None:
+        fitted = [fit_model(*task) for task in tasks]
+    else:
+        futures = [executor.submit(fit_model, *task) for task in tasks]
+        fitted = [future.result() for future in futures]
+    results = {kind: [] for kind in series}
+    for result in fitted:
+        results[result.kind].append(result)
+    return {kind: rank_results(kind_results) for kind, kind_results in results.items()}
+
+
+def format_ranking(results):
+    """ compare_models の結果の表（文字列）。最良のモデルに * を付ける """
+    lines = [f"  {'model':<16} {'AICc':>12} {'BIC':>12} {'RMSE':>11} {'R^2':>8} {'max|res|':>10}  parameters"]
+    for rank, result in enumerate(results):
+        mark = '*' if rank == 0 and result.error is None else ' '
+        if result.error is not None:
+            lines.append(f"{mark} {result.name:<16} 近似できませんでした: {result.error}")
+            continue
+        params = ", ".join(f"{name}={value:.4g}" for name, value in zip(result.param_names, result.params))
+        lines.append(f"{mark} {result.name:<16} {result.aic:>12.4g} {result.bic:>12.4g} {result.rmse:>11.4g} "
+                     f"{result.r2:>8.4f} {result.max_abs_residual:>10.4g}  {params}")
+    return "\n".join(lines)
@@ -0,0 +1,309 @@
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.ticker import ScalarFormatter
+
+
+class _Level:
+    """ ピラミッドの1段分。(x, 最小値, 最大値) を古い順に最大capacity個だけ保持する """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # 2倍の領域を確保しておき、末尾に達したら後半を先頭に詰め直す（追加はならしてO(1)）
+        self.x = np.empty(2 * capacity, dtype=np.float64)
+        self.lo = np.empty(2 * capacity, dtype=np.float64)
+        self.hi = np.empty(2 * capacity, dtype=np.float64)
+        self.start = 0
+        self.end = 0
+        self.evicted = False
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, x, lo, hi):
+        n = len(x)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            x, lo, hi = x[-self.capacity:], lo[-self.capacity:], hi[-self.capacity:]
+            n = self.capacity
+            self.evicted = self.evicted or len(self) > 0
+        if self.end + n > 2 * self.capacity:
+            keep = min(len(self), self.capacity - n)
+            for column in (self.x, self.lo, self.hi):
+                column[:keep] = column[self.end - keep:self.end]
+            self.evicted = self.evicted or keep < len(self)
+            self.start, self.end = 0, keep
+        self.x[self.end:self.end + n] = x
+        self.lo[self.end:self.end + n] = lo
+        self.hi[self.end:self.end + n] = hi
+        self.end += n
+        if len(self) > self.capacity:
+            self.start = self.end - self.capacity
+            self.evicted = True
+
+    def view(self):
+        return self.x[self.start:self.end], self.lo[self.start:self.end], self.hi[self.start:self.end]
+
+
+class MinMaxPyramid:
+    """
+    時系列を段階的に間引いた min/max のピラミッド。
+
+    0段目は生のサンプル、k段目は factor**k 個のサンプルを1つにまとめた (先頭のx, 最小値, 最大値)。
+    各段は level_capacity 個までしか保持しないので、メモリは計測時間によらず一定。
+    サンプルは extend() で追加した分だけ上の段へ伝えるので、更新コストは追加したサンプル数に比例する。
+
+    Parameters:
+        factor (int): 1段上がるごとにまとめるバケツの個数。
+        level_capacity (int): 各段が保持するバケツの個数。
+        levels (int): 段数。
+    """
+
+    def __init__(self, factor=4, level_capacity=8192, levels=12):
+        self.factor = factor
+        self.levels = [_Level(level_capacity) for _ in range(levels)]
+        # 各段でまだ上の段にまとめられていない端数（factor個未満）
+        self.carry = [(np.empty(0), np.empty(0), np.empty(0)) for _ in range(levels)]
+
+    def extend(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self._push(0, x, y, y)
+
+    def _push(self, k, x, lo, hi):
+        self.levels[k].append(x, lo, hi)
+        if k + 1 >= len(self.levels):
+            return
+        carry_x, carry_lo, carry_hi = self.carry[k]
+        x = np.concatenate((carry_x, x))
+        lo = np.concatenate((carry_lo, lo))
+        hi = np.concatenate((carry_hi, hi))
+        full = len(x) // self.factor * self.factor
+        self.carry[k] = (x[full:], lo[full:], hi[full:])
+        if full:
+            self._push(k + 1,
+                       x[:full:self.factor],
+                       lo[:full].reshape(-1, self.factor).min(axis=1),
+                       hi[:full].reshape(-1, self.factor).max(axis=1))
+
+    def render(self, x0, x1, max_points):
+        """
+        [x0, x1] の範囲を max_points 点程度で描画するための (x, y) を返す。
+
+        範囲をカバーしていて、バケツ数が max_points 以下になる最も細かい段を選び、
+        まだ上の段にまとめられていない新しい端数をその後ろにつなげる。
+        k段目（k>0）は各バケツを最小値と最大値の2点にして、縦線の包絡として描く。
+        """
+        for k, level in enumerate(self.levels):
+            x, lo, hi = level.view()
+            if len(x) == 0:
+                continue
+            if level.evicted and x[0] > x0 and k + 1 < len(self.levels) and len(self.levels[k + 1]):
+                continue
+            i0 = max(np.searchsorted(x, x0, side='right') - 1, 0)
+            i1 = np.searchsorted(x, x1, side='right')
+            if i1 - i0 > max_points and k + 1 < len(self.levels) and len(self.levels[k + 1]):
+                continue
+
+            tails = [(x[i0:i1], lo[i0:i1], hi[i0:i1])]
+            # k段目にまだ入っていない新しいサンプル（下の段の端数）を新しい順に後ろへつなげる
+            for j in range(k - 1, -1, -1):
+                tails.append(self.carry[j])
+            xs = np.concatenate([t[0] for t in tails])
+            los = np.concatenate([t[1] for t in tails])
+            his = np.concatenate([t[2] for t in tails])
+            if k == 0:
+                return xs, los
+            return np.repeat(xs, 2), np.column_stack((los, his)).ravel()
+        return np.empty(0), np.empty(0)
+
+
+class _LiveTrace:
+    """ LivePlot の1つの軸（重量と速度の2軸）。SampleStore 1つ分の間引きと軸の範囲を受け持つ """
+
+    def __init__(self, ax1, samples, window, x_field, x_origin, title=None):
+        self.samples = samples
+        self.window = window
+        self.x_field = x_field
+        self.x_origin = x_origin
+        self.seen = 0
+        self.x_first = None
+        self.x_last = None
+        self.xlim_initialized = False
+        self.weight_pyramid = MinMaxPyramid()
+        self.speed_pyramid = MinMaxPyramid()
+
+        self.ax1 = ax1
+        if title:
+            ax1.set_title(title)
+        color = 'tab:red'
+        ax1.set_xlabel('Timestamp' if x_field == 'timestamp' else 'Time (s)')
+        ax1.set_ylabel('Weight', color=color)
+        self.line1, = ax1.plot([], [], color=color, animated=True)
+        ax1.tick_params(axis='y', labelcolor=color)
+        ax1.yaxis.set_major_formatter(ScalarFormatter(useMathText=True))
+
+        self.ax2 = ax1.twinx()
+        color = 'tab:blue'
+        self.ax2.set_ylabel('Speed (rpm)', color=color)
+        self.line2, = self.ax2.plot([], [], color=color, animated=True)
+        self.ax2.tick_params(axis='y', labelcolor=color)
+
+    def draw_lines(self):
+        self.ax1.draw_artist(self.line1)
+        self.ax2.draw_artist(self.line2)
+
+    def _pull_new_samples(self):
+        """ 前回から増えたサンプルだけをピラミッドに追加する """
+        total = self.samples.total_count
+        if total == self.seen:
+            return False
+        snapshot = self.samples.snapshot(last=total - self.seen)
+        self.seen = snapshot.start_index + len(snapshot.timestamp)
+        if len(snapshot.timestamp) == 0:
+            return False
+        x = getattr(snapshot, self.x_field) - self.x_origin
+        self.weight_pyramid.extend(x, snapshot.weight)
+        self.speed_pyramid.extend(x, snapshot.speed)
+        if self.x_first is None:
+            self.x_first = float(x[0])
+        self.x_last = float(x[-1])
+        return True
+
+    def _update_xlim(self):
+        """ x軸の範囲を必要なときだけ飛び飛びに広げる/進める。変更したらTrueを返す """
+        if self.xlim_initialized and self.x_last <= self.ax1.get_xlim()[1]:
+            return False
+        self.xlim_initialized = True
+        if self.window is None:
+            span = max(self.x_last - self.x_first, 1.0)
+            self.ax1.set_xlim(self.x_first, self.x_last + 0.25 * span)
+        else:
+            self.ax1.set_xlim(self.x_last - 0.75 * self.window, self.x_last + 0.25 * self.window)
+        return True
+
+    @staticmethod
+    def _update_ylim(ax, y):
+        """ 描画する値がはみ出したとき、または範囲が広すぎるときだけy軸を変える """
+        if len(y) == 0:
+            return False
+        y_min, y_max = float(np.min(y)), float(np.max(y))
+        bottom, top = ax.get_ylim()
+        inside = bottom <= y_min and y_max <= top
+        too_wide = y_min < y_max and (y_max - y_min) < 0.25 * (top - bottom)
+        if inside and not too_wide:
+            return False
+        margin = 0.1 * (y_max - y_min) if y_max > y_min else max(abs(y_max) * 0.1, 1.0)
+        ax.set_ylim(y_min - margin, y_max + margin)
+        return True
+
+    def update(self):
+        """ 新しいサンプルを線に反映する。軸の範囲を変えた（全体の再描画が必要な）ときはTrueを返す """
+        if not self._pull_new_samples():
+            return False
+        redraw = self._update_xlim()
+        x0, x1 = self.ax1.get_xlim()
+        max_points = max(int(self.ax1.bbox.width), 100)
+
+        x, y = self.weight_pyramid.render(x0, x1, max_points)
+        self.line1.set_data(x, y)
+        redraw |= self._update_ylim(self.ax1, y)
+        x, y = self.speed_pyramid.render(x0, x1, max_points)
+        self.line2.set_data(x, y)
+        redraw |= self._update_ylim(self.ax2, y)
+        return redraw
+
+
+class LivePlot:
+    """
+    DataCollector のサンプルを間引いて描画するライブグラフ。
+
+    SampleStore から新しく届いた分だけを MinMaxPyramid に追加し、
+    軸の幅のピクセル数程度の点だけを描画する。軸の範囲が変わらない間は
+    blitting で線だけを描き直すので、1フレームのコストは計測時間によらずほぼ一定。
+
+    SampleStore のリストを渡すと、縦に並べた軸にそれぞれを描く（複数の装置をまとめて表示する）。
+
+    Parameters:
+        samples (SampleStore or list): 描画するサンプル。
+        window (float): スライドさせる表示範囲（秒）。Noneなら計測開始からの全体を表示する。
+        interval (int): 更新間隔（ミリ秒）。
+        titles (list): 各軸のタイトル。
+        x_field (str): x軸に使う値。'timestamp'（ESP32のミリ秒）または 'host_time'（PC側の秒）。
+        x_origin (float): x軸の値から引く値（'host_time' のとき、全ての装置で共通の開始時刻を渡す）。
+        stop_when (callable): Trueを返したらウィンドウを閉じる（更新のたびに呼ぶ）。
+        metrics (metrics.Metrics or list): 指定すると1フレームの更新にかかった時間を記録する
+            （装置ごとの Metrics のリストなら全てに記録する）。
+    """
+
+    def __init__(self, samples, window=None, interval=100, titles=None, x_field='timestamp', x_origin=0.0,
+                 stop_when=None, metrics=None):
+        sample_stores = list(samples) if isinstance(samples, (list, tuple)) else [samples]
+        titles = titles or [None] * len(sample_stores)
+        if window is not None and x_field == 'timestamp':
+            window = window * 1000  # Timestamp(ESP32)はミリ秒
+        self.interval = interval
+        self.stop_when = stop_when
+        self.metrics = [m for m in (metrics if isinstance(metrics, (list, tuple)) else [metrics]) if m is not None]
+        self.background = None
+
+        self.fig, axes = plt.subplots(len(sample_stores), 1, squeeze=False,
+                                      sharex=(x_field == 'host_time'),
+                                      figsize=(8, min(3 * len(sample_stores), 12)) if len(sample_stores) > 1 else None)
+        self.traces = [_LiveTrace(ax, store, window, x_field, x_origin, title)
+                       for ax, store, title in zip(axes[:, 0], sample_stores, titles)]
+        if len(self.traces) > 1:
+            self.fig.tight_layout()
+
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        self.timer = self.fig.canvas.new_timer(interval=interval)
+        self.timer.add_callback(self.update)
+        self.timer.start()
+
+    def show(self):
+        plt.show()
+
+    def _on_draw(self, event):
+        """ 全体を描き直したときに背景を保存し、線を重ねて描く """
+        canvas = self.fig.canvas
+        if getattr(canvas, 'supports_blit', False):
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for trace in self.traces:
+            trace.draw_lines()
+
+    def update(self):
+        if self.stop_when is not None and self.stop_when():
+            self.timer.stop()
+            plt.close(self.fig)
+            return
+        t0 = time.perf_counter()
+        if self._update_frame():
+            elapsed = time.perf_counter() - t0
+            for metrics in self.metrics:
+                metrics.observe('plot_frame_seconds', elapsed)
+
+    def _update_frame(self):
+        """ 新しいサンプルがあれば描き直す。描き直したらTrueを返す """
+        updated = False
+        redraw = False
+        for trace in self.traces:
+            before = trace.seen
+            redraw |= trace.update()
+            updated |= trace.seen != before
+        if not updated:
+            return False
+
+        canvas = self.fig.canvas
+        if redraw or self.background is None:
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self.background)
+            self._draw_lines()
+            canvas.blit(self.fig.bbox)
+            canvas.flush_events()
+        return True
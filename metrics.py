@@ -0,0 +1,252 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus の説明文（名前 → (種類, 説明)）。ここにない名前もそのまま出力する
+METRIC_HELP = {
+    'lines_total': ('counter', "受信した行数"),
+    'bytes_total': ('counter', "シリアルから読んだバイト数"),
+    'reads_total': ('counter', "シリアルの読み出し回数"),
+    'decode_errors_total': ('counter', "UTF-8としてデコードできずに捨てたバイト数"),
+    'data_records_total': ('counter', "解析できた[data]行の数"),
+    'malformed_records_total': ('counter', "[data]を含むが解析できなかった行の数"),
+    'writer_backpressure_total': ('counter', "書き込みキューが満杯で受信スレッドが待たされた回数"),
+    'serial_buffer_bytes': ('gauge', "読み出し時にシリアルの受信バッファにたまっていたバイト数"),
+    'writer_queue_depth': ('gauge', "書き込みキューにたまっている件数"),
+    'process_batch_seconds': ('summary', "受信スレッドが1回の読み出し分の行を処理するのにかかった時間"),
+    'writer_batch_seconds': ('summary', "書き込みスレッドが1回にまとめて書き込むのにかかった時間"),
+    'plot_frame_seconds': ('summary', "ライブグラフの1フレームの更新にかかった時間"),
+}
+
+
+class _Timer:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Metrics:
+    """
+    計測中の状態を表すカウンタ・ゲージ・タイマーの集まり（各スレッドから更新してよい）。
+
+    カウンタは増えるだけの値（inc）、ゲージはその時点の値（set）、タイマーは所要時間の
+    回数・合計・最大（observe / time）。snapshot() で全てをまとめて読み、前回の snapshot からの
+    増え方で lines/s と bytes/s を計算する。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(int)
+        self.gauges = {}
+        self.timers = collections.defaultdict(_Timer)
+        self.start_time = time.perf_counter()
+        self.last_snapshot_time = self.start_time
+        self.last_counters = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timer = self.timers[name]
+            timer.count += 1
+            timer.total += seconds
+            if seconds > timer.max:
+                timer.max = seconds
+
+    @contextmanager
+    def time(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: counters, gauges, timers（count, sum, mean, max）, rates（前回の snapshot からの毎秒の増加）,
+            uptime_seconds。
+        """
+        now = time.perf_counter()
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {name: {'count': timer.count, 'sum': timer.total,
+                             'mean': timer.total / timer.count if timer.count else 0.0, 'max': timer.max}
+                      for name, timer in self.timers.items()}
+            elapsed = now - self.last_snapshot_time
+            rates = {}
+            if elapsed > 0:
+                for name in ('lines_total', 'bytes_total', 'data_records_total'):
+                    rates[name.replace('_total', '_per_second')] = (
+                        (counters.get(name, 0) - self.last_counters.get(name, 0)) / elapsed)
+            self.last_snapshot_time = now
+            self.last_counters = counters
+        return {'uptime_seconds': now - self.start_time, 'counters': counters, 'gauges': dict(self.gauges),
+                'timers': timers, 'rates': rates}
+
+    def prometheus_text(self, prefix='ushi_'):
+        """ Prometheus のテキスト形式（カウンタ・ゲージ・タイマーの _count/_sum/_max） """
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {name: (timer.count, timer.total, timer.max) for name, timer in self.timers.items()}
+        gauges = dict(self.gauges)
+        lines = []
+
+        def header(name, default_kind):
+            kind, text = METRIC_HELP.get(name, (default_kind, name))
+            lines.append(f"# HELP {prefix}{name} {text}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for name in sorted(counters):
+            header(name, 'counter')
+            lines.append(f"{prefix}{name} {counters[name]}")
+        for name in sorted(gauges):
+            header(name, 'gauge')
+            lines.append(f"{prefix}{name} {gauges[name]}")
+        for name in sorted(timers):
+            count, total, maximum = timers[name]
+            header(name, 'summary')
+            lines.append(f"{prefix}{name}_count {count}")
+            lines.append(f"{prefix}{name}_sum {total}")
+            lines.append(f"{prefix}{name}_max {maximum}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Metrics を定期的にJSONファイルに書き出し、必要なら localhost の HTTP で Prometheus 形式で公開する。
+
+    Parameters:
+        metrics (Metrics): 公開する値。
+        json_path (str): 書き出すJSONファイル（Noneなら書き出さない）。置き換えは一時ファイルから行う。
+        port (int): Prometheus の /metrics を公開するポート（Noneなら公開しない）。127.0.0.1 だけで待ち受ける。
+        interval (float): JSONファイルを書き出す間隔（秒）。
+        extra (callable): JSONに加える辞書を返す関数。
+    """
+
+    def __init__(self, metrics, json_path=None, port=None, interval=1.0, extra=None):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.port = port
+        self.interval = interval
+        self.extra = extra
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="metrics-exporter")
+        self.server = None
+
+    def start(self):
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/metrics', '/'):
+                        self.send_error(404)
+                        return
+                    body = metrics.prometheus_text().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics-http").start()
+            print(f"Prometheus形式の値を公開しています: http://127.0.0.1:{self.server.server_address[1]}/metrics")
+        if self.json_path is not None:
+            self.thread.start()
+        return self
+
+    def write_json(self):
+        snapshot = self.metrics.snapshot()
+        if self.extra is not None:
+            snapshot.update(self.extra())
+        temporary_path = self.json_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file_obj:
+            json.dump(snapshot, file_obj, ensure_ascii=False, indent=1)
+        os.replace(temporary_path, self.json_path)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write_json()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.json_path is not None:
+            # 最後の値を残す
+            self.write_json()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class SamplingProfiler:
+    """
+    指定したスレッドのスタックを一定間隔で覗き、どの行で時間を使っているかを数える簡単なプロファイラ。
+
+    対象のスレッドには何も仕掛けない（sys._current_frames で外から読む）ので、計測への影響は小さい。
+
+    Parameters:
+        thread_id (int): 対象のスレッドの threading.get_ident()。
+        interval (float): サンプリング間隔（秒）。
+        depth (int): 記録するスタックの深さ（内側から）。
+    """
+
+    def __init__(self, thread_id, interval=0.005, depth=4):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.depth = depth
+        self.samples = collections.Counter()
+        self.leaf_samples = collections.Counter()
+        self.sample_count = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="sampling-profiler")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.depth)
+            key = tuple(f"{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}" for entry in reversed(stack))
+            self.samples[key] += 1
+            self.leaf_samples[key[0]] += 1
+            self.sample_count += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def report(self, top=15):
+        """ 多かった行とスタックの一覧（文字列） """
+        lines = [f"サンプル数: {self.sample_count} (間隔 {self.interval * 1000:.1f} ms)", "", "--- 行ごと ---"]
+        for location, count in self.leaf_samples.most_common(top):
+            lines.append(f"{count / max(self.sample_count, 1):7.1%}  {location}")
+        lines += ["", "--- スタックごと（内側から） ---"]
+        for stack, count in self.samples.most_common(top):
+            lines.append(f"{count / max(self.sample_count, 1):7.1%}  " + " <- ".join(stack))
+        return "\n".join(lines)
@@ -0,0 +1,170 @@
+"""
+複数の装置（ESP32）を1つのプロセスで同時に計測するスクリプト。
+
+装置ごとに DataCollector を作り、受信は装置ごとのスレッドで行う（シリアルの読み出しは
+GILを手放して待つので、1つの装置の受信が他の装置の受信を待たせない）。CSVへの書き込みも
+装置ごとの RecordWriter のスレッドで行う。全ての装置は同じ速度スケジュールで、
+段階の切り替えは共通の開始時刻（time.perf_counter）を基準にする。記録される Timestamp(python) も
+同じ time.perf_counter なので、装置間でそのまま比べられる。
+グラフは全ての装置を1つのウィンドウに縦に並べて表示する。
+
+使い方:
+    python multi_rig.py                       # COMポートを一覧から複数選ぶ
+    python multi_rig.py --ports COM3 COM4
+    python multi_rig.py --simulate 3          # 実機の代わりに疑似デバイスを3台使う
+"""
+import argparse
+import datetime
+import os
+import re
+import threading
+import time
+
+import serial.tools.list_ports
+
+from USHI_seigyo2 import DataCollector
+
+
+def port_label(port):
+    """ ポート名をファイル名に使える形にする（例: /dev/ttyUSB0 → ttyUSB0） """
+    return re.sub(r'[^0-9A-Za-z_-]+', '_', os.path.basename(port)).strip('_') or 'port'
+
+
+class MultiRigSession:
+    """
+    複数の DataCollector を同じ設定・同じ開始時刻で動かす。
+
+    Parameters:
+        collectors (list): DataCollector のリスト。
+        labels (list): 各装置の名前（ファイル名とグラフのタイトルに使う）。
+    """
+
+    def __init__(self, collectors, labels):
+        self.collectors = list(collectors)
+        self.labels = list(labels)
+        for collector, label in zip(self.collectors, self.labels):
+            collector.name = label
+        self.threads = []
+        self.start_ut = None
+
+    def configure(self, initial_rpm, final_rpm, planned_steps, operation_during, memoname, profile_kind='linear',
+                  profile_table=None):
+        for collector in self.collectors:
+            collector.configure(initial_rpm, final_rpm, planned_steps, operation_during, memoname,
+                                profile_kind=profile_kind, profile_table=profile_table)
+
+    def prompt_settings(self):
+        """ 設定を1回だけ入力させ、全ての装置に同じ設定を使う """
+        first = self.collectors[0]
+        first.prompt_settings()
+        self.configure(first.initial_rpm, first.final_rpm, first.planned_steps, first.operation_during, first.memoname,
+                       profile_kind=first.profile_kind, profile_table=first.profile if first.profile_kind == 'table' else None)
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def run(self, directory_name, show_plot=True):
+        """
+        全ての装置の計測を行い、終わったらファイルを閉じてグラフの画像を保存する。
+
+        Parameters:
+            directory_name (str): 保存先のディレクトリ。
+            show_plot (bool): Trueならライブグラフを表示する（Falseなら終了まで待つだけ）。
+        """
+        memoname = self.collectors[0].memoname
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        file_prefixes = [f'{timestamp}_{memoname}_{label}' for label in self.labels]
+        for collector, file_prefix in zip(self.collectors, file_prefixes):
+            collector.open_outputs(directory_name, file_prefix)
+
+        # 全ての装置で共通の開始時刻
+        self.start_ut = time.perf_counter()
+        self.threads = [threading.Thread(target=collector.receive_and_process,
+                                         kwargs={'start_ut': self.start_ut, 'close_plot': False},
+                                         name=f"receiver-{label}")
+                        for collector, label in zip(self.collectors, self.labels)]
+        for thread in self.threads:
+            thread.start()
+
+        if show_plot:
+            # matplotlib.pyplot は表示するときだけ読み込む（--no-plot では起動が遅くならないように）
+            from live_view import LivePlot
+
+            # 全ての装置を1つのウィンドウに表示し、全ての受信が終わったら閉じる
+            LivePlot([collector.samples for collector in self.collectors], titles=self.labels,
+                     x_field='host_time', x_origin=self.start_ut,
+                     window=self.collectors[0].live_window, stop_when=lambda: not self.is_running(),
+                     metrics=[collector.metrics for collector in self.collectors]).show()
+
+        for thread in self.threads:
+            thread.join()
+
+        for collector, label in zip(self.collectors, self.labels):
+            print(f"\n=== {label} ===")
+            collector.close_outputs()
+
+        for collector, file_prefix in zip(self.collectors, file_prefixes):
+            collector.plot_graph_and_save(os.path.join(directory_name, f'{file_prefix}_graph_image.png'), dpi=300)
+
+
+def select_com_ports():
+    """ 利用可能なCOMポートの一覧から、使うポートを複数選ばせる """
+    ports = serial.tools.list_ports.comports()
+    if not ports:
+        print("利用可能なCOMポートが見つかりませんでした。")
+        return []
+
+    print("利用可能なCOMポート:")
+    for i, port in enumerate(ports):
+        print(f"{i+1}: {port.device} - {port.description}")
+
+    while True:
+        text = input("使用するCOMポートの番号をカンマ区切りで選択してください (例: 1,3): ")
+        try:
+            choices = [int(value) for value in text.replace(' ', '').split(',') if value]
+        except ValueError:
+            print("無効な入力です。整数をカンマ区切りで入力してください。")
+            continue
+        if choices and all(1 <= choice <= len(ports) for choice in choices) and len(set(choices)) == len(choices):
+            return [ports[choice - 1].device for choice in choices]
+        print("無効な選択です。もう一度試してください。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数の装置を同時に計測する")
+    parser.add_argument('--ports', nargs='+', default=None, help="使用するCOMポート（省略すると一覧から選ぶ）")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--simulate', type=int, default=0, help="実機の代わりに使う疑似デバイスの台数")
+    parser.add_argument('--no-plot', action='store_true', help="ライブグラフを表示しない")
+    parser.add_argument('--metrics', action='store_true', help="受信の状態を装置ごとの _esp32_metrics.json に書き出す")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="受信の状態を Prometheus 形式で公開するポート（装置ごとに1つずつ増やす）")
+    parser.add_argument('--profile-receive', action='store_true', help="受信スレッドのプロファイルを _esp32_profile.txt に書き出す")
+    args = parser.parse_args()
+
+    def metrics_options(i):
+        return {'metrics_export': args.metrics, 'profile_receive': args.profile_receive,
+                'metrics_port': args.metrics_port + i if args.metrics_port is not None else None}
+
+    if args.simulate:
+        from esp32_simulator import SimulatedESP32
+        labels = [f"sim{i + 1}" for i in range(args.simulate)]
+        collectors = [DataCollector(ser=SimulatedESP32(seed=i), **metrics_options(i)) for i in range(args.simulate)]
+    else:
+        ports = args.ports or select_com_ports()
+        if not ports:
+            print("COMポートが選択されませんでした。")
+            return
+        print(f"選択されたCOMポート: {', '.join(ports)}")
+        labels = [port_label(port) for port in ports]
+        collectors = [DataCollector(port=port, baudrate=args.baudrate, **metrics_options(i))
+                      for i, port in enumerate(ports)]
+
+    session = MultiRigSession(collectors, labels)
+    session.prompt_settings()
+    directory_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    session.run(directory_name, show_plot=not args.no_plot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import collections
+import csv
+import math
+import threading
+import time
+
+import numpy as np
+
+from exp_fit import fit_exponential
+
+
+class RunningStats:
+    """ 件数・平均・分散・最小・最大を逐次計算する（配列でまとめて追加できる Welford/Chan の方法） """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = values.size
+        if n == 0:
+            return
+        batch_mean = values.mean()
+        batch_m2 = np.dot(values - batch_mean, values - batch_mean)
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """
+    分位点を一定の相対誤差で近似する、メモリ量が一定でマージできるスケッチ（DDSketch と同じ考え方）。
+
+    値の絶対値を対数スケールのバケツ（幅 gamma = (1+α)/(1-α) 倍）に数えるだけなので、
+    配列でまとめて追加でき、別々に作ったスケッチを merge() で足し合わせられる。
+    返す分位点の値 q' は真の値 q に対して |q' - q| <= α|q| を満たす。
+
+    Parameters:
+        relative_accuracy (float): 相対誤差 α。
+        min_value (float): これより絶対値が小さい値は0として数える。
+    """
+
+    def __init__(self, relative_accuracy=0.001, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_to_store(self, store, magnitudes):
+        keys = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(unique_keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        positive = values > self.min_value
+        negative = values < -self.min_value
+        if positive.any():
+            self._add_to_store(self.positive, values[positive])
+        if negative.any():
+            self._add_to_store(self.negative, -values[negative])
+        self.zero_count += int(values.size - positive.sum() - negative.sum())
+        self.count += int(values.size)
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """ q (0〜1) 分位点の近似値。データがなければ nan """
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        # 小さい順: 負の値（絶対値の大きい順）→ 0 → 正の値
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class RunningExponentialFit:
+    """
+    重量 対 時間 の指数関数近似を、計測中に逐次更新する。
+
+    サンプルは block_size 個ずつの平均に間引いて保持し、個数が capacity に達したら
+    隣り合う2つをまとめて block_size を倍にするので、メモリは計測時間によらず一定。
+    fit() はこの間引いた系列を exp_fit.fit_exponential で近似する。
+
+    Parameters:
+        capacity (int): 保持する間引いた点の数の上限（偶数）。
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.block_size = 1
+        self.times = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.length = 0
+        # block_size に満たない端数
+        self.pending_times = np.empty(0, dtype=np.float64)
+        self.pending_values = np.empty(0, dtype=np.float64)
+        self.t0 = None
+
+    def update(self, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if times.size == 0:
+            return
+        if self.t0 is None:
+            self.t0 = float(times[0])
+        times = np.concatenate((self.pending_times, times - self.t0))
+        values = np.concatenate((self.pending_values, values))
+        while True:
+            full = times.size // self.block_size * self.block_size
+            if full == 0:
+                break
+            room = (self.capacity - self.length) * self.block_size
+            take = min(full, room)
+            blocks = take // self.block_size
+            self.times[self.length:self.length + blocks] = times[:take].reshape(blocks, -1).mean(axis=1)
+            self.values[self.length:self.length + blocks] = values[:take].reshape(blocks, -1).mean(axis=1)
+            self.length += blocks
+            times, values = times[take:], values[take:]
+            if self.length == self.capacity:
+                # 隣り合う2つをまとめて半分にする
+                half = self.capacity // 2
+                self.times[:half] = self.times.reshape(half, 2).mean(axis=1)
+                self.values[:half] = self.values.reshape(half, 2).mean(axis=1)
+                self.length = half
+                self.block_size *= 2
+        self.pending_times = times
+        self.pending_values = values
+
+    def points(self):
+        """ 間引いた系列 (時間, 重量) のコピー。時間は最初のサンプルからの経過時間 """
+        return self.times[:self.length].copy(), self.values[:self.length].copy()
+
+    def fit(self):
+        """
+        間引いた系列で近似する。
+
+        Returns:
+            exp_fit.ExponentialFitResult。params の b は最初のサンプルからの経過時間に対する値。
+
+        Raises:
+            RuntimeError: データ点が不足している場合、または近似が収束しなかった場合。
+        """
+        times, values = self.points()
+        return fit_exponential(times, values)
+
+
+StepSummary = collections.namedtuple(
+    'StepSummary', ['step', 'rpm', 'motor_delay', 'start_time', 'count', 'mean', 'std', 'min', 'max',
+                    'q25', 'median', 'q75'])
+
+STEP_SUMMARY_COLUMNS = ['Step', 'Commanded Speed(rpm)', 'Motor Delay(us)', 'Start Timestamp(UT)', 'Samples',
+                        'Mean Weight(g)', 'Std Weight(g)', 'Min Weight(g)', 'Max Weight(g)',
+                        'Q25 Weight(g)', 'Median Weight(g)', 'Q75 Weight(g)']
+
+
+class StepStatistics:
+    """ 1つの速度段階の重量の統計量（平均・分散・最小・最大と分位点） """
+
+    def __init__(self, step, rpm, motor_delay, start_time):
+        self.step = step
+        self.rpm = rpm
+        self.motor_delay = motor_delay
+        self.start_time = start_time
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch()
+        # ESP32 がこの段階の速度で送ってきたデータを受け取ったか
+        self.acknowledged = False
+
+    def update(self, weights):
+        self.stats.update(weights)
+        self.sketch.update(weights)
+
+    def summary(self):
+        stats = self.stats
+        return StepSummary(self.step, self.rpm, self.motor_delay, self.start_time, stats.count,
+                           float(stats.mean) if stats.count else math.nan, stats.std,
+                           stats.min if stats.count else math.nan, stats.max if stats.count else math.nan,
+                           self.sketch.quantile(0.25), self.sketch.quantile(0.5), self.sketch.quantile(0.75))
+
+
+class OnlineRunStatistics:
+    """
+    計測中に、速度段階ごとの重量の統計量と、重量 対 時間 の指数関数近似を逐次計算する。
+
+    受信スレッドが start_step() と update() を呼び、表示側は summaries() と fit() で
+    途中経過を読む（ロックで保護しているので別スレッドから呼んでよい）。
+    set_speed を送った直後に届くデータはまだ前の速度のものなので、データの Speed Delay が
+    新しい段階の motor_delay と一致した時点から新しい段階に数える。finish() でモーターを止めた後は、
+    Speed Delay が停止の値になった時点から、どの段階にも数えない（停止したモーターのデータで最後の段階が
+    ずれないように。段階の索引 _esp32_steps.csv と同じ行の範囲になる）。
+
+    Parameters:
+        refit_interval (float): fit() が近似をやり直す最短の間隔（秒）。
+        batch_size (int): この件数のサンプルがたまるごとに統計量を更新する。
+    """
+
+    def __init__(self, refit_interval=1.0, batch_size=256):
+        self.lock = threading.Lock()
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_count = 0
+        self.steps = []
+        # finish() で送った停止の Speed Delay と、そのデータが届いて最後の段階を閉じたか
+        self.stop_delay = None
+        self.stopped = False
+        self.fitter = RunningExponentialFit()
+        self.refit_interval = refit_interval
+        self.last_fit_time = -math.inf
+        self.last_fit = None
+        self.last_fit_error = None
+
+    def start_step(self, step, rpm, motor_delay, start_time):
+        with self.lock:
+            self._flush()
+            self.steps.append(StepStatistics(step, rpm, motor_delay, start_time))
+
+    def finish(self, stop_delay=0):
+        """ モーターを止めた（set_speed stop_delay を送った）ことを記録する """
+        with self.lock:
+            self._flush()
+            self.stop_delay = stop_delay
+
+    def update(self, timestamps_esp32, weights, speed_delay):
+        """
+        受信したサンプルを追加する。1行ずつ呼ばれても重くならないように、
+        batch_size 件たまるまで（または途中経過が読まれるまで）まとめてから計算する。
+
+        Parameters:
+            timestamps_esp32 (array-like): Timestamp(ESP32)。
+            weights (array-like): 重量。
+            speed_delay (array-like): データに含まれる Speed Delay。
+        """
+        with self.lock:
+            self.pending.append((timestamps_esp32, weights, speed_delay))
+            self.pending_count += len(weights)
+            if self.pending_count >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        """ たまっているサンプルを統計量に反映する（lock を取った状態で呼ぶ） """
+        if not self.pending:
+            return
+        timestamps_esp32 = np.concatenate([chunk[0] for chunk in self.pending]).astype(np.float64)
+        weights = np.concatenate([chunk[1] for chunk in self.pending]).astype(np.float64)
+        speed_delay = np.concatenate([chunk[2] for chunk in self.pending])
+        self.pending = []
+        self.pending_count = 0
+        if weights.size == 0:
+            return
+
+        self.fitter.update(timestamps_esp32, weights)
+        if not self.steps or self.stopped:
+            return
+        current = self.steps[-1]
+        if not current.acknowledged:
+            matched = np.flatnonzero(speed_delay == current.motor_delay)
+            split = matched[0] if matched.size else weights.size
+            if split and len(self.steps) > 1:
+                self.steps[-2].update(weights[:split])
+            if not matched.size:
+                return
+            current.acknowledged = True
+            weights = weights[split:]
+            speed_delay = speed_delay[split:]
+        if self.stop_delay is not None:
+            stopped = np.flatnonzero(speed_delay == self.stop_delay)
+            if stopped.size:
+                self.stopped = True
+                weights = weights[:stopped[0]]
+        current.update(weights)
+
+    def summaries(self):
+        with self.lock:
+            self._flush()
+            return [step.summary() for step in self.steps]
+
+    def current_summary(self):
+        with self.lock:
+            self._flush()
+            return self.steps[-1].summary() if self.steps else None
+
+    def fit(self, force=False):
+        """
+        これまでのデータで 重量 対 時間 を近似する（前回から refit_interval 秒以内なら前回の結果を返す）。
+
+        Returns:
+            exp_fit.ExponentialFitResult または None（まだ近似できない場合。理由は last_fit_error）。
+        """
+        now = time.perf_counter()
+        if not force and now - self.last_fit_time < self.refit_interval:
+            return self.last_fit
+        self.last_fit_time = now
+        with self.lock:
+            self._flush()
+            times, values = self.fitter.points()
+        # 近似はロックの外で行い、受信スレッドを待たせない
+        try:
+            self.last_fit = fit_exponential(times, values)
+            self.last_fit_error = None
+        except RuntimeError as e:
+            self.last_fit_error = str(e)
+        return self.last_fit
+
+    def status_text(self):
+        """ 状態表示の1行に付け加える文字列 """
+        summary = self.current_summary()
+        if summary is None or summary.count == 0:
+            return ""
+        text = (f"段階{summary.step} {summary.rpm:g}rpm: 平均 {summary.mean:.3f}g  "
+                f"中央値 {summary.median:.3f}g  標準偏差 {summary.std:.3f}g")
+        result = self.fit()
+        if result is not None:
+            text += f"  近似 b={result.params[1]:.3e}"
+        return text
+
+    def write_csv(self, file_path):
+        """ 速度段階ごとの統計量をCSVに書き出す """
+        with open(file_path, 'w', newline='') as file_obj:
+            csv_writer = csv.writer(file_obj)
+            csv_writer.writerow(STEP_SUMMARY_COLUMNS)
+            csv_writer.writerows(self.summaries())
+
+    def print_summary(self):
+        print("\n--- 速度段階ごとの重量 ---")
+        print(f"{'段階':>4} {'速度(rpm)':>10} {'件数':>7} {'平均(g)':>10} {'標準偏差':>9} {'中央値(g)':>10} "
+              f"{'Q25(g)':>10} {'Q75(g)':>10}")
+        for s in self.summaries():
+            print(f"{s.step:>4} {s.rpm:>10.1f} {s.count:>7} {s.mean:>10.3f} {s.std:>9.3f} {s.median:>10.3f} "
+                  f"{s.q25:>10.3f} {s.q75:>10.3f}")
+        result = self.fit(force=True)
+        if result is not None:
+            a, b, c = result.params
+            print(f"重量 対 時間 の近似（計測中に更新）: y = {a:.4f} * exp({b:.4e} * t) + {c:.4f}  MSE: {result.mse:.4f}")
+        elif self.last_fit_error:
+            print(f"重量 対 時間 の近似はできませんでした: {self.last_fit_error}")
+
+
+class ReservoirSample:
+    """
+    全体から一様に選んだ最大 capacity 点の標本を保持する（ボトムk抽出）。
+
+    各点に一様乱数のキーを付け、キーの小さい capacity 点だけを残すので、
+    配列でまとめて追加でき、データ全体の大きさによらずメモリは一定。
+    """
+
+    def __init__(self, capacity=200000, seed=0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0, dtype=np.float64)
+        self.columns = None
+
+    def update(self, *columns):
+        columns = [np.asarray(column) for column in columns]
+        n = len(columns[0])
+        if n == 0:
+            return
+        keys = np.concatenate((self.keys, self.rng.random(n)))
+        if self.columns is not None:
+            columns = [np.concatenate((kept, column)) for kept, column in zip(self.columns, columns)]
+        if keys.size > self.capacity:
+            keep = np.argpartition(keys, self.capacity - 1)[:self.capacity]
+            keep.sort()
+            keys = keys[keep]
+            columns = [column[keep] for column in columns]
+        self.keys = keys
+        self.columns = columns
+
+    def __len__(self):
+        return self.keys.size
@@ -0,0 +1,484 @@
+"""
+記録・デバッグ用の生のログ（_esp32_raw.csv）から、計測データ（_esp32_data.csv / _esp32_data.bin）と
+段階の索引（_esp32_steps.csv）を作り直すスクリプト。
+
+生のログにはESP32から受信した全ての行（ノイズで壊れた行も）が残っているので、校正値
+（OUT_VOL, HX711_AVDD, LOAD, HX711_PGA, ゼロ点のオフセット）を直したときに、計測をやり直さずに
+重量を計算し直せる。計測中と同じ解析（serial_ingest.parse_data_lines_detailed）と変換（raw_to_weight, delay_to_rpm）を
+chunk_rows 行ずつまとめて行い、複数のファイルは別々のプロセスで並列に処理する。
+解析できなかった行は、出力先の replay_unrecoverable.csv に行番号と内容を書き出す。
+
+出力先に同じ名前のファイルがあれば、--overwrite を付けない限り書き込まない（元の計測データを上書きしないため）。
+
+使い方:
+    python replay_raw.py data --output-dir data_replay                 # data/ 以下の全ての生のログから作り直す
+    python replay_raw.py data --output-dir data_replay --format bin --offset 138.5
+    python replay_raw.py data/2024-01-01_12-00-00_test_esp32_raw.csv --output-dir out --out-vol 0.00071
+"""
+import argparse
+import collections
+import csv
+import itertools
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from binary_record import BinaryRecordWriter
+from clock_sync import ClockSync
+from serial_ingest import WEIGHT_OFFSET, delay_to_rpm, parse_data_lines_detailed, raw_to_weight
+from step_index import ACK_PREFIX, StepIndexBuilder, parse_ack_delay, write_step_index
+from USHI_seigyo2 import HX711_AVDD, HX711_PGA, LOAD, OUT_VOL
+
+RAW_SUFFIX = '_esp32_raw.csv'
+REPORT_FILE_NAME = 'replay_unrecoverable.csv'
+REPORT_COLUMNS = ['raw_file', 'line', 'reason', 'text']
+DATA_COLUMNS = ['Timestamp(python)', 'Timestamp(ESP32)', 'weight', 'speed(delay)', 'speed(rpm)']
+# 1回にまとめて解析する行数
+REPLAY_CHUNK_ROWS = 200000
+
+# 1つの生のログの作り直しの結果。unrecoverable は (行番号, 理由, 内容) のリスト
+ReplayResult = collections.namedtuple(
+    'ReplayResult', ['raw_path', 'output_path', 'steps_path', 'records', 'lines', 'unrecoverable', 'error'])
+
+# show_and_save_settings と SpeedScheduler が生のログに書く行
+_SETTING_PATTERN = re.compile(r'(initial_rpm|final_rpm|planned_steps|operation_during|speed_profile): (.*)$')
+_STEP_PATTERN = re.compile(r'step (\d+): rpm ([^,]+), delay (-?\d+), start ([^ ]+) s, duration ([^ ]+) s$')
+_DISPATCH_PATTERN = re.compile(r'step (\d+) dispatched: rpm ([^,]+), delay (-?\d+)')
+# multi_rig で計測したときに DataCollector が書く装置の名前（ファイル名の最後に付いている）
+_RIG_PATTERN = re.compile(r'rig: (.+)$')
+# ファイル名の先頭の日時（'YYYY-mm-dd_HH-MM-SS_'）の長さ
+_TIMESTAMP_PREFIX_LENGTH = len('YYYY-mm-dd_HH-MM-SS_')
+
+
+def hx711_calibration(out_vol=OUT_VOL, avdd=HX711_AVDD, load=LOAD, pga=HX711_PGA, offset=WEIGHT_OFFSET):
+    """
+    HX711とロードセルの定数から、重量の計算に使う校正値を求める（USHI_seigyo2.py の HX711_SCALE, HX711_ADC1bit と同じ式）。
+
+    Returns:
+        dict: adc1bit, scale, offset（BinaryRecordWriter のヘッダの calibration と同じ形式）。
+    """
+    return {'adc1bit': avdd / 16777216, 'scale': out_vol * avdd / load * pga, 'offset': offset}
+
+
+def split_raw_line(line):
+    """
+    生のログの1行（csv.writer で書いた "<時刻>,<受信した行>"）を (時刻, 受信した行) に分ける。
+
+    csv.reader は閉じていない引用符があると次の行まで1つの値として読んでしまい、壊れた行の次の正しい行も
+    失われるので、1行ずつ分ける。壊れていて分けられなければNoneを返す。
+    """
+    time_text, separator, text = line.rstrip('\r\n').partition(',')
+    if not separator:
+        return None
+    if text.startswith('"'):
+        if len(text) < 2 or not text.endswith('"'):
+            return None
+        text = text[1:-1].replace('""', '"')
+    return time_text, text
+
+
+def memoname_from_raw_path(raw_path, rig=None):
+    """
+    生のログのファイル名（'<日時>_<メモ>_esp32_raw.csv'、multi_rig では '<日時>_<メモ>_<装置>_esp32_raw.csv'）
+    からメモを取り出す。
+
+    rig（生のログの "rig: <装置>" の行）があればその名前を末尾から除く。その行のない古いログでは、
+    同じディレクトリに同じ日時の生のログがほかにもあれば multi_rig の計測とみなし、
+    共通の部分（最後の '_' まで）をメモとする。
+    """
+    name = os.path.basename(raw_path)[_TIMESTAMP_PREFIX_LENGTH:-len(RAW_SUFFIX)]
+    if rig is not None:
+        return name[:-len(rig) - 1] if name.endswith('_' + rig) and len(name) > len(rig) + 1 else name
+    directory = os.path.dirname(raw_path) or '.'
+    prefix = os.path.basename(raw_path)[:_TIMESTAMP_PREFIX_LENGTH]
+    try:
+        siblings = [entry[_TIMESTAMP_PREFIX_LENGTH:-len(RAW_SUFFIX)] for entry in os.listdir(directory)
+                    if entry.startswith(prefix) and entry.endswith(RAW_SUFFIX)]
+    except OSError:
+        return name
+    if len(siblings) < 2:
+        return name
+    common = os.path.commonprefix(siblings)
+    return common[:common.rfind('_')] if '_' in common else name
+
+
+def iter_raw_chunks(raw_path, chunk_rows=REPLAY_CHUNK_ROWS):
+    """
+    生のログを chunk_rows 行ずつ読む（見出しの行は除く）。
+
+    Yields:
+        tuple: (first_line_number, lines)。lines はファイルの行（改行を含む）のリスト、
+        first_line_number はその最初の行のファイルの行番号。
+    """
+    # ノイズで壊れた行があっても止まらないように、デコードできない文字は置き換える。
+    # 行は '\n' だけで区切る（newline='' では行の途中の '\r' でも区切られ、1行が2つの壊れた行になる）
+    with open(raw_path, newline='\n', errors='replace') as file_obj:
+        next(file_obj, None)
+        line_number = 2
+        while True:
+            lines = list(itertools.islice(file_obj, chunk_rows))
+            if not lines:
+                return
+            yield line_number, lines
+            line_number += len(lines)
+
+
+def read_dispatch_times(raw_path):
+    """
+    生のログの "step <n> dispatched: ..." の行（SpeedScheduler が速度を変えた時刻。計測の最後にまとめて書かれる）を読む。
+
+    Returns:
+        dict: 段階 → (速度を変えた時刻（Timestamp(python)）, rpm, delay)。
+    """
+    dispatched = {}
+    with open(raw_path, newline='\n', errors='replace') as file_obj:
+        for line in file_obj:
+            if 'dispatched: ' not in line:
+                continue
+            row = split_raw_line(line)
+            match = _DISPATCH_PATTERN.match(row[1]) if row is not None else None
+            if match:
+                try:
+                    dispatched[int(match.group(1))] = (float(row[0]), float(match.group(2)), int(match.group(3)))
+                except ValueError:
+                    pass
+    return dispatched
+
+
+class _StepIndexReplay:
+    """
+    生のログから段階の索引を作り直す。
+
+    計測中は速度を変えたとき（SpeedScheduler）に段階を登録し、その後に処理した[data]行から段階の始まりを探す。
+    生のログにはその時刻が "step <n> dispatched: ..." の行として計測の最後にまとめて書かれるので、
+    先に read_dispatch_times で読んでおき、Timestamp(python) がその時刻より後の[data]行の前で段階を登録する
+    （計測中と同じ行の範囲になる）。停止は時刻が書かれないので、最後の段階の後の delay 0 の応答で登録する。
+
+    dispatched の行がない古いログでは "speed was set : <delay>" の応答で段階を登録する。このとき計測の始めに
+    段階より先に送る set_speed 0 の応答は段階ではないので、最初の delay 0 の応答は使わない
+    （段階 0 の delay も 0 のときに、それを段階 0 と取り違えないため）。
+
+    Parameters:
+        profile (list): 設定の行から読んだ速度の表（[rpm, delay, start, duration] のリスト）。
+        dispatched (dict): read_dispatch_times の結果。
+    """
+
+    def __init__(self, profile, dispatched):
+        self.profile = profile
+        self.dispatched = dispatched
+        # 計測中と同じく、delay の変わらない段階の始まりは応答の時刻を ESP32 の時刻に直して探す
+        self.clock = ClockSync()
+        self.builder = StepIndexBuilder(clock=self.clock)
+        self.next_step = 0
+        self.first_ack = True
+
+    def _command(self, motor_delay):
+        if self.next_step < len(self.profile):
+            rpm = self.profile[self.next_step][0]
+        elif self.next_step in self.dispatched:
+            rpm = self.dispatched[self.next_step][1]
+        else:
+            # 速度の表にない（古い生のログで設定の行がない）段階
+            rpm = float(delay_to_rpm(motor_delay))
+        self.builder.command(self.next_step, rpm, motor_delay, None)
+        self.next_step += 1
+
+    def _acknowledge(self, ack_time, motor_delay):
+        first_ack, self.first_ack = self.first_ack, False
+        if self.dispatched:
+            # 段階は速度を変えた時刻で登録済み。全ての段階の後の delay 0 は停止
+            if motor_delay == 0 and self.next_step > 0 and self.next_step not in self.dispatched:
+                self.builder.finish(None)
+        elif first_ack and motor_delay == 0:
+            return
+        elif self.next_step < len(self.profile) and self.profile[self.next_step][1] == motor_delay:
+            self._command(motor_delay)
+        elif motor_delay == 0:
+            if self.next_step == 0:
+                return
+            self.builder.finish(None)
+        else:
+            self._command(motor_delay)
+        self.builder.acknowledge(ack_time, motor_delay)
+
+    def update(self, host_time, line_indices, millis, speed_delay, acks):
+        """
+        まとめて読んだ行を、計測中と同じ順に索引に載せる。
+
+        Parameters:
+            host_time, line_indices, millis, speed_delay (numpy.ndarray): [data]行の時刻・行の位置・値。
+            acks (list): 応答の (行の位置, 時刻, delay) のリスト（行の順）。
+        """
+        events = []
+        # 速度を変えた時刻より後に処理した[data]行の前で段階を登録する
+        # （このまとまりの最後の行より後に変えた段階は次のまとまりで）
+        times = [ack_time for _, ack_time, _ in acks] + ([float(host_time[-1])] if len(host_time) else [])
+        last_time = max(times, default=None)
+        step = self.next_step
+        while step in self.dispatched and last_time is not None and self.dispatched[step][0] < last_time:
+            events.append((int(np.searchsorted(host_time, self.dispatched[step][0], side='right')), 0, step))
+            step += 1
+        for line_index, ack_time, motor_delay in acks:
+            events.append((int(np.searchsorted(line_indices, line_index)), 1, (ack_time, motor_delay)))
+        events.sort(key=lambda event: event[:2])
+
+        def add_rows(rows):
+            if len(millis[rows]):
+                self.clock.update(host_time[rows], millis[rows])
+                self.builder.update(millis[rows], speed_delay[rows])
+
+        start = 0
+        for position, kind, value in events:
+            add_rows(slice(start, position))
+            start = max(start, position)
+            if kind == 0:
+                self._command(self.dispatched[value][2])
+            else:
+                self._acknowledge(*value)
+        add_rows(slice(start, None))
+
+    def segments(self):
+        return [segment._replace(command_time=self.dispatched[segment.step][0] if segment.step in self.dispatched
+                                 else None) for segment in self.builder.segments()]
+
+
+def _host_times(rows, indices, unrecoverable, first_line_number):
+    """ rows[indices] の Timestamp(python) を float の配列にする。読めない行は unrecoverable に加えて除く """
+    try:
+        return np.array([rows[index][0] for index in indices], dtype=np.float64), np.ones(len(indices), dtype=bool)
+    except ValueError:
+        pass
+    times = np.empty(len(indices))
+    valid = np.ones(len(indices), dtype=bool)
+    for position, index in enumerate(indices):
+        try:
+            times[position] = float(rows[index][0])
+        except ValueError:
+            valid[position] = False
+            unrecoverable.append((first_line_number + index, "時刻を読めません", rows[index][1]))
+    return times[valid], valid
+
+
+def replay_raw_log(raw_path, output_path, calibration, output_format='csv', chunk_rows=REPLAY_CHUNK_ROWS,
+                   steps_path=None):
+    """
+    生のログ1つから計測データを作り直す（別プロセスで実行される）。
+
+    出力は一時ファイルに書いてから置き換えるので、途中で止まっても出力先に書きかけのファイルは残らない。
+
+    Parameters:
+        raw_path (str): 生のログ（_esp32_raw.csv）のパス。
+        output_path (str): 作る計測データのパス。
+        calibration (dict): hx711_calibration の校正値。
+        output_format (str): 'csv' または 'bin'（BinaryRecordWriter の形式。校正値はヘッダに入る）。
+        steps_path (str): 段階の索引を作り直して書き出すパス（Noneなら書き出さない）。
+
+    Returns:
+        ReplayResult: records は作ったレコードの数、lines は読んだ行の数。
+    """
+    temporary_path = output_path + '.tmp'
+    settings = {'memoname': memoname_from_raw_path(raw_path)}
+    profile = []
+    unrecoverable = []
+    steps = None
+    records = 0
+    lines = 0
+    file_obj = csv_writer = binary_writer = None
+
+    def open_output():
+        nonlocal file_obj, csv_writer, binary_writer
+        if output_format == 'bin':
+            settings['steps'] = [list(step) for step in profile]
+            binary_writer = BinaryRecordWriter(temporary_path, settings=settings, calibration=calibration)
+        else:
+            file_obj = open(temporary_path, 'w', newline='')
+            csv_writer = csv.writer(file_obj)
+            csv_writer.writerow(DATA_COLUMNS)
+
+    try:
+        for first_line_number, file_lines in iter_raw_chunks(raw_path, chunk_rows):
+            lines += len(file_lines)
+            rows = [split_raw_line(line) for line in file_lines]
+            for index, row in enumerate(rows):
+                if row is None:
+                    if file_lines[index].strip():
+                        unrecoverable.append((first_line_number + index, "ログの行として読めません",
+                                              file_lines[index].rstrip('\r\n')))
+                    rows[index] = ('', '')
+            texts = [row[1] for row in rows]
+
+            # 設定（計測の最初、時刻0の行）
+            for text in texts:
+                if not text.startswith(('step ', 'initial_rpm', 'final_rpm', 'planned_steps', 'operation_during',
+                                        'speed_profile', 'rig: ')):
+                    continue
+                match = _RIG_PATTERN.match(text)
+                if match:
+                    settings['memoname'] = memoname_from_raw_path(raw_path, match.group(1))
+                    continue
+                match = _SETTING_PATTERN.match(text)
+                if match:
+                    key, value = match.groups()
+                    try:
+                        settings[key] = value if key == 'speed_profile' else int(value)
+                    except ValueError:
+                        settings[key] = value
+                    continue
+                match = _STEP_PATTERN.match(text)
+                if match:
+                    profile.append([float(match.group(2)), int(match.group(3)), float(match.group(4)),
+                                    float(match.group(5))])
+
+            line_indices, millis, raw, speed_delay, malformed_lines = parse_data_lines_detailed(texts)
+            unrecoverable.extend((first_line_number + index, "[data]行を解析できません", texts[index])
+                                 for index in malformed_lines)
+            host_time, valid = _host_times(rows, line_indices, unrecoverable, first_line_number)
+            line_indices, millis, raw, speed_delay = (line_indices[valid], millis[valid], raw[valid],
+                                                      speed_delay[valid])
+
+            # バイナリのヘッダに設定を書くので、設定の行（データの前にある）を読み終えてから開く
+            if file_obj is None and binary_writer is None and len(millis):
+                open_output()
+            if steps is None and steps_path is not None:
+                steps = _StepIndexReplay(profile, read_dispatch_times(raw_path))
+            weights = raw_to_weight(raw, calibration['adc1bit'], calibration['scale'], calibration['offset'])
+            if binary_writer is not None:
+                binary_writer.append(host_time, millis, raw, speed_delay)
+            elif csv_writer is not None:
+                csv_writer.writerows(zip(host_time.tolist(), millis.tolist(), weights.tolist(), speed_delay.tolist(),
+                                         delay_to_rpm(speed_delay).tolist()))
+            records += len(millis)
+
+            if steps is not None:
+                acks = []
+                for index, text in enumerate(texts):
+                    if not text.startswith(ACK_PREFIX):
+                        continue
+                    ack_delay = parse_ack_delay(text)
+                    try:
+                        ack_time = float(rows[index][0])
+                    except ValueError:
+                        continue
+                    if ack_delay is not None:
+                        acks.append((index, ack_time, ack_delay))
+                steps.update(host_time, line_indices, millis, speed_delay, acks)
+
+        if file_obj is None and binary_writer is None:
+            open_output()
+    except Exception as e:
+        for writer in (file_obj, binary_writer):
+            if writer is not None:
+                writer.close()
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return ReplayResult(raw_path, None, None, records, lines, unrecoverable, str(e))
+
+    (binary_writer or file_obj).close()
+    os.replace(temporary_path, output_path)
+    segments = steps.segments() if steps is not None else []
+    if segments:
+        write_step_index(steps_path, segments)
+    return ReplayResult(raw_path, output_path, steps_path if segments else None, records, lines, unrecoverable, None)
+
+
+def discover_raw_logs(paths):
+    """
+    生のログを探す。
+
+    Parameters:
+        paths (list): 生のログのファイルまたはディレクトリ（中を再帰的に探す）。
+
+    Returns:
+        list: (生のログのパス, 出力先のディレクトリからの相対的な出力のパスの先頭) のリスト。
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for file_name in sorted(files):
+                    if file_name.endswith(RAW_SUFFIX):
+                        relative = os.path.relpath(os.path.join(root, file_name), path)
+                        found.append((os.path.join(root, file_name), relative[:-len(RAW_SUFFIX)]))
+        elif path.endswith(RAW_SUFFIX):
+            found.append((path, os.path.basename(path)[:-len(RAW_SUFFIX)]))
+    return sorted(found)
+
+
+def replay_files(paths, output_directory, calibration, output_format='csv', workers=None, overwrite=False,
+                 chunk_rows=REPLAY_CHUNK_ROWS):
+    """
+    生のログをまとめて作り直す（ファイルごとに別プロセスで並列に処理する）。
+
+    Returns:
+        list: ReplayResult のリスト。出力先に同じ名前のファイルがあって上書きしなかったものは error にその旨が入る。
+    """
+    results = []
+    tasks = []
+    for raw_path, prefix in discover_raw_logs(paths):
+        output_path = os.path.join(output_directory, f'{prefix}_esp32_data.{output_format}')
+        steps_path = os.path.join(output_directory, f'{prefix}_esp32_steps.csv')
+        if not overwrite and os.path.exists(output_path):
+            results.append(ReplayResult(raw_path, None, None, 0, 0, [], f"出力先に同じ名前のファイルがあります: {output_path}"))
+            continue
+        if not overwrite and os.path.exists(steps_path):
+            steps_path = None
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tasks.append((raw_path, output_path, calibration, output_format, chunk_rows, steps_path))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results.extend(executor.map(replay_raw_log, *zip(*tasks)))
+    return results
+
+
+def write_report(results, report_path):
+    """ 解析できなかった行の一覧をCSVに書き出す """
+    with open(report_path, 'w', newline='', encoding='utf-8') as file_obj:
+        csv_writer = csv.writer(file_obj)
+        csv_writer.writerow(REPORT_COLUMNS)
+        for result in results:
+            for line_number, reason, text in result.unrecoverable:
+                csv_writer.writerow([result.raw_path, line_number, reason, text])
+
+
+def main():
+    defaults = hx711_calibration()
+    parser = argparse.ArgumentParser(description="生のログ（_esp32_raw.csv）から計測データを作り直す")
+    parser.add_argument('paths', nargs='+', help="生のログのファイルまたはディレクトリ")
+    parser.add_argument('--output-dir', required=True, help="作り直した計測データの保存先")
+    parser.add_argument('--format', choices=['csv', 'bin'], default='csv', help="計測データの形式（既定: csv）")
+    parser.add_argument('--out-vol', type=float, default=OUT_VOL, help=f"ロードセルの定格出力（既定: {OUT_VOL}）")
+    parser.add_argument('--avdd', type=float, default=HX711_AVDD, help=f"HX711のAVDD(V)（既定: {HX711_AVDD}）")
+    parser.add_argument('--load', type=float, default=LOAD, help=f"ロードセルの定格容量（既定: {LOAD}）")
+    parser.add_argument('--pga', type=float, default=HX711_PGA, help=f"HX711のゲイン（既定: {HX711_PGA}）")
+    parser.add_argument('--offset', type=float, default=defaults['offset'],
+                        help=f"ゼロ点のオフセット（既定: {defaults['offset']}）")
+    parser.add_argument('--workers', type=int, default=None, help="プロセス数（既定: コア数）")
+    parser.add_argument('--chunk-rows', type=int, default=REPLAY_CHUNK_ROWS, help="1回にまとめて解析する行数")
+    parser.add_argument('--overwrite', action='store_true', help="出力先に同じ名前のファイルがあっても上書きする")
+    args = parser.parse_args()
+
+    calibration = hx711_calibration(args.out_vol, args.avdd, args.load, args.pga, args.offset)
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = replay_files(args.paths, args.output_dir, calibration, args.format, args.workers, args.overwrite,
+                           args.chunk_rows)
+    if not results:
+        print("生のログ（*_esp32_raw.csv）が見つかりませんでした。")
+        return
+
+    for result in results:
+        if result.error is not None:
+            print(f"エラー: {result.raw_path}: {result.error}")
+            continue
+        print(f"{result.output_path}: {result.records}件 ({result.lines}行中、解析できなかった行 {len(result.unrecoverable)}行)"
+              + ("" if result.steps_path else "  段階の索引なし"))
+    report_path = os.path.join(args.output_dir, REPORT_FILE_NAME)
+    write_report(results, report_path)
+    unrecoverable = sum(len(result.unrecoverable) for result in results)
+    print(f"\n{len(results)}件の生のログを処理しました。解析できなかった行: {unrecoverable}行（{report_path}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+計測の設定を並べたファイルを読み、1つのシリアル接続のまま順番に計測するスクリプト（入力待ち・グラフウィンドウなし）。
+
+計測の設定ファイル（CSV）の列:
+    initial_rpm, final_rpm, planned_steps, operation_during, memo, profile
+profile は省略可。'linear'（等間隔, 既定）, 'log'（対数で等間隔）, または速度の表のCSVのパス
+（1列目: rpm, 2列目: 秒。このとき initial_rpm〜operation_during は表から決まるので空欄でよい）。
+'#' で始まる行は読み飛ばす。
+
+使い方:
+    python run_queue.py runs.csv --port COM3
+    python run_queue.py runs.csv --simulate       # 実機の代わりに疑似デバイスを使う
+    python run_queue.py runs.csv --simulate --metrics --metrics-port 9100 --profile-receive
+"""
+import argparse
+import csv
+import datetime
+import os
+import time
+
+from USHI_seigyo2 import DataCollector, select_com_port
+from speed_schedule import linear_profile, load_profile_table, log_profile
+
+RUN_COLUMNS = ['initial_rpm', 'final_rpm', 'planned_steps', 'operation_during', 'memo', 'profile']
+
+
+def _non_negative_int(value, column, line_number):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{line_number}行目: {column} は整数で指定してください: {value!r}")
+    if number < 0:
+        raise ValueError(f"{line_number}行目: {column} に負数は指定できません: {number}")
+    return number
+
+
+def load_run_definitions(file_path):
+    """
+    計測の設定ファイルを読む。
+
+    Returns:
+        list: configure に渡す引数の辞書のリスト（ファイルの順）。
+    Raises:
+        ValueError: 列が足りない、または値が正しくない場合（何行目かを含む）。
+    """
+    base_directory = os.path.dirname(os.path.abspath(file_path))
+    runs = []
+    # '#' で始まる行は読み飛ばすので、エラーの行番号のために読んだ行のファイル上の行番号を覚えておく
+    line_numbers = []
+
+    def lines_without_comments(file_obj):
+        for line_number, line in enumerate(file_obj, start=1):
+            if not line.lstrip().startswith('#'):
+                line_numbers.append(line_number)
+                yield line
+
+    with open(file_path, newline='', encoding='utf-8-sig') as file_obj:
+        reader = csv.DictReader(lines_without_comments(file_obj))
+        missing = [column for column in RUN_COLUMNS[:5] if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"計測の設定ファイルに列がありません: {', '.join(missing)}")
+        for row in reader:
+            line_number = line_numbers[reader.line_num - 1]
+            profile = (row.get('profile') or '').strip() or 'linear'
+            memo = (row['memo'] or '').strip() or f"run{len(runs) + 1}"
+            if profile in ('linear', 'log'):
+                run = {column: _non_negative_int(row[column], column, line_number) for column in RUN_COLUMNS[:4]}
+                # 速度の段階を作れるか（対数で 0rpm など）を、装置を動かす前に確かめる
+                try:
+                    (log_profile if profile == 'log' else linear_profile)(*(run[column] for column in RUN_COLUMNS[:4]))
+                except ValueError as e:
+                    raise ValueError(f"{line_number}行目: {e}")
+                run.update(memoname=memo, profile_kind=profile, profile_table=None)
+            else:
+                table_path = profile if os.path.isabs(profile) else os.path.join(base_directory, profile)
+                try:
+                    table = load_profile_table(table_path)
+                except (OSError, ValueError) as e:
+                    raise ValueError(f"{line_number}行目: 速度の表を読めません: {e}")
+                run = dict(initial_rpm=0, final_rpm=0, planned_steps=0, operation_during=0, memoname=memo,
+                           profile_kind='table', profile_table=table)
+            runs.append(run)
+    return runs
+
+
+def run_queue(collector, runs, directory_name, pause=0.0, save_image=True):
+    """
+    runs の計測を同じ接続で順番に行う。1つの計測が失敗しても残りは続ける。
+    save_image=False なら計測ごとのグラフの画像を作らない（後から acquire_headless.py --render で作れる）。
+
+    Returns:
+        list: 各計測の (memo, file_prefix, エラーメッセージまたはNone)。
+    """
+    results = []
+    for index, run in enumerate(runs, start=1):
+        memoname = run['memoname']
+        file_prefix = None
+        try:
+            collector.configure(**run)
+            file_prefix = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + f'_{collector.memoname}'
+            print(f"\n=== 計測 {index}/{len(runs)}: {collector.memoname} "
+                  f"({collector.profile_kind}, {collector.operation_during:g}秒) ===")
+            collector.run_headless(directory_name, file_prefix, close_port=False, save_image=save_image)
+            results.append((memoname, file_prefix, None))
+        except Exception as e:
+            print(f"エラー: 計測 {memoname} を中断しました: {e}")
+            results.append((memoname, file_prefix, str(e)))
+        if pause and index < len(runs):
+            time.sleep(pause)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="計測の設定ファイルのとおりに、続けて計測する")
+    parser.add_argument('runs', help="計測の設定ファイル（CSV）")
+    parser.add_argument('--port', default=None, help="使用するCOMポート（省略すると一覧から選ぶ）")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--data-dir', default=None, help="保存先（既定: このスクリプトの data/）")
+    parser.add_argument('--pause', type=float, default=0.0, help="計測の間に待つ秒数")
+    parser.add_argument('--simulate', action='store_true', help="実機の代わりに疑似デバイスを使う")
+    parser.add_argument('--no-image', action='store_true', help="グラフの画像を作らない（後から作る場合）")
+    parser.add_argument('--metrics', action='store_true', help="受信の状態を計測ごとの _esp32_metrics.json に書き出す")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="受信の状態を http://127.0.0.1:<ポート>/metrics で Prometheus 形式で公開する")
+    parser.add_argument('--profile-receive', action='store_true', help="受信スレッドのプロファイルを _esp32_profile.txt に書き出す")
+    args = parser.parse_args()
+    metrics_options = {'metrics_export': args.metrics, 'metrics_port': args.metrics_port,
+                       'profile_receive': args.profile_receive}
+
+    try:
+        runs = load_run_definitions(args.runs)
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}")
+        return
+    if not runs:
+        print("計測の設定がありません。")
+        return
+
+    if args.simulate:
+        from esp32_simulator import SimulatedESP32
+        collector = DataCollector(ser=SimulatedESP32(seed=0), console='none', **metrics_options)
+    else:
+        port = args.port or select_com_port()
+        if not port:
+            print("COMポートが選択されませんでした。")
+            return
+        collector = DataCollector(port=port, baudrate=args.baudrate, console='none', **metrics_options)
+
+    directory_name = args.data_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    try:
+        results = run_queue(collector, runs, directory_name, pause=args.pause, save_image=not args.no_image)
+    finally:
+        collector.ser.close()
+
+    print("\n=== 結果 ===")
+    for memo, file_prefix, error in results:
+        print(f"{file_prefix or memo}: {'失敗 ' + error if error else '完了'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import collections
+import threading
+
+import numpy as np
+
+# 1サンプル分のレコード（退避ファイルもこの並びで書き込む）
+SAMPLE_DTYPE = np.dtype([
+    ('host_time', '<f8'),       # Timestamp(python)
+    ('timestamp', '<i8'),       # Timestamp(ESP32) (millis)
+    ('weight', '<f8'),
+    ('speed_delay', '<i4'),
+    ('speed', '<f8'),           # speed(rpm)
+])
+
+SampleSnapshot = collections.namedtuple(
+    'SampleSnapshot', ['host_time', 'timestamp', 'weight', 'speed_delay', 'speed', 'start_index'])
+
+
+class SampleStore:
+    """
+    受信したサンプルを保持する固定容量のリングバッファ。
+
+    列ごとにnumpy配列を確保しておき、容量を超えたら古いサンプルから上書きするので、
+    何時間計測してもメモリ使用量は一定になる。書き込むのは受信スレッド1つだけとし、
+    読み手（グラフ描画など）は snapshot() でロックを取らずに全列の長さがそろったコピーを得る。
+
+    書き込み手順は「書き込む範囲を _reserved で予約 → 書き込み → _published で公開」。
+    読み手はコピー後に _reserved を読み直し、コピー中に上書きされた可能性のある古い行を捨てる。
+
+    Parameters:
+        capacity (int): 保持するサンプル数の上限。
+        spill_path (str): 指定すると、上書きで追い出されたサンプルをこのファイルに
+            SAMPLE_DTYPE のバイナリで追記する（read_spill_file で読める）。
+    """
+
+    def __init__(self, capacity=2 ** 20, spill_path=None):
+        self.capacity = capacity
+        self.host_time = np.zeros(capacity, dtype=np.float64)
+        self.timestamp = np.zeros(capacity, dtype=np.int64)
+        self.weight = np.zeros(capacity, dtype=np.float64)
+        self.speed_delay = np.zeros(capacity, dtype=np.int32)
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        self._columns = (self.host_time, self.timestamp, self.weight, self.speed_delay, self.speed)
+
+        # これまでに書き込んだ総サンプル数（公開済み / 書き込み中を含む予約済み）
+        self._published = 0
+        self._reserved = 0
+        self._write_lock = threading.Lock()
+
+        self.spill_path = spill_path
+        self.spill_file = open(spill_path, 'ab') if spill_path else None
+        self.spilled_count = 0
+
+    def __len__(self):
+        """ 現在メモリ上に保持しているサンプル数 """
+        return min(self._published, self.capacity)
+
+    @property
+    def total_count(self):
+        """ 書き込まれた総サンプル数（追い出された分も含む） """
+        return self._published
+
+    def append(self, host_time, timestamp, weight, speed_delay, speed):
+        """ 1サンプルを追加する """
+        with self._write_lock:
+            end = self._published + 1
+            if self.spill_file is not None and end > self.capacity:
+                self._spill_ring(end - 1 - self.capacity, end - self.capacity)
+            self._reserved = end
+            position = (end - 1) % self.capacity
+            self.host_time[position] = host_time
+            self.timestamp[position] = timestamp
+            self.weight[position] = weight
+            self.speed_delay[position] = speed_delay
+            self.speed[position] = speed
+            self._published = end
+
+    def append_many(self, host_time, timestamps, weights, speed_delays, speeds):
+        """
+        複数のサンプルをまとめて追加する。
+
+        Parameters:
+            host_time (float or array-like): Python側のタイムスタンプ（スカラーなら全サンプル共通）。
+            timestamps, weights, speed_delays, speeds (array-like): 各列の値。
+        """
+        timestamps = np.asarray(timestamps)
+        count = timestamps.shape[0]
+        if count == 0:
+            return
+        # スカラーの host_time は np.full で広げる（np.broadcast_to は1回ごとの手間が大きい）
+        host_times = np.full(count, host_time, dtype=np.float64) if np.ndim(host_time) == 0 else \
+            np.asarray(host_time, dtype=np.float64)
+        values = (host_times,
+                  timestamps, np.asarray(weights), np.asarray(speed_delays), np.asarray(speeds))
+
+        with self._write_lock:
+            start = self._published
+            end = start + count
+            if self.spill_file is not None:
+                # リングから追い出される古い行を先に、リングに入りきらない新しい行をその後に退避する
+                self._spill_ring(max(start - self.capacity, 0), min(start, end - self.capacity))
+                if count > self.capacity:
+                    self._spill_values(values, 0, count - self.capacity)
+            if count > self.capacity:
+                values = tuple(column[count - self.capacity:] for column in values)
+                start = end - self.capacity
+                count = self.capacity
+
+            self._reserved = end
+            position = start % self.capacity
+            first = min(count, self.capacity - position)
+            for column, value in zip(self._columns, values):
+                column[position:position + first] = value[:first]
+                if first < count:
+                    column[:count - first] = value[first:]
+            self._published = end
+
+    def snapshot(self, last=None):
+        """
+        現在保持しているサンプルの一貫したコピーを返す。
+
+        Parameters:
+            last (int): 指定すると最新のlast個だけを返す。
+
+        Returns:
+            SampleSnapshot: 各列の配列と、先頭サンプルの通し番号(start_index)。
+        """
+        published = self._published
+        available = min(published, self.capacity)
+        if last is not None:
+            available = min(available, last)
+        start = published - available
+
+        columns = [self._copy_range(column, start, published) for column in self._columns]
+
+        # コピー中に書き込み手が上書きしたかもしれない行を捨てる
+        overwritten = self._reserved - self.capacity - start
+        if overwritten > 0:
+            columns = [column[overwritten:] for column in columns]
+            start += overwritten
+        return SampleSnapshot(*columns, start_index=start)
+
+    def _copy_range(self, column, start, end):
+        if end <= start:
+            return column[:0].copy()
+        begin = start % self.capacity
+        stop = begin + (end - start)
+        if stop <= self.capacity:
+            return column[begin:stop].copy()
+        return np.concatenate((column[begin:], column[:stop - self.capacity]))
+
+    def _spill_ring(self, start, end):
+        """ 通し番号[start, end)のサンプルをリングから退避ファイルへ書き出す """
+        if end <= start:
+            return
+        values = tuple(self._copy_range(column, start, end) for column in self._columns)
+        self._spill_values(values, 0, end - start)
+
+    def _spill_values(self, values, start, end):
+        if self.spill_file is None or end <= start:
+            return
+        records = np.empty(end - start, dtype=SAMPLE_DTYPE)
+        for name, value in zip(SAMPLE_DTYPE.names, values):
+            records[name] = value[start:end]
+        self.spill_file.write(records.tobytes())
+        self.spilled_count += end - start
+
+    def close(self):
+        """ 退避ファイルを閉じる（保持中のサンプルは書き出さない） """
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+def read_spill_file(spill_path):
+    """ SampleStore が書き出した退避ファイルを構造化配列として読み込む """
+    return np.fromfile(spill_path, dtype=SAMPLE_DTYPE)
@@ -0,0 +1,223 @@
+import time
+
+import numpy as np
+
+# ロードセルのゼロ点のオフセット（USHI_seigyo2.py の process_response と同じ値）
+WEIGHT_OFFSET = 140
+
+
+class BulkSerialReader:
+    """
+    シリアルの受信バッファにたまっているバイト列を1回の read でまとめて読み出し、行に分割するクラス。
+
+    readline() を1行ずつ呼ぶ代わりに in_waiting 分を一度に読み、
+    途中で切れた最後の行は次回の読み出しまで持ち越す。
+
+    一括で解析する処理には1回ごとに決まった手間がかかる（1行だけ読めたときは DataCollector.process_lines が
+    1行ずつの処理に回す）。max_batch_wait を指定すると、前回読んだ行が min_batch_lines 行より
+    少なければ、これまでの受信の間隔から min_batch_lines 行がたまると見込まれる時刻まで
+    （ただし前回の読み出しから max_batch_wait 秒まで）待ってから読む。
+    前回が min_batch_lines 行以上なら（処理が受信に追いついていない）待たずに読むので、
+    レートが高いときに受信バッファがあふれるほどはためない。
+    待つ分だけ行が届いてから処理されるまでが遅れる（100 Hz で min_batch_lines=32, max_batch_wait=0.05 なら
+    平均で約25 ms、最大で約50 ms）。ライブグラフや速度を変えたときの応答の記録もその分遅れるので、既定では待たない。
+
+    Parameters:
+        ser (serial.Serial): 読み出すシリアルポート（esp32_simulator.SimulatedESP32 でも可）。
+        max_read (int): 1回に読み出す最大バイト数。
+        metrics (metrics.Metrics): 指定すると読み出したバイト数・行数・受信バッファの量・デコードできなかったバイト数を数える。
+        min_batch_lines (int): 1回にまとめて読みたい行数の目安（0なら待たない）。
+        max_batch_wait (float): 行がたまるのを待つ最長の時間（秒。前回の読み出しからの時間。0なら待たない）。
+    """
+
+    def __init__(self, ser, max_read=65536, metrics=None, min_batch_lines=32, max_batch_wait=0.0):
+        self.ser = ser
+        self.max_read = max_read
+        self.metrics = metrics
+        self.min_batch_lines = min_batch_lines
+        self.max_batch_wait = max_batch_wait
+        self.remainder = b""
+        self.last_read = None
+        self.last_line_count = 0
+        # 1行あたりの受信間隔（秒）の推定値（指数移動平均）
+        self.line_interval = None
+
+    def _wait_for_batch(self):
+        """ 前回が少なければ、min_batch_lines 行がたまると見込まれるまで（最長 max_batch_wait 秒）待つ """
+        if (self.min_batch_lines <= 0 or self.max_batch_wait <= 0 or self.last_read is None or self.line_interval is None
+                or self.last_line_count >= self.min_batch_lines):
+            return
+        target = min(self.max_batch_wait, self.min_batch_lines * self.line_interval)
+        remaining = self.last_read + target - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _update_line_interval(self, line_count):
+        now = time.perf_counter()
+        # 多く読めたときは受信バッファがあふれて行が欠けているかもしれないので、間隔の推定には使わない
+        if self.last_read is not None and 0 < line_count < self.min_batch_lines:
+            interval = (now - self.last_read) / line_count
+            self.line_interval = interval if self.line_interval is None else \
+                0.8 * self.line_interval + 0.2 * interval
+        self.last_read = now
+        self.last_line_count = line_count
+
+    def read_lines(self):
+        """
+        受信済みの行をまとめて返す。何も届いていなければ ser のタイムアウトまで最初の1バイトを待つ。
+
+        Returns:
+            list: 末尾の空白を取り除いた、空でない行（str）のリスト。
+        """
+        self._wait_for_batch()
+        waiting = self.ser.in_waiting
+        if waiting:
+            chunk = self.ser.read(min(waiting, self.max_read))
+        else:
+            chunk = self.ser.read(1)
+            if chunk:
+                waiting = self.ser.in_waiting
+                if waiting:
+                    chunk += self.ser.read(min(waiting, self.max_read))
+        if self.metrics is not None:
+            self.metrics.set('serial_buffer_bytes', waiting)
+            self.metrics.inc('reads_total')
+            self.metrics.inc('bytes_total', len(chunk))
+        if not chunk:
+            self._update_line_interval(0)
+            return []
+
+        buffer = self.remainder + chunk
+        last_newline = buffer.rfind(b"\n")
+        if last_newline < 0:
+            self.remainder = buffer
+            self._update_line_interval(0)
+            return []
+        self.remainder = buffer[last_newline + 1:]
+        text = decode_ignoring_errors(buffer[:last_newline], self.metrics)
+        lines = [line for line in map(str.rstrip, text.split('\n')) if line]
+        if self.metrics is not None:
+            self.metrics.inc('lines_total', len(lines))
+        self._update_line_interval(len(lines))
+        return lines
+
+    def flush(self):
+        """ 改行が来ないまま残っている行を返して、持ち越しを空にする """
+        line = decode_ignoring_errors(self.remainder, self.metrics).rstrip()
+        self.remainder = b""
+        return [line] if line else []
+
+
+def decode_ignoring_errors(data, metrics=None):
+    """
+    バイト列をUTF-8としてデコードする。ノイズで壊れたバイト列が混ざることがあるので、
+    デコードできないバイトは読み飛ばす（'ignore'）。metrics を渡すと読み飛ばしたバイト数を数える。
+    """
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        text = data.decode('utf-8', 'ignore')
+        if metrics is not None:
+            metrics.inc('decode_errors_total', len(data) - len(text.encode('utf-8')))
+        return text
+
+
+# [data]行の各フィールドが取りうる範囲（ESP32 の millis() は unsigned long、raw と delay は long）。
+# バイナリ形式の列（binary_record.RECORD_DTYPE）もこの型なので、範囲の外の値は壊れた行として扱う
+_FIELD_RANGES = ((0, 2 ** 32 - 1), (-2 ** 31, 2 ** 31 - 1), (-2 ** 31, 2 ** 31 - 1))
+_FIELD_LOW, _FIELD_HIGH = np.array(_FIELD_RANGES, dtype=np.int64).T
+
+
+def parse_data_line(line):
+    """
+    [data]行を1行だけ解析し、(millis, raw, delay) を返す。壊れていればNoneを返す。
+
+    "[data]" を含むフィールドに続けてちょうど3つのフィールドがあり、どれも int() で読めて
+    ESP32 の型の範囲（_FIELD_RANGES）に収まる行だけを受け付ける
+    （1行ずつ処理する process_response も、まとめて処理する parse_data_lines もこの規則に従う）。
+    """
+    fields = line.split(',')
+    if len(fields) != 4:
+        return None
+    try:
+        values = int(fields[1]), int(fields[2]), int(fields[3])
+    except ValueError:
+        return None
+    if not all(low <= value <= high for value, (low, high) in zip(values, _FIELD_RANGES)):
+        return None
+    return values
+
+
+def parse_data_lines(lines):
+    """
+    行のリストから[data]行を取り出し、まとめて整数配列に変換する。
+
+    "[data], millis, raw, delay" の行を1つの文字列に連結し、数値のフィールドをまとめて一度に変換する。
+    壊れた行が含まれていて一括変換できなかったときだけ、1行ずつの解析に切り替える。
+
+    Parameters:
+        lines (list): 受信した行（str）のリスト。
+
+    Returns:
+        tuple: (millis, raw, delay, malformed)
+            millis, raw, delay (numpy.ndarray): int64の配列。
+            malformed (int): [data]を含むが解析できなかった行の数。
+    """
+    _, millis, raw, delay, malformed_lines = parse_data_lines_detailed(lines)
+    return millis, raw, delay, len(malformed_lines)
+
+
+def parse_data_lines_detailed(lines):
+    """
+    parse_data_lines と同じ解析を行い、各レコードと解析できなかった[data]行が lines の何番目かも返す
+    （生のログからデータを作り直すときに、行の対応と読めなかった行を知るため）。
+
+    Returns:
+        tuple: (line_indices, millis, raw, delay, malformed_lines)
+            line_indices (numpy.ndarray): 各レコードの lines の中の添字。
+            millis, raw, delay (numpy.ndarray): int64の配列。
+            malformed_lines (list): [data]を含むが解析できなかった行の lines の中の添字。
+    """
+    data_indices = [index for index, line in enumerate(lines) if '[data]' in line]
+    if not data_indices:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty, []
+    data_lines = [lines[index] for index in data_indices]
+
+    # 全ての行が parse_data_line で読めるなら、連結して1回で数値化する（受け付ける行は1行ずつの解析と同じ）。
+    # 正規表現での検査や np.fromstring は1回ごとの手間が大きく、1〜2行ずつ届くときに1行ずつより遅くなるので使わない
+    values = None
+    if all(line.count(',') == 3 for line in data_lines):
+        fields = ','.join(data_lines).split(',')
+        del fields[0::4]
+        try:
+            values = np.array(list(map(int, fields)), dtype=np.int64).reshape(-1, 3)
+        except (ValueError, OverflowError):
+            values = None
+        else:
+            if not ((values >= _FIELD_LOW) & (values <= _FIELD_HIGH)).all():
+                values = None
+
+    malformed_lines = []
+    if values is None:
+        parsed = [parse_data_line(line) for line in data_lines]
+        valid_indices = [index for index, record in zip(data_indices, parsed) if record is not None]
+        malformed_lines = [index for index, record in zip(data_indices, parsed) if record is None]
+        data_indices = valid_indices
+        values = np.array([record for record in parsed if record is not None], dtype=np.int64).reshape(-1)
+
+    values = values.reshape(-1, 3)
+    return np.array(data_indices, dtype=np.int64), values[:, 0], values[:, 1], values[:, 2], malformed_lines
+
+
+def raw_to_weight(raw, adc1bit, scale, offset=WEIGHT_OFFSET):
+    """ HX711の生の値を重量に変換する（process_response と同じ式） """
+    return -np.asarray(raw) * adc1bit / scale - offset
+
+
+def delay_to_rpm(speed_delay):
+    """ モーターのステップ間隔(us)を回転数(rpm)に変換する。0は停止として0を返す """
+    speed_delay = np.asarray(speed_delay, dtype=np.float64)
+    rpm = np.zeros_like(speed_delay)
+    np.divide(60, speed_delay / 1000000 * 200, out=rpm, where=speed_delay != 0)
+    return rpm
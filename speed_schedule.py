@@ -0,0 +1,175 @@
+import collections
+import csv
+import math
+import threading
+import time
+
+SpeedStep = collections.namedtuple('SpeedStep', ['step', 'rpm', 'motor_delay', 'start_offset', 'duration'])
+
+StepDispatch = collections.namedtuple('StepDispatch', ['step', 'rpm', 'motor_delay', 'deadline', 'dispatched', 'jitter'])
+
+SCHEDULE_COLUMNS = ['Step', 'Commanded Speed(rpm)', 'Motor Delay(us)', 'Deadline(python)', 'Dispatched(python)',
+                    'Jitter(ms)']
+
+PROFILE_KINDS = ('linear', 'log', 'table')
+
+# 締め切りのこの時間（秒）前からは、スリープではなく時刻を見ながら待つ。
+# 段階の切り替えはミリ秒の精度で十分なので短くする（長く回ると1コアを使い切り、受信スレッドと GIL を取り合う）
+SPIN_THRESHOLD = 0.0005
+
+
+def rpm_to_motor_delay(rpm):
+    """ 回転数(rpm)から ESP32 に送る set_speed の値（ステップの間隔, μs）を求める。0rpmなら0（停止） """
+    return round(60 / (rpm * 200) * 1000000) if rpm != 0 else 0
+
+
+def _build_profile(rpms, durations):
+    profile = []
+    start_offset = 0.0
+    for step, (rpm, duration) in enumerate(zip(rpms, durations)):
+        profile.append(SpeedStep(step, rpm, rpm_to_motor_delay(rpm), start_offset, duration))
+        start_offset += duration
+    return profile
+
+
+def linear_profile(initial_rpm, final_rpm, planned_steps, operation_during):
+    """
+    initial_rpm から final_rpm まで、planned_steps 回に分けて等間隔に速度を上げる（従来の方法）。
+    各段階の時間は operation_during / (planned_steps + 1) 秒。
+    """
+    one_step_duration = operation_during / (planned_steps + 1)
+    one_step_increase = (final_rpm - initial_rpm) / planned_steps if planned_steps != 0 else 0
+    rpms = [initial_rpm + one_step_increase * count for count in range(planned_steps + 1)]
+    return _build_profile(rpms, [one_step_duration] * (planned_steps + 1))
+
+
+def log_profile(initial_rpm, final_rpm, planned_steps, operation_during):
+    """
+    initial_rpm から final_rpm まで、速度の比が一定になるように（対数で等間隔に）上げる。
+    各段階の時間は linear_profile と同じ。
+
+    Raises:
+        ValueError: initial_rpm または final_rpm が0以下の場合。
+    """
+    if initial_rpm <= 0 or final_rpm <= 0:
+        raise ValueError("対数で速度を変える場合、開始時と終了時のrpmは0より大きくしてください。")
+    one_step_duration = operation_during / (planned_steps + 1)
+    ratio = (final_rpm / initial_rpm) ** (1 / planned_steps) if planned_steps != 0 else 1
+    rpms = [initial_rpm * ratio ** count for count in range(planned_steps + 1)]
+    return _build_profile(rpms, [one_step_duration] * (planned_steps + 1))
+
+
+def table_profile(rows):
+    """
+    (rpm, 秒) の組の並びから速度の段階を作る。
+
+    Raises:
+        ValueError: 空の場合、または負の値がある場合。
+    """
+    rows = [(float(rpm), float(duration)) for rpm, duration in rows]
+    if not rows:
+        raise ValueError("速度の表が空です。")
+    if any(rpm < 0 or duration <= 0 or not math.isfinite(rpm + duration) for rpm, duration in rows):
+        raise ValueError("速度の表のrpmは0以上、時間は0より大きくしてください。")
+    return _build_profile([rpm for rpm, _ in rows], [duration for _, duration in rows])
+
+
+def load_profile_table(file_path):
+    """
+    速度の表をCSVから読む。1列目がrpm、2列目がその速度を続ける秒数。
+    数値でない行（見出しなど）は読み飛ばす。
+    """
+    rows = []
+    with open(file_path, newline='', encoding='utf-8-sig') as file_obj:
+        for row in csv.reader(file_obj):
+            try:
+                rows.append((float(row[0]), float(row[1])))
+            except (ValueError, IndexError):
+                continue
+    return table_profile(rows)
+
+
+def profile_duration(profile):
+    return profile[-1].start_offset + profile[-1].duration if profile else 0.0
+
+
+class SpeedScheduler:
+    """
+    速度の段階を、あらかじめ決めた締め切り（time.perf_counter の時刻）どおりに切り替えるスレッド。
+
+    受信の読み出しとは独立に動くので、ESP32 からの応答が途切れても切り替えは遅れない。
+    締め切りの直前までは Event.wait で眠り、最後の SPIN_THRESHOLD 秒は時刻を見ながら待つ。
+    実際に切り替えた時刻と締め切りとの差（ジッタ）を dispatches に記録する。
+
+    Parameters:
+        profile (list): SpeedStep のリスト。
+        dispatch (callable): dispatch(step) で段階 step の速度を設定する関数。
+        finish (callable): 最後の段階が終わったときに呼ぶ関数（モーターを止める）。
+        start_ut (float): 段階の時刻の基準（time.perf_counter の値）。
+    """
+
+    def __init__(self, profile, dispatch, finish, start_ut):
+        self.profile = list(profile)
+        self.dispatch = dispatch
+        self.finish = finish
+        self.start_ut = start_ut
+        self.dispatches = []
+        self.end_dispatch = None
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="speed-scheduler")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ 残りの段階を取りやめる（finish は呼ばない） """
+        self.stop_event.set()
+        self.thread.join()
+
+    def _wait_until(self, deadline):
+        """ deadline まで待つ。stop() されたらFalseを返す """
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= SPIN_THRESHOLD:
+                break
+            if self.stop_event.wait(remaining - SPIN_THRESHOLD):
+                return False
+        while time.perf_counter() < deadline:
+            time.sleep(0)
+        return not self.stop_event.is_set()
+
+    def run(self):
+        try:
+            for step in self.profile:
+                deadline = self.start_ut + step.start_offset
+                if not self._wait_until(deadline):
+                    return
+                dispatched = time.perf_counter()
+                self.dispatch(step.step)
+                self.dispatches.append(StepDispatch(step.step, step.rpm, step.motor_delay, deadline, dispatched,
+                                                    dispatched - deadline))
+            deadline = self.start_ut + profile_duration(self.profile)
+            if not self._wait_until(deadline):
+                return
+            dispatched = time.perf_counter()
+            self.finish()
+            self.end_dispatch = StepDispatch(len(self.profile), 0, 0, deadline, dispatched, dispatched - deadline)
+        finally:
+            self.finished.set()
+
+    def jitter_summary(self):
+        """ (最大ジッタ, 平均ジッタ) を秒で返す。切り替えがなければ (nan, nan) """
+        jitters = [d.jitter for d in self.dispatches] + ([self.end_dispatch.jitter] if self.end_dispatch else [])
+        if not jitters:
+            return math.nan, math.nan
+        return max(jitters), sum(jitters) / len(jitters)
+
+    def write_csv(self, file_path):
+        """ 各段階の締め切りと実際に切り替えた時刻を書き出す（最後の行は停止） """
+        with open(file_path, 'w', newline='') as file_obj:
+            csv_writer = csv.writer(file_obj)
+            csv_writer.writerow(SCHEDULE_COLUMNS)
+            for d in self.dispatches + ([self.end_dispatch] if self.end_dispatch else []):
+                csv_writer.writerow([d.step, d.rpm, d.motor_delay, d.deadline, d.dispatched, d.jitter * 1000])
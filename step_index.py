@@ -0,0 +1,278 @@
+import collections
+import csv
+import os
+import threading
+
+import numpy as np
+
+# 1つの速度段階の、データファイル（_esp32_data.csv の見出しを除いた行 / _esp32_data.bin のレコード）の中の範囲
+StepSegment = collections.namedtuple(
+    'StepSegment', ['step', 'rpm', 'motor_delay', 'start_row', 'end_row', 'command_time', 'ack_time',
+                    'start_timestamp', 'end_timestamp'])
+
+STEP_INDEX_COLUMNS = ['Step', 'Commanded Speed(rpm)', 'Motor Delay(us)', 'Start Row', 'End Row',
+                      'Command(python)', 'Ack(python)', 'Start(ESP32)', 'End(ESP32)']
+
+STEP_INDEX_SUFFIX = '_esp32_steps.csv'
+
+# ファームウェアが set_speed に応えて返す行（"speed was set : <delay>"）
+ACK_PREFIX = "speed was set :"
+
+
+def parse_ack_delay(line):
+    """ "speed was set : <delay>" の行なら delay を、そうでなければNoneを返す """
+    if not line.startswith(ACK_PREFIX):
+        return None
+    try:
+        return int(line[len(ACK_PREFIX):])
+    except ValueError:
+        return None
+
+
+class _StepEntry:
+    __slots__ = ('step', 'rpm', 'motor_delay', 'command_time', 'ack_time', 'start_row', 'end_row',
+                 'start_timestamp', 'end_timestamp')
+
+    def __init__(self, step, rpm, motor_delay, command_time):
+        self.step = step
+        self.rpm = rpm
+        self.motor_delay = motor_delay
+        self.command_time = command_time
+        self.ack_time = None
+        self.start_row = None
+        self.end_row = None
+        self.start_timestamp = None
+        self.end_timestamp = None
+
+
+class StepIndexBuilder:
+    """
+    計測中に、速度の段階ごとのデータの行の範囲を記録する（_esp32_steps.csv に書き出す）。
+
+    速度を変えたとき（command）と、ファームウェアが "speed was set : <delay>" で応えたとき（acknowledge）の
+    PCの時刻を記録し、受信した[data]行の speed(delay) が新しい値に変わった最初の行を段階の始まりとする
+    （ファームウェアは応えた直後から新しい delay を送ってくる）。前の段階と delay が同じで変化が見えない場合は、
+    応えた時刻を clock で ESP32 の時刻に直し、Timestamp(ESP32) がそれ以降の最初の行を始まりとする
+    （応答がまだ来ていなければ待つ）。clock がない、またはまだ時刻の対応が推定できていなければ、
+    速度を変えた後に処理した最初の行を始まりとする。段階の終わりは次の段階（最後は停止）の始まり。
+
+    command / finish は SpeedScheduler のスレッドから、acknowledge / update は受信スレッドから呼ぶ。
+
+    Parameters:
+        clock (clock_sync.ClockSync): PC の時刻を ESP32 の時刻に直すのに使う（device_ms を持つもの）。
+            update の前に、同じ行で更新しておく。
+    """
+
+    def __init__(self, clock=None):
+        self.lock = threading.Lock()
+        self.clock = clock
+        self.entries = []
+        # 停止（finish）も段階と同じように扱い、最後の段階の終わりを決めるのに使う（書き出さない）
+        self.finish_entry = None
+        self.row_count = 0
+        self.current_delay = None
+        self.last_timestamp = None
+        # 始まりの行をまだ見つけていない最初の段階（entries の添字。len(entries) なら停止）
+        self.pending = 0
+
+    def command(self, step, rpm, motor_delay, command_time):
+        with self.lock:
+            self.entries.append(_StepEntry(step, rpm, motor_delay, command_time))
+
+    def finish(self, command_time):
+        with self.lock:
+            self.finish_entry = _StepEntry(None, 0, 0, command_time)
+
+    def acknowledge(self, ack_time, motor_delay):
+        """ ファームウェアの応答を、まだ応答のない最初の同じ delay の段階に対応させる """
+        with self.lock:
+            for entry in self._commanded():
+                if entry.ack_time is None and entry.motor_delay == motor_delay:
+                    entry.ack_time = ack_time
+                    return
+
+    def _commanded(self):
+        return self.entries + ([self.finish_entry] if self.finish_entry is not None else [])
+
+    def update(self, timestamps_esp32, speed_delay):
+        """ 受信した[data]行（データファイルに書く順）を追加する """
+        count = len(speed_delay)
+        if count == 0:
+            return
+        speed_delay = np.asarray(speed_delay)
+        timestamps_esp32 = np.asarray(timestamps_esp32)
+        with self.lock:
+            base = self.row_count
+            commanded = self._commanded()
+            offset = 0
+            while self.pending < len(commanded):
+                entry = commanded[self.pending]
+                if entry.motor_delay != self.current_delay:
+                    matches = np.flatnonzero(speed_delay[offset:] == entry.motor_delay)
+                    if len(matches) == 0:
+                        break
+                    offset += int(matches[0])
+                elif self.clock is not None:
+                    # delay が変わらないので、応答の時刻以降の最初の行から始める
+                    if entry.ack_time is None and self._ack_expected(commanded):
+                        break
+                    ack_ms = self.clock.device_ms(entry.ack_time) if entry.ack_time is not None else None
+                    if ack_ms is not None:
+                        offset += int(np.searchsorted(timestamps_esp32[offset:], ack_ms, side='left'))
+                        if offset >= count:
+                            break
+                self._begin(entry, base + offset, int(timestamps_esp32[offset]), timestamps_esp32, offset, base)
+                self.pending += 1
+            self.row_count = base + count
+            self.last_timestamp = int(timestamps_esp32[-1])
+
+    def _ack_expected(self, commanded):
+        """ 始まりを探している段階の応答を待つか（次の段階の応答が先に来ていたら、応答は失われたとみなして待たない） """
+        following = commanded[self.pending + 1:self.pending + 2]
+        return not following or following[0].ack_time is None
+
+    def _begin(self, entry, row, timestamp, timestamps_esp32, offset, base):
+        """ entry の段階を row から始め、1つ前の段階をその直前で終える """
+        index = self.pending
+        if index > 0:
+            previous = self.entries[index - 1]
+            previous.end_row = row
+            previous.end_timestamp = (int(timestamps_esp32[offset - 1]) if row > base else self.last_timestamp)
+        entry.start_row = row
+        entry.start_timestamp = timestamp
+        self.current_delay = entry.motor_delay
+
+    def segments(self):
+        """
+        始まりの行が分かった段階の StepSegment のリスト。停止の行がまだ来ていない最後の段階は、
+        これまでに受信した行までとする。
+        """
+        with self.lock:
+            result = []
+            for entry in self.entries:
+                if entry.start_row is None:
+                    continue
+                end_row, end_timestamp = entry.end_row, entry.end_timestamp
+                if end_row is None:
+                    end_row, end_timestamp = self.row_count, self.last_timestamp
+                result.append(StepSegment(entry.step, entry.rpm, entry.motor_delay, entry.start_row, end_row,
+                                          entry.command_time, entry.ack_time, entry.start_timestamp, end_timestamp))
+            return result
+
+    def write_csv(self, file_path):
+        write_step_index(file_path, self.segments())
+
+
+def write_step_index(file_path, segments):
+    """ StepSegment のリストを段階の索引のCSV（load_step_index で読める形式）に書き出す """
+    with open(file_path, 'w', newline='') as file_obj:
+        csv_writer = csv.writer(file_obj)
+        csv_writer.writerow(STEP_INDEX_COLUMNS)
+        for segment in segments:
+            csv_writer.writerow(['' if value is None else value for value in segment])
+
+
+def step_index_path(data_filepath):
+    """ 計測データ（_esp32_data.csv / _esp32_data.bin）と同じ計測の段階の索引のパス """
+    for suffix in ('_esp32_data.csv', '_esp32_data.bin'):
+        if data_filepath.lower().endswith(suffix):
+            return data_filepath[:-len(suffix)] + STEP_INDEX_SUFFIX
+    return None
+
+
+def load_step_index(data_filepath):
+    """
+    計測データと同じ計測の段階の索引を読む。
+
+    Returns:
+        list: StepSegment のリスト（段階の順）。索引がない、または空ならNone。
+    """
+    path = step_index_path(data_filepath)
+    if path is None or not os.path.exists(path):
+        return None
+
+    def optional(value, convert):
+        return convert(value) if value != '' else None
+
+    segments = []
+    with open(path, newline='', encoding='utf-8-sig') as file_obj:
+        for row in csv.DictReader(file_obj):
+            segments.append(StepSegment(
+                int(row['Step']), float(row['Commanded Speed(rpm)']), int(row['Motor Delay(us)']),
+                int(row['Start Row']), int(row['End Row']), optional(row['Command(python)'], float),
+                optional(row['Ack(python)'], float), optional(row['Start(ESP32)'], int),
+                optional(row['End(ESP32)'], int)))
+    return segments or None
+
+
+def segment_slices(segments, timestamps_esp32, row_offset=0, settle_seconds=0.0):
+    """
+    データの一部（row_offset 行目から len(timestamps_esp32) 行）について、各段階に入る範囲を返す。
+
+    Parameters:
+        segments (list): StepSegment のリスト。
+        timestamps_esp32 (numpy.ndarray): その範囲の Timestamp(ESP32)（ミリ秒）。
+        row_offset (int): timestamps_esp32[0] のデータファイルの中の行番号（分割して読む場合）。
+        settle_seconds (float): 段階の始まりからこの秒数の行は、速度を変えた直後の過渡応答として除く。
+
+    Yields:
+        tuple: (StepSegment, slice)。slice は timestamps_esp32 と同じ範囲の配列に対するもの。空の範囲は返さない。
+    """
+    count = len(timestamps_esp32)
+    for segment in segments:
+        start = max(segment.start_row - row_offset, 0)
+        end = min(segment.end_row - row_offset, count)
+        if start >= end:
+            continue
+        if settle_seconds > 0 and segment.start_timestamp is not None:
+            settled = segment.start_timestamp + settle_seconds * 1000
+            start += int(np.searchsorted(timestamps_esp32[start:end], settled, side='left'))
+            if start >= end:
+                continue
+        yield segment, slice(start, end)
+
+
+def segment_boundaries_match(segments, timestamps_esp32, row_offset=0):
+    """
+    データの一部（row_offset 行目から len(timestamps_esp32) 行）について、その中にある各段階の最初と最後の行の
+    Timestamp(ESP32) が索引の Start(ESP32) / End(ESP32) と同じか。読み込みで途中の行が捨てられていると、
+    それより後の段階の行番号がずれるので一致しなくなる（索引に時刻がない段階は調べない）。
+    """
+    count = len(timestamps_esp32)
+    for segment in segments:
+        if segment.end_row == segment.start_row:
+            continue
+        for row, timestamp in ((segment.start_row, segment.start_timestamp),
+                               (segment.end_row - 1, segment.end_timestamp)):
+            if timestamp is None or not row_offset <= row < row_offset + count:
+                continue
+            if timestamps_esp32[row - row_offset] != timestamp:
+                return False
+    return True
+
+
+def index_matches_data(segments, row_count, timestamps_esp32=None):
+    """
+    索引がデータに使えるか。行番号がデータの行数を超えていない（読み込みで行が捨てられていたら使えない）うえ、
+    段階の順に行と Timestamp(ESP32) が進んでいること（作り直しに失敗した索引などは使わない）。
+    行のない段階（速度を続けて変えて、次の段階と同じ行から始まったもの）は使わないだけで、索引全体は使える。
+    timestamps_esp32（読み込んだ全ての行の Timestamp(ESP32)）を渡すと、各段階の境目の行の時刻が索引と同じかも
+    確かめる（segment_boundaries_match。途中の行が捨てられて行番号がずれた場合も使わない）。
+    """
+    if not segments or segments[-1].end_row > row_count:
+        return False
+    previous_end_row = 0
+    previous_end_timestamp = None
+    for segment in segments:
+        if segment.end_row < segment.start_row or segment.start_row < previous_end_row:
+            return False
+        if segment.end_row == segment.start_row:
+            continue
+        if segment.start_timestamp is not None and segment.end_timestamp is not None:
+            if segment.end_timestamp < segment.start_timestamp:
+                return False
+            if previous_end_timestamp is not None and segment.start_timestamp <= previous_end_timestamp:
+                return False
+            previous_end_timestamp = segment.end_timestamp
+        previous_end_row = segment.end_row
+    return timestamps_esp32 is None or segment_boundaries_match(segments, timestamps_esp32)
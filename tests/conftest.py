@@ -0,0 +1,5 @@
+import os
+import sys
+
+# スクリプトはリポジトリの直下に置かれているので、テストからも import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import async_writer
+from async_writer import RecordWriter
+
+
+class FakeCsvWriter:
+    def __init__(self, gate=None, error=None):
+        self.rows = []
+        self.gate = gate
+        self.error = error
+        self.entered = threading.Event()
+
+    def writerows(self, rows):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.rows.extend(rows)
+
+
+class FakeFile:
+    def __init__(self):
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+    def fileno(self):
+        return 99
+
+
+def _writer(raw, data=None, **kwargs):
+    kwargs.setdefault('console', 'none')
+    return RecordWriter(raw, data or FakeCsvWriter(), **kwargs).start()
+
+
+def test_full_queue_blocks_the_caller_without_dropping_rows():
+    gate = threading.Event()
+    raw = FakeCsvWriter(gate)
+    writer = _writer(raw, queue_size=2)
+    writer.put([[0.0, 'line 0']])
+    assert raw.entered.wait(5)
+    # 書き込みスレッドが止まっている間にキューを満杯にする
+    writer.put([[1.0, 'line 1']])
+    writer.put([[2.0, 'line 2']])
+    blocked = threading.Thread(target=writer.put, args=([[3.0, 'line 3']],))
+    blocked.start()
+    blocked.join(0.3)
+    assert blocked.is_alive()
+
+    gate.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.close()
+    assert [row[1] for row in raw.rows] == ['line 0', 'line 1', 'line 2', 'line 3']
+    assert writer.backpressure_count == 1
+    assert writer.max_queue_depth == 2
+
+
+def test_write_error_is_raised_in_the_caller(capsys):
+    gate = threading.Event()
+    raw = FakeCsvWriter(gate, error=OSError('disk full'))
+    writer = _writer(raw, queue_size=1)
+    writer.put([[0.0, 'line 0']])
+    assert raw.entered.wait(5)
+    writer.put([[1.0, 'line 1']])
+    # キューが満杯で待っている put() も、書き込みスレッドが止まれば例外で戻る
+    result = {}
+
+    def put():
+        try:
+            writer.put([[2.0, 'line 2']])
+        except OSError as e:
+            result['error'] = e
+
+    blocked = threading.Thread(target=put)
+    blocked.start()
+    gate.set()
+    blocked.join(5)
+    assert str(result['error']) == 'disk full'
+    with pytest.raises(OSError, match='disk full'):
+        writer.put([[3.0, 'line 3']])
+    with pytest.raises(OSError, match='disk full'):
+        writer.close()
+    assert '書き込みスレッドが停止しました' in capsys.readouterr().out
+
+
+def test_close_writes_and_flushes_everything():
+    raw, data, file_obj = FakeCsvWriter(), FakeCsvWriter(), FakeFile()
+    # flush_interval が長くても close() で最後に flush する
+    writer = _writer(raw, data, file_objs=[file_obj], flush_interval=60, status_interval=60)
+    for i in range(500):
+        writer.put([[float(i), f'[data],{i},0,0']], iter([[float(i), i, 0.0, 0, 0.0]]))
+    writer.close()
+    assert [row[1] for row in raw.rows] == [f'[data],{i},0,0' for i in range(500)]
+    assert [row[1] for row in data.rows] == list(range(500))
+    assert (writer.raw_rows_written, writer.data_rows_written) == (500, 500)
+    assert file_obj.flushes >= 1
+
+
+@pytest.mark.parametrize('sync, flushes, fsyncs', [('none', 0, 0), ('flush', 1, 0), ('fsync', 1, 1)])
+def test_sync_policy(monkeypatch, sync, flushes, fsyncs):
+    synced = []
+    monkeypatch.setattr(async_writer.os, 'fsync', synced.append)
+    file_obj = FakeFile()
+    writer = _writer(FakeCsvWriter(), file_objs=[file_obj], sync=sync, flush_interval=60, status_interval=60)
+    writer.put([[0.0, 'line']])
+    writer.close()
+    assert file_obj.flushes == flushes
+    assert synced == [99] * fsyncs
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from binary_record import BinaryRecordWriter, open_binary_record
+from serial_ingest import delay_to_rpm, raw_to_weight
+
+CALIBRATION = {'adc1bit': 5.0 / 16777216, 'scale': 0.002 * 5.0 / 20 * 128, 'offset': 140.0}
+
+
+def _write(path, batches, settings=None):
+    writer = BinaryRecordWriter(path, settings=settings or {'memoname': 'テスト'}, calibration=CALIBRATION)
+    for batch in batches:
+        writer.append(*batch)
+    writer.close()
+    return writer
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'run_esp32_data.bin')
+    timestamps = np.arange(0, 50, 10)
+    raw = np.array([-420900, -420910, -420920, 0, 12345])
+    delay = np.array([30000, 30000, 15000, 15000, 0])
+    writer = _write(path, [(1.5, timestamps[:2], raw[:2], delay[:2]),
+                           (np.array([2.0, 2.1, 2.2]), timestamps[2:], raw[2:], delay[2:])])
+    assert writer.count == 5
+
+    record = open_binary_record(path)
+    assert len(record) == 5
+    assert record.settings == {'memoname': 'テスト'}
+    np.testing.assert_array_equal(record.host_time, [1.5, 1.5, 2.0, 2.1, 2.2])
+    np.testing.assert_array_equal(record.timestamp, timestamps)
+    np.testing.assert_array_equal(record.raw, raw)
+    np.testing.assert_array_equal(record.speed_delay, delay)
+    np.testing.assert_allclose(record.weight, raw_to_weight(raw.astype(np.float64), CALIBRATION['adc1bit'],
+                                                            CALIBRATION['scale'], CALIBRATION['offset']))
+    np.testing.assert_allclose(record.speed_rpm, delay_to_rpm(delay))
+
+
+def test_truncated_last_record_is_ignored(tmp_path):
+    path = str(tmp_path / 'run_esp32_data.bin')
+    _write(path, [(0.0, np.arange(3), np.zeros(3), np.full(3, 1000))])
+    with open(path, 'ab') as file_obj:
+        file_obj.write(b'\x00' * 5)
+    assert len(open_binary_record(path)) == 3
+
+
+def test_empty_file_has_no_records(tmp_path):
+    path = str(tmp_path / 'run_esp32_data.bin')
+    _write(path, [])
+    record = open_binary_record(path)
+    assert len(record) == 0
+    assert record.weight.size == 0
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'not_a_record.bin'
+    path.write_bytes(b'NOTUSHI!' + b'\x00' * 64)
+    with pytest.raises(ValueError):
+        open_binary_record(str(path))
+
+
+@pytest.mark.parametrize('timestamps, raw', [([0, -1], [0, 0]), ([0, 2 ** 32], [0, 0]), ([0, 1], [0, 2 ** 31])])
+def test_values_outside_the_column_types_are_rejected(tmp_path, timestamps, raw):
+    path = str(tmp_path / 'run_esp32_data.bin')
+    writer = BinaryRecordWriter(path, settings={}, calibration=CALIBRATION)
+    writer.append(0.0, [2 ** 32 - 1], [-2 ** 31], [0])
+    with pytest.raises(ValueError):
+        writer.append(1.0, np.array(timestamps), np.array(raw), np.array([0, 0]))
+    writer.close()
+    # 桁があふれた値は書かれない
+    assert open_binary_record(path).timestamp.tolist() == [2 ** 32 - 1]
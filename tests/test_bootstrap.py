@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from bootstrap import (bootstrap_exponential, bootstrap_median_cdf, bootstrap_median_tables, draw_bootstrap_medians,
+                       fit_exponential_batch)
+
+
+def _median_distribution(medians, support):
+    return np.array([np.mean(np.isclose(medians, value)) for value in support])
+
+
+@pytest.mark.parametrize('n', [1, 2, 5, 6, 9])
+def test_draw_bootstrap_medians_matches_brute_force_resampling(n):
+    values = np.sort(np.random.default_rng(n).normal(size=n)) * 10
+    count = 200000
+    drawn = draw_bootstrap_medians(values, bootstrap_median_tables(n), np.random.default_rng(0), count)
+    resamples = values[np.random.default_rng(1).integers(0, n, size=(count, n))]
+    brute = np.median(resamples, axis=1)
+    support = np.unique(np.concatenate([drawn, brute]))
+    difference = np.abs(_median_distribution(drawn, support) - _median_distribution(brute, support))
+    assert difference.max() < 0.006
+
+
+def test_bootstrap_median_cdf_is_a_distribution():
+    cdf = bootstrap_median_cdf(7)
+    assert np.all(np.diff(cdf) >= 0)
+    assert cdf[-1] == pytest.approx(1.0)
+    # 中央値の分布は対称
+    np.testing.assert_allclose(np.diff(np.concatenate(([0.0], cdf))), np.diff(np.concatenate(([0.0], cdf)))[::-1])
+
+
+def test_fit_exponential_batch_fits_every_row():
+    x = np.linspace(0, 5, 100)
+    rates = np.array([-0.2, -0.5, -1.0])
+    y = 2 * np.exp(rates[:, None] * x) + 1
+    params, converged = fit_exponential_batch(x, y, b0=-0.4)
+    assert converged.all()
+    np.testing.assert_allclose(params[:, 1], rates, rtol=1e-6)
+    np.testing.assert_allclose(params[:, 0], 2, rtol=1e-6)
+    np.testing.assert_allclose(params[:, 2], 1, rtol=1e-6)
+
+
+def test_bootstrap_interval_covers_the_fit_and_is_reproducible():
+    rng = np.random.default_rng(3)
+    x = np.linspace(0, 5, 200)
+    y = 2 * np.exp(-0.5 * x) + 1 + rng.normal(0, 0.02, len(x))
+    params = (2.0, -0.5, 1.0)
+    first = bootstrap_exponential(x, y, params, n_boot=200, seed=7, workers=1, batch_size=64)
+    second = bootstrap_exponential(x, y, params, n_boot=200, seed=7, workers=1, batch_size=64)
+    np.testing.assert_array_equal(first.samples, second.samples)
+    assert first.failed == 0
+    assert np.all(first.lower <= first.upper)
+    assert first.lower[1] < -0.5 < first.upper[1]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from binary_record import BinaryRecordWriter
+from display_approximation_exponential import iter_data_chunks, load_data_arrays, summarize_data_chunked
+
+CALIBRATION = {'adc1bit': 5.0 / 16777216, 'scale': 0.002 * 5.0 / 20 * 128, 'offset': 140.0}
+
+
+@pytest.fixture
+def bin_path(tmp_path):
+    path = str(tmp_path / 'run_esp32_data.bin')
+    rng = np.random.default_rng(0)
+    delays = np.repeat([30000, 15000, 10000, 7500], 250)
+    raw = (-420000 - delays // 10 + rng.integers(-50, 50, delays.size)).astype(np.int64)
+    writer = BinaryRecordWriter(path, settings={'memoname': 'テスト'}, calibration=CALIBRATION)
+    for start in range(0, delays.size, 64):
+        stop = start + 64
+        writer.append(float(start), np.arange(start, min(stop, delays.size)) * 10, raw[start:stop], delays[start:stop])
+    writer.close()
+    return path
+
+
+def test_chunks_match_in_memory_arrays(bin_path):
+    chunks = list(iter_data_chunks(bin_path, chunk_rows=97))
+    assert len(chunks) == 11
+    for chunked, whole in zip(zip(*chunks), load_data_arrays(bin_path)):
+        np.testing.assert_allclose(np.concatenate(chunked), whole)
+
+
+def test_chunked_medians_match_in_memory_medians(bin_path):
+    timestamps, weights, speeds = load_data_arrays(bin_path)
+    summary = summarize_data_chunked(bin_path, chunk_rows=97)
+    assert summary.count == weights.size
+    np.testing.assert_allclose(summary.unique_speeds, np.unique(speeds))
+    expected = [np.median(weights[speeds == speed]) for speed in np.unique(speeds)]
+    np.testing.assert_allclose(summary.median_weights, expected, rtol=0.002)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from clock_sync import ClockSync
+
+
+def _feed(clock, device_ms, offset, drift, latency_s, batch=10):
+    host_time = offset + (1 + drift) * device_ms / 1000.0 + latency_s
+    for start in range(0, len(device_ms), batch):
+        # 受信スレッドと同じく、まとめて読んだ行には同じ受信時刻が付く
+        rows = slice(start, start + batch)
+        clock.update(host_time[rows].max(), device_ms[rows])
+
+
+def test_offset_and_drift_are_recovered():
+    rng = np.random.default_rng(0)
+    device_ms = np.arange(0, 120000, 10.0)
+    latency = 0.002 + rng.exponential(0.005, len(device_ms))
+    clock = ClockSync()
+    _feed(clock, device_ms, offset=500.0, drift=50e-6, latency_s=latency, batch=1)
+    summary = clock.summary()
+    assert summary['samples'] == len(device_ms)
+    assert summary['drift_ppm'] == pytest.approx(50, abs=5)
+    assert summary['offset_s'] == pytest.approx(500.002, abs=0.002)
+    assert summary['latency_mean_ms'] == pytest.approx(5, abs=1)
+    assert summary['gaps'] == 0
+
+
+def test_device_ms_inverts_the_fitted_clock():
+    device_ms = np.arange(0, 30000, 10.0)
+    clock = ClockSync()
+    assert clock.device_ms(1.0) is None
+    _feed(clock, device_ms, offset=100.0, drift=0.0, latency_s=0.001)
+    host = 100.0 + 12.345 + 0.001
+    assert clock.device_ms(host) == pytest.approx(12345, abs=1)
+
+
+def test_missed_samples_and_backward_steps_are_counted():
+    device_ms = np.concatenate((np.arange(0, 1000, 10.0), np.arange(1050, 2000, 10.0), [100.0, 110.0]))
+    clock = ClockSync()
+    clock.update(0.0, device_ms)
+    summary = clock.summary()
+    assert summary['gaps'] == 1
+    assert summary['missed_samples'] == 5
+    assert summary['max_gap_ms'] == 60
+    assert summary['backward_steps'] == 1
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from exp_fit import MAX_EXPONENT, exponential_jacobian, fit_exponential, initial_estimate
+
+
+def test_recovers_parameters_of_noisy_decay():
+    rng = np.random.default_rng(1)
+    x = np.linspace(10, 100, 50)
+    y = 3 * np.exp(-0.03 * x) + 1 + rng.normal(0, 0.01, len(x))
+    a, b, c = fit_exponential(x, y).params
+    assert a == pytest.approx(3, rel=0.05)
+    assert b == pytest.approx(-0.03, rel=0.05)
+    assert c == pytest.approx(1, abs=0.05)
+
+
+def test_large_x_offset_does_not_overflow():
+    x = np.linspace(1e6, 2e6, 500)
+    y = 30 * np.exp(-3e-6 * (x - 1e6)) + 70
+    with np.errstate(all='raise'):
+        result = fit_exponential(x, y)
+    assert result.params[1] == pytest.approx(-3e-6, rel=1e-6)
+    assert result.params[2] == pytest.approx(70, rel=1e-6)
+
+
+def test_initial_estimate_is_exact_for_exact_data():
+    x = np.linspace(0, 1, 200)
+    a, b, c = initial_estimate(x, 2 * np.exp(-3 * x) + 5)
+    assert b == pytest.approx(-3, rel=1e-3)
+    assert a == pytest.approx(2, rel=1e-2)
+    assert c == pytest.approx(5, rel=1e-2)
+
+
+def test_initial_estimate_falls_back_to_constant_for_flat_data():
+    x = np.linspace(0, 1e6, 100)
+    a, b, c = initial_estimate(x, np.full(len(x), 4.0))
+    assert b == 0.0
+    assert c == pytest.approx(4.0)
+
+
+def test_initial_estimate_bounds_b():
+    x = np.linspace(0, 1, 100)
+    y = np.zeros(len(x))
+    y[-1] = 1e6
+    _, b, _ = initial_estimate(x, y)
+    assert abs(b) <= MAX_EXPONENT
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('offset', [0.0, 1e6])
+def test_flat_noisy_data_is_rejected(seed, offset):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(offset, offset + 1e6, 800)
+    y = 100 + rng.normal(0, 1, len(x))
+    with np.errstate(over='raise'):
+        with pytest.raises(RuntimeError):
+            fit_exponential(x, y)
+
+
+def test_constant_data_is_rejected():
+    with pytest.raises(RuntimeError):
+        fit_exponential(np.arange(10.0), np.full(10, 3.0))
+
+
+def test_jacobian_matches_finite_differences():
+    x = np.linspace(0, 2, 7)
+    params = np.array([1.5, -0.7, 0.3])
+    analytic = exponential_jacobian(x, *params)
+    step = 1e-7
+    for j in range(3):
+        shifted = params.copy()
+        shifted[j] += step
+        numeric = ((shifted[0] * np.exp(shifted[1] * x) + shifted[2])
+                   - (params[0] * np.exp(params[1] * x) + params[2])) / step
+        np.testing.assert_allclose(analytic[:, j], numeric, rtol=1e-5, atol=1e-6)
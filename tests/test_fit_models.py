@@ -0,0 +1,58 @@
+import math
+
+import numpy as np
+import pytest
+
+from fit_models import ModelFitResult, SELECTION_MARGIN, compare_models, fit_model, rank_results
+
+
+def _result(name, k, aic, bic, error=None):
+    return ModelFitResult(name, 'time', '', (), None if error else [0.0] * k, 100, k, 1.0, 0.01, 0.1, 0.9, 0.2,
+                          aic, bic, error)
+
+
+def test_bi_exponential_is_not_ranked_on_a_single_exponential():
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 8000, 800)
+    y = 2.9 * np.exp(1.15e-4 * t) - 3.1 + rng.normal(0, 0.075, len(t))
+    results = compare_models('time', t, y)
+    assert results[0].name == 'exponential'
+    bi = next(result for result in results if result.name == 'bi_exponential')
+    if bi.error is None:
+        a1, b1, a2, b2, _ = bi.params
+        assert not (a1 * a2 < 0 and max(abs(a1), abs(a2)) > 10 * np.ptp(y))
+
+
+def test_bi_exponential_wins_on_two_separated_rates():
+    rng = np.random.default_rng(1)
+    t = np.linspace(0, 10, 600)
+    y = 3 * np.exp(-5 * t) + 2 * np.exp(-0.3 * t) + 1 + rng.normal(0, 0.005, len(t))
+    results = compare_models('time', t, y)
+    assert results[0].name == 'bi_exponential'
+    a1, b1, a2, b2, c = results[0].params
+    assert b1 == pytest.approx(-5, rel=0.05)
+    assert b2 == pytest.approx(-0.3, rel=0.05)
+
+
+def test_too_few_points_is_reported_not_ranked():
+    result = fit_model('time', 'bi_exponential', np.arange(6.0), np.arange(6.0))
+    assert result.error is not None
+    assert math.isinf(result.aic)
+
+
+def test_complex_model_needs_a_margin_to_win():
+    simple = _result('exponential', 3, 0.0, 0.0)
+    complex_ = _result('bi_exponential', 5, -SELECTION_MARGIN / 2, -2 * SELECTION_MARGIN)
+    assert rank_results([complex_, simple])[0] is simple
+
+
+def test_complex_model_wins_with_a_clear_margin():
+    simple = _result('exponential', 3, 0.0, 0.0)
+    complex_ = _result('bi_exponential', 5, -2 * SELECTION_MARGIN, -2 * SELECTION_MARGIN)
+    assert rank_results([simple, complex_])[0] is complex_
+
+
+def test_failed_models_go_last():
+    failed = _result('cross', 4, math.inf, math.inf, error='failed')
+    ranked = rank_results([failed, _result('power_law', 3, 5.0, 5.0), _result('exponential', 3, 1.0, 1.0)])
+    assert [result.name for result in ranked] == ['exponential', 'power_law', 'cross']
@@ -0,0 +1,70 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import Metrics, MetricsExporter
+
+
+def _metrics():
+    metrics = Metrics()
+    metrics.inc('lines_total', 3)
+    metrics.inc('lines_total')
+    metrics.inc('custom_total', 2)
+    metrics.set('writer_queue_depth', 5)
+    metrics.observe('process_batch_seconds', 0.25)
+    metrics.observe('process_batch_seconds', 0.75)
+    return metrics
+
+
+def test_prometheus_text_format():
+    lines = _metrics().prometheus_text().splitlines()
+    assert lines[:3] == ['# HELP ushi_custom_total custom_total', '# TYPE ushi_custom_total counter',
+                         'ushi_custom_total 2']
+    assert lines[3:6] == ['# HELP ushi_lines_total 受信した行数', '# TYPE ushi_lines_total counter',
+                          'ushi_lines_total 4']
+    assert lines[6:9] == ['# HELP ushi_writer_queue_depth 書き込みキューにたまっている件数',
+                          '# TYPE ushi_writer_queue_depth gauge', 'ushi_writer_queue_depth 5']
+    assert lines[9:] == ['# HELP ushi_process_batch_seconds 受信スレッドが1回の読み出し分の行を処理するのにかかった時間',
+                         '# TYPE ushi_process_batch_seconds summary', 'ushi_process_batch_seconds_count 2',
+                         'ushi_process_batch_seconds_sum 1.0', 'ushi_process_batch_seconds_max 0.75']
+    # 説明や種類の行以外は「名前 値」で、値は数値
+    for line in lines:
+        if not line.startswith('#'):
+            name, value = line.split(' ')
+            float(value)
+
+
+def test_snapshot_contents_and_rates():
+    metrics = _metrics()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'lines_total': 4, 'custom_total': 2}
+    assert snapshot['gauges'] == {'writer_queue_depth': 5}
+    assert snapshot['timers'] == {'process_batch_seconds': {'count': 2, 'sum': 1.0, 'mean': 0.5, 'max': 0.75}}
+    assert snapshot['rates']['lines_per_second'] > 0
+    # 2回目の snapshot の rate は前回からの増え方
+    metrics.inc('bytes_total', 10)
+    rates = metrics.snapshot()['rates']
+    assert rates['lines_per_second'] == 0
+    assert rates['bytes_per_second'] > 0
+
+
+def test_exporter_writes_json_and_serves_prometheus(tmp_path, capsys):
+    json_path = str(tmp_path / 'run_esp32_metrics.json')
+    exporter = MetricsExporter(_metrics(), json_path=json_path, port=0, interval=60,
+                               extra=lambda: {'memo': 'テスト'}).start()
+    try:
+        url = f"http://127.0.0.1:{exporter.server.server_address[1]}"
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'ushi_lines_total 4' in response.read().decode('utf-8').splitlines()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        exporter.close()
+    with open(json_path, encoding='utf-8') as file_obj:
+        written = json.load(file_obj)
+    assert written['memo'] == 'テスト'
+    assert written['counters']['lines_total'] == 4
+    assert set(written) >= {'uptime_seconds', 'counters', 'gauges', 'timers', 'rates'}
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from online_stats import OnlineRunStatistics, QuantileSketch, RunningStats
+from step_index import StepIndexBuilder
+
+
+def test_running_stats_matches_numpy():
+    values = np.random.default_rng(0).normal(3, 2, 1000)
+    stats = RunningStats()
+    for chunk in np.array_split(values, 7):
+        stats.update(chunk)
+    other = RunningStats()
+    other.update(values[:10])
+    stats.merge(other)
+    merged = np.concatenate((values, values[:10]))
+    assert stats.count == len(merged)
+    assert stats.mean == pytest.approx(merged.mean())
+    assert stats.std == pytest.approx(merged.std(ddof=1))
+    assert (stats.min, stats.max) == (merged.min(), merged.max())
+
+
+def test_quantile_sketch_relative_error():
+    values = np.random.default_rng(1).lognormal(0, 1, 10000) - 0.5
+    sketch = QuantileSketch()
+    sketch.update(values)
+    for q in (0.1, 0.5, 0.9):
+        exact = np.quantile(values, q, method='lower')
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.003, abs=1e-3)
+
+
+def test_step_counts_match_the_step_index_after_the_motor_stops():
+    delays = [30000, 10000, 6000]
+    stats = OnlineRunStatistics(batch_size=16)
+    index = StepIndexBuilder()
+    rng = np.random.default_rng(2)
+    weights = []
+
+    def receive(rows):
+        speed_delay = np.array(rows)
+        millis = (len(weights) + np.arange(len(rows))) * 10
+        chunk = rng.normal(size=len(rows))
+        weights.extend(chunk)
+        stats.update(millis, chunk, speed_delay)
+        index.update(millis, speed_delay)
+
+    previous = 0
+    for step, delay in enumerate(delays):
+        stats.start_step(step, 10.0 * (step + 1), delay, float(step))
+        index.command(step, 10.0 * (step + 1), delay, float(step))
+        # 速度を変えた直後の数行は前の速度のまま届く
+        receive([previous] * 3 + [delay] * 50)
+        previous = delay
+    stats.finish(0)
+    index.finish(3.0)
+    receive([previous] * 4 + [0] * 20)
+
+    weights = np.array(weights)
+    summaries = stats.summaries()
+    segments = index.segments()
+    assert [summary.count for summary in summaries] == [s.end_row - s.start_row for s in segments]
+    last = segments[-1]
+    assert summaries[-1].count == 54
+    assert summaries[-1].mean == pytest.approx(weights[last.start_row:last.end_row].mean())
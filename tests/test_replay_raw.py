@@ -0,0 +1,71 @@
+import csv
+
+import numpy as np
+
+from replay_raw import hx711_calibration, iter_raw_chunks, memoname_from_raw_path, replay_raw_log, split_raw_line
+
+
+def _write_raw_log(path, rows):
+    with open(path, 'w', newline='') as file_obj:
+        csv_writer = csv.writer(file_obj)
+        csv_writer.writerow(['Timestamp', 'log and response'])
+        csv_writer.writerows(rows)
+
+
+def _raw_rows(garbled=None):
+    rows = [[0, 'settings:'], [0, 'initial_rpm: 10'], [0, 'speed_profile: linear'],
+            [0, 'step 0: rpm 10, delay 30000, start 0 s, duration 1 s'],
+            [1.0, 'speed was set : 30000']]
+    for i in range(20):
+        rows.append([1.0 + i * 0.01, f"[data], {1000 + 10 * i}, -420900, 30000"])
+        if garbled is not None and i == 10:
+            rows.append([1.1, garbled])
+    return rows
+
+
+def test_split_raw_line():
+    assert split_raw_line('1.5,"[data], 1, 2, 3"\r\n') == ('1.5', '[data], 1, 2, 3')
+    assert split_raw_line('1.5,speed was set : 0\n') == ('1.5', 'speed was set : 0')
+    assert split_raw_line('1.5,"a ""quoted"" text"\n') == ('1.5', 'a "quoted" text')
+    assert split_raw_line('1.5,"unterminated\n') is None
+    assert split_raw_line('garbage\n') is None
+
+
+def test_lone_carriage_return_does_not_split_a_record(tmp_path):
+    raw_path = str(tmp_path / '2026-01-01_00-00-00_test_esp32_raw.csv')
+    _write_raw_log(raw_path, _raw_rows(garbled='[data], 11\r05, -4209'))
+    lines = [line for _, chunk in iter_raw_chunks(raw_path) for line in chunk]
+    assert len(lines) == len(_raw_rows()) + 1
+    assert split_raw_line(lines[-10]) == ('1.1', '[data], 11\r05, -4209')
+
+    result = replay_raw_log(raw_path, str(tmp_path / 'out_esp32_data.csv'), hx711_calibration())
+    assert result.error is None
+    assert result.records == 20
+    assert len(result.unrecoverable) == 1
+
+
+def test_replay_recomputes_weights_with_new_calibration(tmp_path):
+    raw_path = str(tmp_path / '2026-01-01_00-00-00_test_esp32_raw.csv')
+    _write_raw_log(raw_path, _raw_rows())
+    calibration = hx711_calibration(offset=0.0)
+    output_path = str(tmp_path / 'out_esp32_data.csv')
+    replay_raw_log(raw_path, output_path, calibration)
+    with open(output_path, newline='') as file_obj:
+        rows = list(csv.DictReader(file_obj))
+    assert [int(row['Timestamp(ESP32)']) for row in rows] == list(range(1000, 1200, 10))
+    expected = 420900 * calibration['adc1bit'] / calibration['scale']
+    np.testing.assert_allclose([float(row['weight']) for row in rows], expected)
+
+
+def test_memoname_strips_the_rig_label(tmp_path):
+    path = str(tmp_path / '2026-01-01_00-00-00_my_memo_ttyUSB0_esp32_raw.csv')
+    assert memoname_from_raw_path(path, 'ttyUSB0') == 'my_memo'
+    assert memoname_from_raw_path(path, 'COM3') == 'my_memo_ttyUSB0'
+
+
+def test_memoname_of_old_multi_rig_logs_uses_siblings(tmp_path):
+    for label in ('sim1', 'sim2'):
+        (tmp_path / f'2026-01-01_00-00-00_memo_{label}_esp32_raw.csv').write_text('')
+    (tmp_path / '2026-01-01_00-00-01_single_run_esp32_raw.csv').write_text('')
+    assert memoname_from_raw_path(str(tmp_path / '2026-01-01_00-00-00_memo_sim1_esp32_raw.csv')) == 'memo'
+    assert memoname_from_raw_path(str(tmp_path / '2026-01-01_00-00-01_single_run_esp32_raw.csv')) == 'single_run'
@@ -0,0 +1,72 @@
+import pytest
+
+from run_queue import load_run_definitions, run_queue
+
+
+def _write(tmp_path, text, name='runs.csv'):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_runs_are_read_in_order(tmp_path):
+    _write(tmp_path, "rpm,seconds\n10,2\n30,1.5\n", 'table.csv')
+    path = _write(tmp_path, "\ufeffinitial_rpm,final_rpm,planned_steps,operation_during,memo,profile\n"
+                            "# コメント行\n"
+                            "10,100,4,60,slow,\n"
+                            "10,1000,3,40,,log\n"
+                            ",,,,from table,table.csv\n")
+    runs = load_run_definitions(path)
+    assert [run['memoname'] for run in runs] == ['slow', 'run2', 'from table']
+    assert runs[0] == dict(initial_rpm=10, final_rpm=100, planned_steps=4, operation_during=60, memoname='slow',
+                           profile_kind='linear', profile_table=None)
+    assert runs[1]['profile_kind'] == 'log'
+    assert runs[2]['profile_kind'] == 'table'
+    assert [(step.rpm, step.duration) for step in runs[2]['profile_table']] == [(10, 2), (30, 1.5)]
+
+
+def test_missing_columns_are_reported(tmp_path):
+    path = _write(tmp_path, "initial_rpm,final_rpm,memo\n10,100,a\n")
+    with pytest.raises(ValueError, match='planned_steps, operation_during'):
+        load_run_definitions(path)
+
+
+@pytest.mark.parametrize('row, message', [
+    ("10,100,four,60,a", "5行目: planned_steps は整数"),
+    ("10,-100,4,60,a", "5行目: final_rpm に負数"),
+    ("0,100,4,60,a,log", "5行目: 対数で速度を変える場合"),
+    (",,,,a,missing.csv", "5行目: 速度の表を読めません"),
+])
+def test_bad_rows_report_the_line_in_the_file(tmp_path, row, message):
+    # コメント行を飛ばしても、ファイル上の行番号を示す
+    path = _write(tmp_path, "initial_rpm,final_rpm,planned_steps,operation_during,memo,profile\n"
+                            "# 1つ目\n10,100,4,60,ok\n# 2つ目\n" + row + "\n")
+    with pytest.raises(ValueError, match=message):
+        load_run_definitions(path)
+
+
+class FakeCollector:
+    def __init__(self, failing):
+        self.failing = failing
+        self.completed = []
+
+    def configure(self, memoname, **kwargs):
+        if memoname in self.failing:
+            raise ValueError(f"{memoname} は設定できません")
+        self.memoname = memoname
+        self.profile_kind = kwargs['profile_kind']
+        self.operation_during = kwargs['operation_during']
+
+    def run_headless(self, directory_name, file_prefix, close_port=True, save_image=True):
+        assert close_port is False
+        self.completed.append(self.memoname)
+
+
+def test_run_queue_keeps_going_after_a_failed_run(tmp_path, capsys):
+    path = _write(tmp_path, "initial_rpm,final_rpm,planned_steps,operation_during,memo\n"
+                            "10,100,4,60,a\n10,100,4,60,b\n10,100,4,60,c\n")
+    collector = FakeCollector(failing={'b'})
+    results = run_queue(collector, load_run_definitions(path), str(tmp_path))
+    assert collector.completed == ['a', 'c']
+    assert [(memo, error) for memo, _, error in results] == [('a', None), ('b', 'b は設定できません'), ('c', None)]
+    assert 'エラー: 計測 b を中断しました' in capsys.readouterr().out
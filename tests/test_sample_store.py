@@ -0,0 +1,80 @@
+import numpy as np
+
+from sample_store import SampleStore, read_spill_file
+
+
+def _columns(indices):
+    indices = np.asarray(indices)
+    return 100.0 + indices, indices, 0.5 * indices, indices % 7, 2.0 * indices
+
+
+def _append(store, start, count):
+    host_time, timestamp, weight, speed_delay, speed = _columns(np.arange(start, start + count))
+    store.append_many(host_time, timestamp, weight, speed_delay, speed)
+
+
+def _assert_rows_consistent(snapshot):
+    expected = _columns(snapshot.timestamp)
+    for column, values in zip((snapshot.host_time, snapshot.timestamp, snapshot.weight, snapshot.speed_delay,
+                               snapshot.speed), expected):
+        np.testing.assert_array_equal(column, values)
+    np.testing.assert_array_equal(snapshot.timestamp,
+                                  np.arange(snapshot.start_index, snapshot.start_index + len(snapshot.timestamp)))
+
+
+def test_snapshot_after_wrap_keeps_the_newest_rows():
+    store = SampleStore(capacity=8)
+    for start, count in ((0, 5), (5, 6), (11, 9)):
+        _append(store, start, count)
+    snapshot = store.snapshot()
+    assert (snapshot.start_index, len(snapshot.timestamp), store.total_count) == (12, 8, 20)
+    _assert_rows_consistent(snapshot)
+    last = store.snapshot(last=3)
+    assert last.timestamp.tolist() == [17, 18, 19]
+    _assert_rows_consistent(last)
+
+
+def test_snapshot_drops_rows_overwritten_during_the_copy(monkeypatch):
+    store = SampleStore(capacity=8)
+    _append(store, 0, 10)
+    copy_range = store._copy_range
+    copied = []
+
+    def copy_while_writing(column, start, end):
+        copied.append(column)
+        if len(copied) == 2:
+            # 2列目をコピーしている途中で書き込み手が3行上書きする
+            _append(store, 10, 3)
+        return copy_range(column, start, end)
+
+    monkeypatch.setattr(store, '_copy_range', copy_while_writing)
+    snapshot = store.snapshot()
+    # コピーを始めたときの 2..9 のうち、上書きされた 2..4 は捨てられる
+    assert snapshot.start_index == 5
+    assert snapshot.timestamp.tolist() == list(range(5, 10))
+    _assert_rows_consistent(snapshot)
+
+
+def test_spilled_and_kept_rows_cover_every_sample(tmp_path):
+    spill_path = str(tmp_path / 'spill.bin')
+    store = SampleStore(capacity=8, spill_path=spill_path)
+    start = 0
+    for count in (3, 6, 1, 20, 4):
+        _append(store, start, count)
+        start += count
+    for index in range(start, start + 5):
+        store.append(*(column[0] for column in _columns([index])))
+    start += 5
+    snapshot = store.snapshot()
+    store.close()
+
+    spilled = read_spill_file(spill_path)
+    assert len(spilled) == store.spilled_count == start - 8
+    host_time, timestamp, weight, speed_delay, speed = _columns(np.arange(start - 8))
+    np.testing.assert_array_equal(spilled['host_time'], host_time)
+    np.testing.assert_array_equal(spilled['timestamp'], timestamp)
+    np.testing.assert_array_equal(spilled['weight'], weight)
+    np.testing.assert_array_equal(spilled['speed_delay'], speed_delay)
+    np.testing.assert_array_equal(spilled['speed'], speed)
+    assert snapshot.start_index == start - 8
+    _assert_rows_consistent(snapshot)
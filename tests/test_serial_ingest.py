@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from esp32_simulator import SimulatedESP32
+from serial_ingest import parse_data_line, parse_data_lines
+from USHI_seigyo2 import DataCollector
+
+LINES = [
+    "[data],10,-420000,30000",
+    "[data], 20 , -420010 , 30000",
+    "[data],30,-420020,30000,extra",
+    "[data],40,-420030",
+    "[data],50,,30000",
+    "[data],60,-420050,fast",
+    "[data],70,99999999999999999999,30000",
+    "[data],-1,-420070,30000",
+    "[data],4294967296,-420080,30000",
+    "[data],4294967295,-420090,30000",
+    "speed was set : 15000",
+    "[data],80,+420060,15000",
+]
+
+
+def test_bulk_and_single_line_parsing_accept_the_same_lines():
+    expected = [parse_data_line(line) for line in LINES if '[data]' in line]
+    millis, raw, delay, malformed = parse_data_lines(LINES)
+    assert list(zip(millis.tolist(), raw.tolist(), delay.tolist())) == [record for record in expected if record]
+    assert malformed == expected.count(None) == 7
+    # 壊れた行がなければ一括変換の経路を通る
+    millis, raw, delay, malformed = parse_data_lines([LINES[0], LINES[1], LINES[-1]])
+    assert (millis.tolist(), raw.tolist(), delay.tolist(), malformed) == \
+        ([10, 20, 80], [-420000, -420010, 420060], [30000, 30000, 15000], 0)
+    # フィールドの数がそろっていても、ESP32 の型の範囲の外の値は壊れた行として数える
+    millis, _, _, malformed = parse_data_lines(["[data],-1,0,0", "[data],1,0,0", "[data],2,0,2147483648"])
+    assert (millis.tolist(), malformed) == ([1], 2)
+
+
+@pytest.fixture
+def collector(tmp_path, capsys):
+    collectors = []
+
+    def make():
+        collector = DataCollector(ser=SimulatedESP32(seed=0), binary_record=False)
+        collector.configure(10, 100, 2, 1, 'test')
+        directory = str(tmp_path / f'run{len(collectors)}')
+        collector.raw_csv_writer, raw_file = collector.create_csv_file(directory, 'raw.csv')
+        collector.data_csv_writer, data_file = collector.create_csv_file(directory, 'data.csv')
+        collector.open_record_writer([raw_file, data_file])
+        collectors.append((collector, raw_file, data_file))
+        return collector
+
+    yield make
+    for collector, raw_file, data_file in collectors:
+        collector.record_writer.close()
+        raw_file.close()
+        data_file.close()
+
+
+def test_process_response_and_process_lines_share_the_rule(collector):
+    single, bulk = collector(), collector()
+    for line in LINES:
+        single.process_response(1.0, line)
+    bulk.process_lines(1.0, LINES)
+    for name in ('data_records_total', 'malformed_records_total'):
+        assert single.metrics.counters[name] == bulk.metrics.counters[name]
+    np.testing.assert_array_equal(single.samples.snapshot().timestamp, bulk.samples.snapshot().timestamp)
+    np.testing.assert_allclose(single.samples.snapshot().weight, bulk.samples.snapshot().weight)
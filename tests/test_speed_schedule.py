@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+import speed_schedule
+from speed_schedule import SpeedScheduler, linear_profile, rpm_to_motor_delay, table_profile
+
+
+class FakeClock:
+    """ perf_counter / sleep と Event.wait の待ち時間だけ進む時計 """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 1e-5)
+
+
+class FakeEvent:
+    def __init__(self, clock):
+        self.clock = clock
+        self.flag = False
+
+    def set(self):
+        self.flag = True
+
+    def is_set(self):
+        return self.flag
+
+    def wait(self, timeout):
+        if not self.flag:
+            self.clock.now += timeout
+        return self.flag
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(speed_schedule, 'time', clock)
+    return clock
+
+
+def _scheduler(clock, profile, on_dispatch=None):
+    calls = []
+
+    def dispatch(step):
+        calls.append(('dispatch', step, clock.now))
+        if on_dispatch is not None:
+            on_dispatch(step)
+
+    scheduler = SpeedScheduler(profile, dispatch, lambda: calls.append(('finish', None, clock.now)), clock.now)
+    scheduler.stop_event = FakeEvent(clock)
+    return scheduler, calls
+
+
+def test_steps_are_dispatched_in_order_on_their_deadlines(clock):
+    profile = table_profile([(10, 2.0), (20, 1.0), (0, 0.5), (40, 3.0)])
+    start = clock.now
+    scheduler, calls = _scheduler(clock, profile)
+    scheduler.start()
+    assert scheduler.finished.wait(5)
+    scheduler.thread.join(5)
+    assert not scheduler.thread.is_alive()
+
+    assert [(kind, step) for kind, step, _ in calls] == [('dispatch', 0), ('dispatch', 1), ('dispatch', 2),
+                                                         ('dispatch', 3), ('finish', None)]
+    for (_, _, time_called), deadline in zip(calls, [0.0, 2.0, 3.0, 3.5, 6.5]):
+        assert start + deadline <= time_called < start + deadline + 1e-3
+    assert [d.motor_delay for d in scheduler.dispatches] == [rpm_to_motor_delay(rpm) for rpm in (10, 20, 0, 40)]
+    assert scheduler.end_dispatch.step == 4
+    max_jitter, mean_jitter = scheduler.jitter_summary()
+    assert 0 <= mean_jitter <= max_jitter < 1e-3
+
+
+def test_stop_skips_the_remaining_steps_and_finish(clock):
+    scheduler, calls = _scheduler(clock, linear_profile(10, 100, 4, 10.0),
+                                  on_dispatch=lambda step: step == 1 and scheduler.stop_event.set())
+    scheduler.start()
+    assert scheduler.finished.wait(5)
+    scheduler.thread.join(5)
+    assert not scheduler.thread.is_alive()
+    assert [(kind, step) for kind, step, _ in calls] == [('dispatch', 0), ('dispatch', 1)]
+    assert scheduler.end_dispatch is None
+
+
+def test_stop_wakes_a_waiting_scheduler():
+    dispatched = threading.Event()
+    finished = []
+    scheduler = SpeedScheduler(linear_profile(10, 100, 2, 60.0), lambda step: dispatched.set(),
+                               lambda: finished.append(True), speed_schedule.time.perf_counter()).start()
+    assert dispatched.wait(5)
+    scheduler.stop()
+    assert scheduler.finished.is_set()
+    assert not scheduler.thread.is_alive()
+    assert len(scheduler.dispatches) == 1
+    assert not finished
+
+
+def test_write_csv_lists_every_dispatch_and_the_stop(clock, tmp_path):
+    scheduler, _ = _scheduler(clock, table_profile([(10, 1.0), (20, 1.0)]))
+    scheduler.start()
+    scheduler.finished.wait(5)
+    path = tmp_path / 'schedule.csv'
+    scheduler.write_csv(str(path))
+    rows = path.read_text().splitlines()
+    assert rows[0].split(',') == speed_schedule.SCHEDULE_COLUMNS
+    assert [row.split(',')[0] for row in rows[1:]] == ['0', '1', '2']
@@ -0,0 +1,113 @@
+import numpy as np
+
+from step_index import (StepIndexBuilder, StepSegment, index_matches_data, load_step_index, parse_ack_delay,
+                        segment_slices, write_step_index)
+
+
+class _Clock:
+    """ PC の時刻（秒）と millis() が一致する時計 """
+
+    def device_ms(self, host_time):
+        return host_time * 1000.0
+
+
+def _segment(step, start_row, end_row, start_timestamp, end_timestamp):
+    return StepSegment(step, 10.0 * (step + 1), 1000, start_row, end_row, None, None, start_timestamp,
+                       end_timestamp)
+
+
+def test_parse_ack_delay():
+    assert parse_ack_delay("speed was set : 3000") == 3000
+    assert parse_ack_delay("speed was set : x") is None
+    assert parse_ack_delay("[data],1,2,3") is None
+
+
+def test_step_starts_where_delay_changes():
+    builder = StepIndexBuilder()
+    builder.command(0, 10.0, 3000, 0.0)
+    builder.command(1, 20.0, 1500, 0.1)
+    millis = np.arange(0, 100, 10)
+    builder.update(millis, [3000] * 4 + [1500] * 6)
+    segments = builder.segments()
+    assert [(s.start_row, s.end_row) for s in segments] == [(0, 4), (4, 10)]
+    assert segments[0].end_timestamp == 30
+    assert segments[1].start_timestamp == 40
+
+
+def test_equal_delay_step_is_anchored_on_the_ack_time():
+    builder = StepIndexBuilder(clock=_Clock())
+    builder.command(0, 10.0, 3000, 0.0)
+    builder.acknowledge(0.0, 3000)
+    builder.update(np.arange(0, 50, 10), [3000] * 5)
+    # delay が変わらない2つの段階の応答が、同じまとまりの行の途中の時刻に来る
+    builder.command(1, 10.0, 3000, 0.05)
+    builder.command(2, 10.0, 3000, 0.08)
+    builder.acknowledge(0.065, 3000)
+    builder.acknowledge(0.085, 3000)
+    builder.update(np.arange(50, 120, 10), [3000] * 7)
+    segments = builder.segments()
+    assert [(s.start_row, s.end_row) for s in segments] == [(0, 7), (7, 9), (9, 12)]
+    assert [s.start_timestamp for s in segments] == [0, 70, 90]
+    assert index_matches_data(segments, 12, np.arange(0, 120, 10))
+
+
+def test_equal_delay_step_waits_for_its_ack():
+    builder = StepIndexBuilder(clock=_Clock())
+    builder.command(0, 10.0, 3000, 0.0)
+    builder.acknowledge(0.0, 3000)
+    builder.command(1, 10.0, 3000, 0.02)
+    builder.update(np.arange(0, 50, 10), [3000] * 5)
+    assert [(s.start_row, s.end_row) for s in builder.segments()] == [(0, 5)]
+    builder.acknowledge(0.055, 3000)
+    builder.update(np.arange(50, 100, 10), [3000] * 5)
+    assert [(s.start_row, s.end_row) for s in builder.segments()] == [(0, 6), (6, 10)]
+
+
+def test_zero_length_segment_does_not_invalidate_the_index():
+    timestamps = np.arange(0, 300, 10)
+    segments = [_segment(0, 0, 10, 0, 90), _segment(1, 10, 10, 100, 90), _segment(2, 10, 30, 100, 290)]
+    assert index_matches_data(segments, 30, timestamps)
+    sliced = [(segment.step, rows) for segment, rows in segment_slices(segments, timestamps)]
+    assert sliced == [(0, slice(0, 10)), (2, slice(10, 30))]
+
+
+def test_overlapping_segments_invalidate_the_index():
+    segments = [_segment(0, 0, 10, 0, 90), _segment(1, 5, 30, 50, 290)]
+    assert not index_matches_data(segments, 30)
+    assert not index_matches_data([_segment(0, 0, 40, 0, 390)], 30)
+
+
+def test_dropped_rows_are_detected_from_boundary_timestamps():
+    segments = [_segment(0, 0, 10, 0, 90), _segment(1, 10, 20, 100, 190)]
+    timestamps = np.delete(np.arange(0, 210, 10), 3)
+    assert not index_matches_data(segments, len(timestamps), timestamps)
+
+
+def test_settle_seconds_skip_the_start_of_each_step():
+    timestamps = np.arange(0, 4000, 100)
+    segments = [_segment(0, 0, 20, 0, 1900), _segment(1, 20, 40, 2000, 3900)]
+    sliced = [rows for _, rows in segment_slices(segments, timestamps, settle_seconds=0.5)]
+    assert sliced == [slice(5, 20), slice(25, 40)]
+    # 分割して読んだ後半だけ
+    sliced = [rows for _, rows in segment_slices(segments, timestamps[30:], row_offset=30)]
+    assert sliced == [slice(0, 10)]
+
+
+def test_write_and_load_round_trip(tmp_path):
+    data_path = str(tmp_path / 'run_esp32_data.bin')
+    segments = [StepSegment(0, 10.0, 30000, 0, 10, 1.5, 1.52, 0, 90),
+                StepSegment(1, 20.0, 15000, 10, 20, None, None, None, None)]
+    write_step_index(str(tmp_path / 'run_esp32_steps.csv'), segments)
+    assert load_step_index(data_path) == segments
+    assert load_step_index(str(tmp_path / 'other_esp32_data.csv')) is None
+
+
+def test_lost_ack_falls_back_to_the_next_processed_row():
+    builder = StepIndexBuilder(clock=_Clock())
+    builder.command(0, 10.0, 3000, 0.0)
+    builder.acknowledge(0.0, 3000)
+    builder.command(1, 10.0, 3000, 0.02)
+    builder.command(2, 20.0, 1500, 0.04)
+    builder.acknowledge(0.045, 1500)
+    builder.update(np.arange(0, 100, 10), [3000] * 5 + [1500] * 5)
+    assert [(s.start_row, s.end_row) for s in builder.segments()] == [(0, 0), (0, 5), (5, 10)]